@@ -0,0 +1,216 @@
+import os
+import random
+import argparse
+import multiprocessing
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+from data_statistics import RunningMoments
+from sharded_dataset import ShardWriter
+
+"""
+Preprocessing script for IAM-OnDB handwriting data.
+
+You can download the `lineStrokes` directory of IAM-OnDB from http://www.fki.inf.unibe.ch/databases/iam-on-line-handwriting-database
+The `source` directory must be in PYTHONPATH (i.e., for `data_statistics` and `sharded_dataset`).
+
+- Stroke xml files are parsed by a pool of `num_workers` processes. A handwriting line is represented by (seq_len, 3)
+samples of <x,y> pen position and binary pen event, which is 1 for the last point of a stroke (i.e., pen-up).
+- `origin_translation`, `scale` and `relative_representation` are applied on the whole sample at once.
+- Samples are streamed into ragged sharded datasets (see `source/sharded_dataset.py`) in the file order. Training
+statistics (i.e., channel statistics and sequence statistics where every sample has the same weight) are accumulated in
+the same pass. The validation split is normalized with the training statistics.
+- The pen event is not normalized, i.e., its mean and std entries are 0 and 1, respectively.
+- Samples can be stored in float16 (`--sample_dtype float16`) to halve the disk and memory usage. They are converted into
+float32 when they are fed to the model.
+
+Example run command:
+    python preprocess_iamondb.py --data_path <>/lineStrokes --output_dir ./data_iamondb --num_workers 16
+"""
+
+OUTPUT_FILE = "iamondb_stcn"
+PREPROCESSING = ['origin_translation', 'scale', 'relative_representation']
+
+
+def list_stroke_files(data_path):
+    """
+    Returns sorted paths of the stroke xml files under `data_path`.
+    """
+    stroke_files = []
+    for root, dir_names, file_names in os.walk(data_path):
+        for file_name in file_names:
+            if file_name.lower().endswith('.xml'):
+                stroke_files.append(os.path.join(root, file_name))
+    return sorted(stroke_files)
+
+
+def parse_strokes(path):
+    """
+    Parses a stroke xml file.
+
+    Args:
+        path (str): path to the xml file.
+
+    Returns:
+        (np.ndarray): (seq_len, 3) float32 array of absolute <x,y> positions and pen events.
+    """
+    stroke_set = ElementTree.parse(path).getroot().find('StrokeSet')
+    if stroke_set is None:
+        raise Exception("StrokeSet not found in " + path)
+
+    points = [(point.get('x'), point.get('y')) for stroke in stroke_set.iter('Stroke') for point in stroke.iter('Point')]
+    stroke_lens = [sum(1 for _ in stroke.iter('Point')) for stroke in stroke_set.iter('Stroke')]
+
+    sample = np.zeros((len(points), 3), dtype=np.float32)
+    if len(points) > 0:
+        sample[:, 0:2] = np.array(points, dtype=np.float32)
+        # Pen-up at the last point of every (non-empty) stroke.
+        stroke_ends = np.cumsum(stroke_lens)[np.array(stroke_lens) > 0] - 1
+        sample[stroke_ends, 2] = 1
+    return sample
+
+
+def origin_translation(sample):
+    """
+    Translates the sample such that the first point is at the origin.
+    """
+    sample = sample.copy()
+    sample[:, 0:2] -= sample[0, 0:2]
+    return sample
+
+
+def scale(sample, scale_factor):
+    """
+    Divides the pen positions by `scale_factor`.
+    """
+    sample = sample.copy()
+    sample[:, 0:2] /= scale_factor
+    return sample
+
+
+def relative_representation(sample):
+    """
+    Replaces the pen positions with the offsets from the previous point. The first point has zero offset.
+    """
+    sample = sample.copy()
+    sample[:, 0:2] = np.diff(sample[:, 0:2], axis=0, prepend=sample[0:1, 0:2])
+    return sample
+
+
+def preprocess_file(path, scale_factor=1.0):
+    """
+    Parses a stroke xml file and applies the preprocessing steps.
+
+    Returns:
+        (np.ndarray): (seq_len, 3) float32 sample, or None if the file has fewer than 2 points.
+    """
+    sample = parse_strokes(path)
+    if len(sample) < 2:
+        return None
+    return relative_representation(scale(origin_translation(sample), scale_factor))
+
+
+def _preprocess_file_worker(args):
+    return preprocess_file(*args)
+
+
+class SequenceStatistics(object):
+    """
+    Per-channel mean and std where every sequence has the same weight, i.e., the mean of sequence means and the square
+    root of the mean of sequence second moments minus the squared mean.
+    """
+    def __init__(self):
+        self.sequence_means = RunningMoments(axis=0)
+        self.sequence_squares = RunningMoments(axis=0)
+
+    def update(self, sample):
+        sample = sample.astype(np.float64)
+        self.sequence_means.update(sample.mean(axis=0, keepdims=True))
+        self.sequence_squares.update(np.square(sample).mean(axis=0, keepdims=True))
+
+    def statistics(self):
+        mean = self.sequence_means.mean
+        std = np.sqrt(np.maximum(self.sequence_squares.mean - np.square(mean), 0))
+        std[np.where(std < 1e-6)] = 1.0
+        return dict(mean_sequence=mean.tolist(), std_sequence=std.tolist())
+
+
+def preprocess_iamondb(data_path, output_dir, num_workers=None, validation_fraction=0.05, scale_factor=1.0,
+                       shard_size=1024, sample_dtype='float32', seed=1):
+    """
+    Creates the training and validation splits.
+
+    Args:
+        data_path (str): `lineStrokes` directory.
+        output_dir (str): destination of the dataset directories.
+        num_workers (int): number of parsing processes. If None, the number of cores.
+        validation_fraction (float): fraction of the files in the validation split.
+        scale_factor (float): pen positions are divided by `scale_factor`.
+        shard_size (int): number of samples per shard.
+        sample_dtype (str): storage type of the samples, float32 or float16.
+        seed (int): seed of the split.
+
+    Returns:
+        (dict): training statistics.
+    """
+    stroke_files = list_stroke_files(data_path)
+    if len(stroke_files) == 0:
+        raise Exception("No stroke files found in " + data_path)
+    random.Random(seed).shuffle(stroke_files)
+    num_validation = int(len(stroke_files)*validation_fraction)
+    splits = [("training", sorted(stroke_files[num_validation:])), ("validation", sorted(stroke_files[:num_validation]))]
+    print("NUMBER OF TRAIN FILES", len(splits[0][1]))
+    print("NUMBER OF VALID FILES", len(splits[1][1]))
+
+    quantization = dict(dtype=sample_dtype, scale=1.0, offset=0.0) if sample_dtype != 'float32' else None
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        # Both splits are parsed by the same imap call, i.e., validation files are parsed while the training split is
+        # finalized.
+        samples = pool.imap(_preprocess_file_worker, [(path, scale_factor) for _, files in splits for path in files], chunksize=16)
+        statistics = None
+        for split_name, files in splits:
+            writer = ShardWriter(os.path.join(output_dir, OUTPUT_FILE + "_" + split_name), shard_size=shard_size,
+                                 ragged=True, compute_statistics=statistics is None, preprocessing=PREPROCESSING,
+                                 quantization=quantization, scale_factor=scale_factor)
+            sequence_statistics = SequenceStatistics()
+            num_samples = 0
+            for _ in files:
+                sample = next(samples)
+                if sample is None:
+                    continue
+                writer.add(samples=sample)
+                if statistics is None:
+                    sequence_statistics.update(sample)
+                num_samples += 1
+
+            if statistics is None:
+                statistics = writer.accumulated_statistics()
+                if statistics is None:
+                    raise Exception("No training samples found in " + data_path)
+                statistics.update(sequence_statistics.statistics())
+                for key in ['mean_channel', 'mean_sequence']:
+                    statistics[key][2] = 0.0
+                for key in ['std_channel', 'std_sequence']:
+                    statistics[key][2] = 1.0
+            writer.set_statistics(statistics)
+            writer.close()
+            print("# {} samples: {}".format(split_name, num_samples))
+    finally:
+        pool.terminate()
+    return statistics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', required=True, type=str, help='Path to the lineStrokes directory.')
+    parser.add_argument('--output_dir', required=True, type=str, help='Destination of the dataset directories.')
+    parser.add_argument('--num_workers', type=int, default=None, help='Number of parsing processes. Default is the number of cores.')
+    parser.add_argument('--validation_fraction', type=float, default=0.05, help='Fraction of the files in the validation split.')
+    parser.add_argument('--scale_factor', type=float, default=1.0, help='Pen positions are divided by this factor.')
+    parser.add_argument('--shard_size', type=int, default=1024, help='Number of samples per shard.')
+    parser.add_argument('--sample_dtype', type=str, default='float32', choices=['float32', 'float16'], help='Storage type of the samples.')
+    args = parser.parse_args()
+
+    preprocess_iamondb(args.data_path, args.output_dir, args.num_workers, args.validation_fraction, args.scale_factor,
+                       args.shard_size, args.sample_dtype)
@@ -0,0 +1,73 @@
+import os
+import argparse
+
+from tf_benchmark import find_config_files, benchmark_xla, benchmark_fused_gate, benchmark_gated_block, benchmark_shared_trunk
+from tf_benchmark import benchmark_space_to_batch, benchmark_dilated_conv, benchmark_vrnn_input_layer, benchmark_rnn_layer
+from tf_benchmark import benchmark_recompute
+from configuration_ink import InkConfiguration as Configuration
+
+"""
+Benchmarks training steps of the shipped configurations with synthetic handwriting data. Samples consist of <x,y> pen
+position and binary pen-event.
+
+Example run command to compare training with and without XLA JIT compilation:
+    python run_benchmark.py --benchmark xla
+    python run_benchmark.py --benchmark xla --json_file ./config_iamondb/stcn_dense_gmm.json --sequence_length 300
+
+Example run command to compare separate and fused filter/gate convolutions in a temporal block and in full models:
+    python run_benchmark.py --benchmark gated_block
+    python run_benchmark.py --benchmark fused_gate
+
+Example run command to compare separate and shared mu/sigma networks of 5-layer ladder latent layers:
+    python run_benchmark.py --benchmark shared_trunk
+
+Example run command to compare dilated and space-to-batch convolutions for the dilation sizes of the configurations and
+in full models:
+    python run_benchmark.py --benchmark dilated_conv
+    python run_benchmark.py --benchmark space_to_batch
+
+Example run command to compare applying the VRNN input layer at every step and on the whole sequence before the
+recurrence:
+    python run_benchmark.py --benchmark vrnn_input
+
+Example run command to compare sequences/sec of step-wise and fused LSTM layers on CPU:
+    python run_benchmark.py --benchmark rnn_layer
+
+Example run command to check the gradients of temporal blocks with recomputed activations and compare their step time and memory:
+    python run_benchmark.py --benchmark recompute
+"""
+
+BENCHMARKS = {'xla': benchmark_xla,
+              'fused_gate': benchmark_fused_gate,
+              'shared_trunk': benchmark_shared_trunk,
+              'space_to_batch': benchmark_space_to_batch,
+              'dilated_conv': benchmark_dilated_conv,
+              'vrnn_input': benchmark_vrnn_input_layer,
+              'recompute': benchmark_recompute}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', type=str, default='xla', choices=list(BENCHMARKS.keys()) + ['gated_block', 'rnn_layer'], help='Benchmark to run. `gated_block` and `rnn_layer` are micro-benchmarks of a single temporal block and an LSTM layer, respectively.')
+    parser.add_argument('--json_file', type=str, default=None, help='Path to a configuration. If not set, all configurations in config_* folders are used.')
+    parser.add_argument('--sequence_length', type=int, default=300, help='Number of time-steps per sample.')
+    parser.add_argument('--num_steps', type=int, default=50, help='Number of timed training steps.')
+    args = parser.parse_args()
+
+    if args.benchmark == 'gated_block':
+        benchmark_gated_block(sequence_length=args.sequence_length, num_steps=args.num_steps)
+        exit()
+    if args.benchmark == 'rnn_layer':
+        benchmark_rnn_layer(sequence_length=args.sequence_length, num_steps=args.num_steps)
+        exit()
+
+    if args.json_file is not None:
+        config_paths = [args.json_file]
+    else:
+        config_paths = find_config_files(os.path.dirname(os.path.abspath(__file__)))
+
+    BENCHMARKS[args.benchmark](Configuration, config_paths,
+                               input_dims=[3],
+                               target_dims=[2, 1],
+                               sequence_length=args.sequence_length,
+                               num_steps=args.num_steps)
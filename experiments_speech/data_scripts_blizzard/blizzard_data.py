@@ -7,6 +7,7 @@ import numpy as np
 import scipy.signal
 from multiprocessing import Process, Queue
 from numpy.lib.stride_tricks import as_strided
+from data_statistics import hdf5_moments
 
 """
 Taken from https://github.com/jych/nips2015_vrnn/
@@ -130,6 +131,48 @@ def segment_axis(a, length, overlap=0, axis=None, end='cut', endvalue=0):
                      a.strides[axis+1:]
         return as_strided(a, strides=newstrides, shape=newshape)
 
+def frame_batch(batch, frame_size, overlap=0, window=None):
+    """
+    Frames every example of a (batch_size, T) array at once by using stride tricks, and applies the window by
+    broadcasting. Equivalent to `window * segment_axis(x, frame_size, overlap, end='pad')` for every example x.
+    Parameters
+    ----------
+    batch      : (batch_size, T) ndArray
+    frame_size : int
+    overlap    : int
+    window     : (1, frame_size) ndArray or None
+    Returns
+    -------
+    (batch_size, num_frames, frame_size) ndArray
+    """
+    frames = segment_axis(batch, frame_size, overlap, axis=1, end='pad')
+    if window is not None:
+        frames = window * frames
+    return frames
+
+
+def log_magnitude_concatenate(X):
+    """
+    Fuses `Blizzard.log_magnitude` and `Blizzard.concatenate`: the complex spectrum is mapped to log10(|X| + 1) with
+    the same phase, and the real and imaginary parts are written into the halves of a float32 array directly
+    instead of the row-wise `complex_to_real` and reshape copies.
+    Parameters
+    ----------
+    X : (..., num_bins) complex ndArray
+    Returns
+    -------
+    (..., 2*num_bins) float32 ndArray
+    """
+    mag, phase = R2P(X)
+    X_log = P2R(np.log10(mag + 1.), phase)
+    num_bins = X.shape[-1]
+
+    new_X = np.empty(X.shape[:-1] + (2*num_bins,), dtype=np.float32)
+    new_X[..., :num_bins] = X_log.real
+    new_X[..., num_bins:] = X_log.imag
+    return new_X
+
+
 def complex_to_real(X):
     """
     WRITEME
@@ -149,6 +192,30 @@ def complex_to_real(X):
 
 
 
+def segment_tbptt_group(signals, sz=8000, batch_size=100):
+    """
+    Concatenates a group of signals and segments them into rows of `sz` samples for truncated BPTT, as in
+    `fetch_blizzard_tbptt`: the concatenated signal is split into `batch_size` streams of equal length and consecutive
+    blocks of `batch_size` rows continue the same streams.
+    Parameters
+    ----------
+    signals    : list of 1D int16 ndArrays
+    sz         : int
+        Number of samples per row.
+    batch_size : int
+        Number of parallel streams.
+    Returns
+    -------
+    (num_rows, sz) ndArray, where num_rows is a multiple of batch_size.
+    """
+    large_d = np.concatenate(signals)
+    chunk_size = len(large_d) // batch_size
+    seg_d = large_d[:chunk_size*batch_size].reshape(batch_size, chunk_size)
+    num_batch = max(0, (chunk_size - 1) // sz)
+    rows = seg_d[:, :num_batch*sz].reshape(batch_size, num_batch, sz)
+    return rows.transpose(1, 0, 2).reshape(-1, sz)
+
+
 class _blizzardEArray(tables.EArray):
     pass
 
@@ -218,7 +285,12 @@ def fetch_blizzard(data_path, shuffle=0, sz=32000, file_name="full_blizzard.h5")
     return hdf5_file.root.data
 
 
-def fetch_blizzard_tbptt(data_path, sz=8000, batch_size=100, file_name="blizzard_tbptt.h5"):
+def fetch_blizzard_tbptt(data_path, sz=8000, batch_size=100, file_name="blizzard_tbptt.h5", block_rows=10000):
+    """
+    Builds the hdf5 store of truncated BPTT rows from the data_*.npy files (lists of utterances) if it doesn't exist.
+    Every data file is segmented by `segment_tbptt_group` in linear time and its rows are appended in blocks of at
+    most `block_rows` rows.
+    """
 
     hdf5_path = os.path.join(data_path, file_name)
 
@@ -245,30 +317,14 @@ def fetch_blizzard_tbptt(data_path, sz=8000, batch_size=100, file_name="blizzard
         for n, f in enumerate(data_matches):
             print("Reading file %s" % (f))
 
-            # with open(f) as fp:
             # Array of arrays, ragged
-            #    d = np.load(fp)
-            d = np.load(f)
-            large_d = d[0]
-
-            for i in range(1, len(d)):
-                print("Processing line %i of %i" % (i+1, len(d)))
-                di = d[i]
+            d = np.load(f, allow_pickle=True)
+            signals = [di[:, 0] if len(di.shape) > 1 else di for di in d]
 
-                if len(di.shape) > 1:
-                    di = di[:, 0]
-
-                large_d = np.concatenate([large_d, di])
-
-            chunk_size = int(np.float(len(large_d) / batch_size))
-            seg_d = segment_axis(large_d, chunk_size, 0)
-            num_batch = int(np.float((seg_d.shape[-1] - 1)/float(sz)))
-
-            for i in range(num_batch):
-                batch = seg_d[:, i*sz:(i+1)*sz]
-
-                for j in range(batch_size):
-                    data.append(batch[j][None])
+            rows = segment_tbptt_group(signals, sz, batch_size)
+            for i in range(0, len(rows), block_rows):
+                data.append(rows[i:i+block_rows])
+            print("Appended %i rows" % len(rows))
 
         hdf5_file.close()
 
@@ -590,6 +646,7 @@ class Blizzard(TemporalSeries, SequentialPrepMixin):
                  frame_size=200,
                  overlap=0,
                  file_name="full_blizzard",
+                 num_stat_workers=1,
                  **kwargs):
 
         self.X_mean = X_mean
@@ -601,6 +658,7 @@ class Blizzard(TemporalSeries, SequentialPrepMixin):
         self.frame_size = frame_size
         self.file_name = file_name
         self.overlap = overlap
+        self.num_stat_workers = num_stat_workers
 
         if self.use_window or self.use_spec:
             if self.use_spec:
@@ -609,9 +667,9 @@ class Blizzard(TemporalSeries, SequentialPrepMixin):
                                       for fast speed of DFT.")
 
             if np.mod(self.frame_size, 2) == 0:
-                self.overlap = self.frame_size / 2
+                self.overlap = self.frame_size // 2
             else:
-                self.overlap = (self.frame_size - 1) / 2
+                self.overlap = (self.frame_size - 1) // 2
 
             self.window = np.maximum(scipy.signal.hann(self.frame_size)[None, :], 1e-4).astype(np.float32)
 
@@ -622,34 +680,13 @@ class Blizzard(TemporalSeries, SequentialPrepMixin):
         X = fetch_blizzard(data_path, self.shuffle, self.seq_len, self.file_name+'.h5')
 
         if (self.X_mean is None or self.X_std is None) and not self.use_spec:
-            prev_mean = None
-            prev_var = None
-            n_seen = 0
-            n_inter = 10000
-            range_end = np.int(np.ceil(len(X) / float(n_inter)))
-
-            for i in range(range_end):
-                n_seen += 1
-                i_start = i*n_inter
-                i_end = min((i+1)*n_inter, len(X))
-
-                if prev_mean is None:
-                    prev_mean = X[i_start:i_end].mean()
-                    prev_var = 0.
-                else:
-                    curr_mean = prev_mean +\
-                        (X[i_start:i_end] - prev_mean).mean() / n_seen
-                    curr_var = prev_var +\
-                        ((X[i_start:i_end] - prev_mean) *
-                         (X[i_start:i_end] - curr_mean)).mean()
-                    prev_mean = curr_mean
-                    prev_var = curr_var
-
-                print("[%d / %d]" % (i+1, range_end))
+            # Exact statistics, reading every chunk once.
+            moments = hdf5_moments(X._v_file.filename, X._v_pathname,
+                                   num_workers=self.num_stat_workers, verbose=True)
 
             save_file_name = self.file_name + '_normal.npz'
-            self.X_mean = prev_mean
-            self.X_std = np.sqrt(prev_var / n_seen)
+            self.X_mean = moments.mean
+            self.X_std = moments.std
             np.savez(data_path + save_file_name, X_mean=self.X_mean, X_std=self.X_std)
 
         return X
@@ -666,15 +703,14 @@ class Blizzard(TemporalSeries, SequentialPrepMixin):
 
         if self.use_spec:
             batch = self.apply_fft(batch)
-            batch = self.log_magnitude(batch)
-            batch = self.concatenate(batch)
+            batch = self.log_magnitude_concatenate(batch)
         else:
             batch -= self.X_mean
             batch /= self.X_std
             if self.use_window:
                 batch = self.apply_window(batch)
             else:
-                batch = np.asarray([segment_axis(x, self.frame_size, 0) for x in batch])
+                batch = segment_axis(batch, self.frame_size, 0, axis=1)
 
         batch = batch.transpose(1, 0, 2)
 
@@ -682,24 +718,19 @@ class Blizzard(TemporalSeries, SequentialPrepMixin):
 
     def apply_window(self, batch):
 
-        batch = np.array([self.window * segment_axis(x, self.frame_size,
-                                                     self.overlap, end='pad')
-                          for x in batch])
+        batch = frame_batch(batch, self.frame_size, self.overlap, self.window)
 
         return batch
 
     def apply_fft(self, batch):
 
-        batch = np.array([self.numpy_rfft(self.window *
-                                          segment_axis(x, self.frame_size,
-                                                       self.overlap, end='pad'))
-                          for x in batch])
+        batch = np.fft.rfft(frame_batch(batch, self.frame_size, self.overlap, self.window), axis=-1)
 
         return batch
 
     def apply_ifft(self, batch):
 
-        batch = np.array([self.numpy_irfft(example) for example in batch])
+        batch = np.fft.irfft(batch, axis=-1)
 
         return batch
 
@@ -724,6 +755,10 @@ class Blizzard(TemporalSeries, SequentialPrepMixin):
 
         return new_batch
 
+    def log_magnitude_concatenate(self, batch):
+
+        return log_magnitude_concatenate(batch)
+
     def pow_magnitude(self, batch):
 
         batch_shape = batch.shape
@@ -785,38 +820,14 @@ class Blizzard_tbptt(Blizzard):
                                  file_name=self.file_name+'.h5')
 
         if (self.X_mean is None or self.X_std is None) and not self.use_spec:
-            prev_mean = None
-            prev_var = None
-            n_seen = 0
-            n_inter = 10000  # Lower values provide more precise approximation.
-            range_start = self.range_start
-
-            if self.range_end is not None:
-                range_end = np.int(np.ceil(self.range_end / float(n_inter)))
-            else:
-                range_end = np.int(np.ceil(len(X) / float(n_inter)))
-
-            for i in range(range_start, range_end):
-                n_seen += 1
-                i_start = i*n_inter
-                i_end = min((i+1)*n_inter, len(X))
-
-                if prev_mean is None:
-                    prev_mean = X[i_start:i_end].mean()
-                    prev_var = 0.
-                else:
-                    curr_mean = prev_mean + (X[i_start:i_end] - prev_mean).mean() / n_seen
-                    curr_var = prev_var +\
-                        ((X[i_start:i_end] - prev_mean) *\
-                         (X[i_start:i_end] - curr_mean)).mean()
-                    prev_mean = curr_mean
-                    prev_var = curr_var
-
-                print("[%d / %d]" % (i+1, range_end))
+            # Exact statistics of the rows [range_start, range_end), reading every chunk once.
+            range_end = min(self.range_end, len(X)) if self.range_end is not None else len(X)
+            moments = hdf5_moments(X._v_file.filename, X._v_pathname, start=self.range_start, end=range_end,
+                                   num_workers=self.num_stat_workers, verbose=True)
 
             save_file_name = self.file_name + '_normal.npz'
-            self.X_mean = prev_mean
-            self.X_std = np.sqrt(prev_var / n_seen)
+            self.X_mean = moments.mean
+            self.X_std = moments.std
             print("mean: " + str(self.X_mean))
             print("std: " + str(self.X_std))
             np.savez(os.path.join(data_path, save_file_name), X_mean=self.X_mean, X_std=self.X_std)
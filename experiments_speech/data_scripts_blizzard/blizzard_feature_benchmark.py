@@ -0,0 +1,69 @@
+import time
+import argparse
+import numpy as np
+import scipy.signal
+from blizzard_data import segment_axis, complex_to_real, frame_batch, log_magnitude_concatenate, R2P, P2R
+
+"""
+Throughput benchmark of the Blizzard frame and spectral features. The batched extractors (`frame_batch`,
+`np.fft.rfft` on the whole batch and `log_magnitude_concatenate`) are compared with the per-example implementation
+they replace. The outputs are checked to be exactly the same.
+
+Example run command:
+    python blizzard_feature_benchmark.py --batch_size 128 --seq_len 8000 --frame_size 256
+"""
+
+
+def reference_window(batch, window, frame_size, overlap):
+    return np.array([window*segment_axis(x, frame_size, overlap, end='pad') for x in batch])
+
+
+def reference_spectral(batch, window, frame_size, overlap):
+    batch = np.array([np.array([np.fft.rfft(frame) for frame in window*segment_axis(x, frame_size, overlap, end='pad')]) for x in batch])
+    batch_shape = batch.shape
+    mag, phase = R2P(batch.reshape((batch_shape[0]*batch_shape[1], batch_shape[2])))
+    batch = P2R(np.log10(mag + 1.), phase)
+    batch = complex_to_real(batch)
+    return batch.reshape((batch_shape[0], batch_shape[1], batch.shape[-1])).astype(np.float32)
+
+
+def batched_window(batch, window, frame_size, overlap):
+    return frame_batch(batch, frame_size, overlap, window)
+
+
+def batched_spectral(batch, window, frame_size, overlap):
+    return log_magnitude_concatenate(np.fft.rfft(frame_batch(batch, frame_size, overlap, window), axis=-1))
+
+
+def run_benchmark(batch_size=128, seq_len=8000, frame_size=256, num_repeats=10):
+    """
+    Prints frames/sec of the reference and batched feature extractors.
+    """
+    overlap = frame_size // 2
+    window = np.maximum(scipy.signal.get_window('hann', frame_size, fftbins=False)[None, :], 1e-4).astype(np.float32)
+    batch = np.random.randn(batch_size, seq_len).astype(np.float32)
+
+    for name, reference_fn, batched_fn in [("window", reference_window, batched_window),
+                                           ("spectral", reference_spectral, batched_spectral)]:
+        reference_out = reference_fn(batch, window, frame_size, overlap)
+        batched_out = batched_fn(batch, window, frame_size, overlap)
+        assert reference_out.dtype == batched_out.dtype and np.array_equal(reference_out, batched_out), name + " outputs differ."
+
+        num_frames = reference_out.shape[0]*reference_out.shape[1]
+        for label, fn in [("reference", reference_fn), ("batched", batched_fn)]:
+            start_time = time.perf_counter()
+            for _ in range(num_repeats):
+                fn(batch, window, frame_size, overlap)
+            time_elapsed = (time.perf_counter() - start_time)/num_repeats
+            print("{:>10} {:>10}: {:10.1f} frames/sec ({:.4f} sec/batch)".format(name, label, num_frames/time_elapsed, time_elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128, help='Number of sequences per batch.')
+    parser.add_argument('--seq_len', type=int, default=8000, help='Number of samples per sequence.')
+    parser.add_argument('--frame_size', type=int, default=256, help='Frame size. Power of 2 for spectral features.')
+    parser.add_argument('--num_repeats', type=int, default=10, help='Number of timed runs.')
+    args = parser.parse_args()
+
+    run_benchmark(args.batch_size, args.seq_len, args.frame_size, args.num_repeats)
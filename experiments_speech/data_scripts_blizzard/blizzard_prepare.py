@@ -0,0 +1,207 @@
+import os
+import json
+import shutil
+import argparse
+import subprocess
+import multiprocessing
+from math import gcd
+
+import tables
+import numpy as np
+import scipy.signal
+from scipy.io import wavfile
+from blizzard_data import segment_tbptt_group
+from data_statistics import RunningMoments
+from preprocessing_manifest import PreprocessingManifest
+
+"""
+Parallel and incremental preparation of the segmented Blizzard store.
+
+- Audio files are decoded into 16-bit mono signals at `sample_rate` by a pool of `num_workers` processes. `ffmpeg` is
+used if it is available (i.e., for mp3 files). Otherwise only wav files are supported, which are read by scipy and
+resampled by polyphase filtering.
+- Files are assigned to groups of `group_size` files by a `PreprocessingManifest`. Every group is segmented by
+`segment_tbptt_group` (i.e., the same layout as `fetch_blizzard_tbptt`) into an int16 .npy shard with its statistics.
+Only new groups and groups with changed or deleted files are decoded again. New files form new groups. Hence, adding
+recordings costs time proportional to the new data.
+- The shards are written into the int16 EArray of the hdf5 store in the group order. New shards are appended if the
+store already contains the preceding ones. Interrupted runs resume from the missing shards.
+
+Example run command:
+    python blizzard_prepare.py --data_path <>/unsegmented --output_file ./tmp/blizzard_unseg_tbptt.h5 --num_workers 32
+"""
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav')
+
+
+def list_audio_files(data_path, extensions=AUDIO_EXTENSIONS):
+    """
+    Returns sorted paths of the audio files under `data_path`.
+    """
+    audio_files = []
+    for root, dir_names, file_names in os.walk(data_path):
+        for file_name in file_names:
+            if file_name.lower().endswith(extensions):
+                audio_files.append(os.path.join(root, file_name))
+    return sorted(audio_files)
+
+
+def decode_audio(path, sample_rate=16000):
+    """
+    Decodes an audio file into a mono int16 signal with the given sample rate.
+
+    Args:
+        path (str): path to the audio file.
+        sample_rate (int): target sample rate.
+
+    Returns:
+        (np.ndarray): 1D int16 signal.
+    """
+    if shutil.which("ffmpeg") is not None:
+        command = ["ffmpeg", "-v", "error", "-i", path, "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "-"]
+        pcm = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+        return np.frombuffer(pcm, dtype=np.int16)
+
+    if not path.lower().endswith('.wav'):
+        raise Exception("ffmpeg is required to decode " + path)
+    file_sample_rate, signal = wavfile.read(path)
+    if signal.ndim > 1:
+        signal = signal[:, 0]
+    if signal.dtype != np.int16:
+        if np.issubdtype(signal.dtype, np.floating):
+            signal = signal*32767
+        elif signal.dtype == np.int32:
+            signal = signal/65536
+        elif signal.dtype == np.uint8:
+            signal = (signal.astype(np.int16) - 128)*256
+    if file_sample_rate != sample_rate:
+        divisor = gcd(file_sample_rate, sample_rate)
+        signal = scipy.signal.resample_poly(signal.astype(np.float64), sample_rate//divisor, file_sample_rate//divisor)
+    return np.clip(np.round(signal), -32768, 32767).astype(np.int16)
+
+
+def _decode_audio_worker(args):
+    return decode_audio(*args)
+
+
+def prepare_blizzard(data_path, output_file, num_workers=None, sample_rate=16000, group_size=200, sz=8000, batch_size=100):
+    """
+    Decodes and segments new or changed groups of audio files into shards in parallel, and assembles the hdf5 store
+    `output_file` from the shards.
+
+    Args:
+        data_path (str): directory of the audio files.
+        output_file (str): path to the hdf5 store.
+        num_workers (int): number of decoding processes. If None, the number of cores.
+        sample_rate (int): target sample rate.
+        group_size (int): number of files concatenated before segmentation. Applies to new groups only.
+        sz (int): number of samples per row.
+        batch_size (int): number of parallel streams per group.
+
+    Returns:
+        (int): number of rows in the store.
+        (RunningMoments): statistics of the store.
+        (list): (signature, first row, last row) of the shards in the store order.
+    """
+    audio_files = list_audio_files(data_path)
+    if len(audio_files) == 0:
+        raise Exception("No audio files found in " + data_path)
+
+    shard_dir = os.path.splitext(output_file)[0] + "_shards"
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    manifest = PreprocessingManifest(os.path.join(shard_dir, "manifest.json"),
+                                     params=dict(sample_rate=sample_rate, sz=sz, batch_size=batch_size))
+    groups = manifest.assign_groups(audio_files, group_size)
+    dirty_groups = [(name, files) for name, files in groups if manifest.is_dirty(name, files)]
+    print("{} of {} groups are built.".format(len(dirty_groups), len(groups)))
+
+    if len(dirty_groups) > 0:
+        pool = multiprocessing.Pool(num_workers)
+        try:
+            # imap returns the decoded files in order while the workers continue decoding the following files.
+            signals = pool.imap(_decode_audio_worker, [(path, sample_rate) for _, files in dirty_groups for path in files], chunksize=4)
+            for name, files in dirty_groups:
+                rows = segment_tbptt_group([next(signals) for _ in files], sz, batch_size)
+                shard_path = os.path.join(shard_dir, name + ".npy")
+                with open(shard_path + ".tmp", 'wb') as f:
+                    np.save(f, rows)
+                os.replace(shard_path + ".tmp", shard_path)
+                manifest.mark_done(name, files, files=[shard_path], num_rows=len(rows), moments=RunningMoments().update(rows).to_dict())
+                print("Shard {}: {} rows.".format(name, len(rows)))
+        finally:
+            pool.terminate()
+
+    shards = [(name, manifest.get(name)) for name, _ in groups]
+    num_rows = assemble_store(output_file, shards, sz)
+
+    moments = RunningMoments()
+    shard_rows = []
+    start_row = 0
+    for name, record in shards:
+        moments.merge(RunningMoments.from_dict(record['moments']))
+        shard_rows.append((record['signature'], start_row, start_row + record['num_rows']))
+        start_row += record['num_rows']
+    return num_rows, moments, shard_rows
+
+
+def assemble_store(output_file, shards, sz, block_rows=10000):
+    """
+    Writes the shards into the int16 EArray of the hdf5 store in the given order. If the store already contains a
+    prefix of the shards (i.e., new recordings are added), only the remaining shards are appended. Otherwise the store
+    is rewritten.
+
+    Args:
+        output_file (str): path to the hdf5 store.
+        shards (list): (name, manifest record) tuples.
+        sz (int): number of samples per row.
+        block_rows (int): maximum number of rows per append.
+
+    Returns:
+        (int): number of rows in the store.
+    """
+    shard_ids = [[name, record['signature']] for name, record in shards]
+    stored_ids, stored_rows = [], 0
+    if os.path.exists(output_file):
+        hdf5_file = tables.open_file(output_file, mode='a')
+        data = hdf5_file.root.data
+        if 'shards' in data.attrs._v_attrnamesuser:
+            stored_ids = json.loads(data.attrs.shards)
+            stored_rows = data.attrs.num_rows
+        if data.shape[1] != sz or stored_ids != shard_ids[:len(stored_ids)] or data.nrows < stored_rows:
+            hdf5_file.close()
+            os.remove(output_file)
+            stored_ids, stored_rows = [], 0
+
+    if not os.path.exists(output_file):
+        compression_filter = tables.Filters(complevel=5, complib='blosc')
+        hdf5_file = tables.open_file(output_file, mode='w')
+        data = hdf5_file.create_earray(hdf5_file.root, 'data', tables.Int16Atom(), shape=(0, sz), filters=compression_filter)
+
+    # Discard the rows of an interrupted append.
+    data.truncate(stored_rows)
+    for name, record in shards[len(stored_ids):]:
+        rows = np.load(record['files'][0], mmap_mode='r')
+        for i in range(0, len(rows), block_rows):
+            data.append(rows[i:i + block_rows])
+        stored_ids.append([name, record['signature']])
+        data.attrs.shards = json.dumps(stored_ids)
+        data.attrs.num_rows = data.nrows
+        hdf5_file.flush()
+        print("Store: appended {} ({} rows).".format(name, data.nrows))
+
+    num_rows = data.nrows
+    hdf5_file.close()
+    return num_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', required=True, type=str, help='Directory of the audio files.')
+    parser.add_argument('--output_file', required=True, type=str, help='Path to the hdf5 store.')
+    parser.add_argument('--num_workers', type=int, default=None, help='Number of decoding processes. Default is the number of cores.')
+    parser.add_argument('--sample_rate', type=int, default=16000, help='Target sample rate.')
+    parser.add_argument('--group_size', type=int, default=200, help='Number of files concatenated before segmentation.')
+    args = parser.parse_args()
+
+    prepare_blizzard(args.data_path, args.output_file, args.num_workers, args.sample_rate, args.group_size)
@@ -3,22 +3,36 @@ Preprocessing script for Blizzard data. The same steps with VRNN (https://arxiv.
 Z-forcing (https://arxiv.org/abs/1711.05411) are applied.
 
 You can download Blizzard dataset from https://www.synsig.org/index.php/Blizzard_Challenge_2013
+The `source` directory must be in PYTHONPATH (i.e., for `data_statistics`, `preprocessing_manifest` and
+`sharded_dataset`).
+Re-running the script only processes new or changed recordings.
 """
 
 import os
-import pickle
 import tables
 import numpy as np
-from scipy.io import wavfile
-from blizzard_data import Blizzard_tbptt
+from blizzard_prepare import prepare_blizzard
+from preprocessing_manifest import PreprocessingManifest
+from sharded_dataset import ShardWriter, INDEX_FILE
 
 # Path to the unsegmented Blizzard dataset. Don't add "./"
 BLIZZARD_DATA_PATH = "<>/unsegmented"
+# Number of decoding processes. If None, the number of cores.
+NUM_WORKERS = None
 # Temporarily created destination for intermediate files.
 TMP_DIR = "tmp"
 # Destination of the dataset files.
 OUTPUT_DIR = "data_blizzard"
 OUTPUT_FILE = "blizzard_stcn"
+# Number of samples per dataset shard and number of store rows read at once.
+SHARD_SIZE = 4096
+BLOCK_ROWS = 1000
+# Audio samples are kept in int16 (i.e., losslessly) and dequantized into float32 when they are fed to the model.
+SAMPLE_QUANTIZATION = dict(dtype='int16', scale=1.0, offset=0.0)
+# Z-forcing normalizes the data with approximate statistics (`X_mean` and `X_std` in `blizzard_unseg_tbptt_normal.npz`
+# created by the VRNN/Z-forcing preprocessing). Set the path of this file in order to use the same normalization and
+# directly compare the results with Z-forcing. If None, the exact statistics of the data are used.
+ZFORCING_STATISTICS_FILE = None
 
 if not os.path.exists(TMP_DIR):
     os.mkdir(TMP_DIR)
@@ -26,116 +40,67 @@ if not os.path.exists(OUTPUT_DIR):
     os.mkdir(OUTPUT_DIR)
 
 ###
-# 1-List .mp3 files
-###
-bash_list_mp3 = 'find . -type f -path "*/{0}/*.mp3" > {1}/list_of_files.txt'.format(BLIZZARD_DATA_PATH, TMP_DIR)
-os.system(bash_list_mp3)
-
-###
-# 2-Convert mp3 into wav. Taken from
+# 1-Decode the mp3 files in parallel, segment the data and write into the hdf5 store. Replaces the serial ffmpeg
+# conversion and pickling steps of
 # https://github.com/jych/nips2015_vrnn/blob/275e183536a8bf4c3d30a29a1b6ccd3e8026e93c/datasets/blizzard_utils/convert_to_wav.sh
-###
-bash_mp3_to_wav = \
-    """
-    DIRNAME={0}/blizzard_wav
-    if [ ! -d "$DIRNAME" ]; then
-        mkdir $DIRNAME
-    fi
-        echo $files_list
-    for f in `cat {0}/list_of_files.txt | grep .mp3 | sed -e 's/[ \t][ \t]*/ /g' | cut -d ' ' -f6`; do""".format(TMP_DIR) +\
-    """
-        t=`basename $f`
-        ffmpeg -i "$f" -acodec pcm_s16le -ac 1 -ar 16000 $DIRNAME/${t%.mp3}.wav
-    done
-    """
-os.system(bash_mp3_to_wav)
-
-###
-# 3-Read the wav files and dump into numpy arrays.
 # https://github.com/jych/nips2015_vrnn/blob/275e183536a8bf4c3d30a29a1b6ccd3e8026e93c/datasets/blizzard_utils/make_blizzard_npy.py
+# Only new or changed files are decoded again (see blizzard_prepare.py).
 ###
-wav_dir = os.path.join(TMP_DIR, 'blizzard_wav')
-list_len = 200
-file_idx = 0
-data_list = []
-files = [os.path.join(wav_dir, f) for f in os.listdir(wav_dir)]
-for n, f in enumerate(files):
-    sr, d = wavfile.read(f)
-    data_list.append(d)
-    if len(data_list) >= list_len:
-        print("Dumping at file %i of %i" % (n, len(files)))
-        pickle.dump(data_list, open(TMP_DIR + "/data_%i.npy" % file_idx, mode="wb"))
-        file_idx += 1
-        data_list = []
-# dump the last chunk
-pickle.dump(data_list, open(TMP_DIR + "/data_%i.npy" % file_idx, mode="wb"))
+hdf5_data_file = "blizzard_unseg_tbptt"
+num_rows, moments, shard_rows = prepare_blizzard(BLIZZARD_DATA_PATH, os.path.join(TMP_DIR, hdf5_data_file + ".h5"), num_workers=NUM_WORKERS)
+print("Num examples: " + str(num_rows))
 
 ###
-# 4-Load the numpy arrays, segment the data and calculate statistics.
-# https://github.com/jych/nips2015_vrnn/blob/master/datasets/blizzard.py
+# 2-Calculate statistics. Exact statistics of the store are merged from the statistics of the shards. They differ from
+# the approximate statistics of https://github.com/jych/nips2015_vrnn/blob/master/datasets/blizzard.py, which are
+# kept in `_normal.npz`. Hence, the exact statistics are written into a separate file.
 ###
-file_name = 'blizzard_unseg_tbptt'
-X_mean = None
-X_std = None
-train_data = Blizzard_tbptt(name='train',
-                            path=TMP_DIR,
-                            frame_size=200,
-                            seq_len=8000,
-                            file_name=file_name,
-                            X_mean=X_mean,
-                            X_std=X_std)
-print("Num examples: " + str(train_data.num_examples()))
+print("mean: " + str(moments.mean))
+print("std: " + str(moments.std))
+np.savez(os.path.join(TMP_DIR, hdf5_data_file + "_exact_normal.npz"), X_mean=moments.mean, X_std=moments.std)
 
 
 ###
-# 5-Convert to a dataset representation that is required by the STCN repository.
+# 3-Convert to a dataset representation that is required by the STCN repository. Every split is a sharded dataset
+# directory streamed from the store block by block, i.e., a split is never loaded into memory. A split is rewritten
+# only if the shards in its range, their row ranges in the store or the statistics changed.
 ###
-input_data_folder = TMP_DIR
-hdf5_data_file = "blizzard_unseg_tbptt"
-
 # These numbers are taken from Z-forcing repository.
-train_start, train_end = 0, 2040064
-valid_start, valid_end = 2040064, 2152704
-test_start, test_end = 2152704, 2267008 - 128
-
-# Load raw data.
-print("Reading HDF5 data file.")
-hdf5_data = tables.open_file(os.path.join(input_data_folder, hdf5_data_file + ".h5"), mode='r')
-dataset_all = hdf5_data.root.data
-
-# Create training, validation and test splits.
-training_dataset = dict()
-validation_dataset = dict()
-test_dataset = dict()
-
-# Z-forcing paper approximates data statistics and normalizes both the inputs and targets by using the approximated mean
-# and std. In order to be able to directly compare our results with them, we also use their statistics.
-print("Fetching statistics.")
-stats = dict(np.load(os.path.join(input_data_folder, hdf5_data_file + "_normal.npz")))
-baseline_stats = dict(mean_all=np.float32(stats["X_mean"]), std_all=np.float32(stats["X_std"]))
-training_dataset["statistics"] = baseline_stats
-validation_dataset["statistics"] = baseline_stats
-test_dataset["statistics"] = baseline_stats
-
-print("Creating training split.")
-training_dataset["samples"] = dataset_all[train_start:train_end].reshape(-1, 40, 200)
-print("Creating validation split.")
-validation_dataset["samples"] = dataset_all[valid_start:valid_end].reshape(-1, 40, 200)
-print("Creating test split.")
-test_dataset["samples"] = dataset_all[test_start:test_end].reshape(-1, 40, 200)
-
-# Save
-if training_dataset is not None:
-    print("# training samples: " + str(len(training_dataset['samples'])))
-    training_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE + "_training")
-    np.savez_compressed(training_path, **training_dataset)
-
-if validation_dataset is not None:
-    print("# validation samples: " + str(len(validation_dataset['samples'])))
-    validation_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE + "_validation")
-    np.savez_compressed(validation_path, **validation_dataset)
-
-if test_dataset is not None:
-    print("# test samples: " + str(len(test_dataset['samples'])))
-    validation_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE + "_test")
-    np.savez_compressed(validation_path, **test_dataset)
+SPLITS = dict(training=(0, 2040064),
+              validation=(2040064, 2152704),
+              test=(2152704, 2267008 - 128))
+
+# Both the inputs and targets are normalized by the scalar mean and std of the data, either exact or the approximate
+# Z-forcing statistics (see `ZFORCING_STATISTICS_FILE`).
+if ZFORCING_STATISTICS_FILE is not None:
+    print("Using Z-forcing statistics in " + ZFORCING_STATISTICS_FILE)
+    zforcing_stats = dict(np.load(ZFORCING_STATISTICS_FILE))
+    normalization_stats = dict(mean_all=np.float32(zforcing_stats["X_mean"]), std_all=np.float32(zforcing_stats["X_std"]))
+else:
+    normalization_stats = dict(mean_all=np.float32(moments.mean), std_all=np.float32(moments.std))
+split_manifest = PreprocessingManifest(os.path.join(OUTPUT_DIR, OUTPUT_FILE + "_manifest.json"), params=dict(splits=SPLITS))
+
+hdf5_data = None
+for split_name in ["training", "validation", "test"]:
+    split_start, split_end = SPLITS[split_name]
+    split_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE + "_" + split_name)
+    split_dependencies = dict(statistics=[float(normalization_stats['mean_all']), float(normalization_stats['std_all'])],
+                              shards=[[signature, int(start), int(end)] for signature, start, end in shard_rows if start < split_end and end > split_start])
+    if not split_manifest.is_dirty(split_name, [], split_dependencies):
+        print("Split {} is up to date.".format(split_name))
+        continue
+
+    if hdf5_data is None:
+        print("Reading HDF5 data file.")
+        hdf5_data = tables.open_file(os.path.join(TMP_DIR, hdf5_data_file + ".h5"), mode='r')
+    print("Creating {} split.".format(split_name))
+    writer = ShardWriter(split_path, shard_size=SHARD_SIZE, compute_statistics=False, quantization=SAMPLE_QUANTIZATION)
+    writer.set_statistics(normalization_stats)
+    for block_start in range(split_start, split_end, BLOCK_ROWS):
+        writer.add_batch(samples=hdf5_data.root.data[block_start:min(block_start + BLOCK_ROWS, split_end)].reshape(-1, 40, 200))
+    writer.close()
+    print("# {} samples: {}".format(split_name, split_end - split_start))
+    split_manifest.mark_done(split_name, [], split_dependencies, files=[os.path.join(split_path, INDEX_FILE)])
+
+if hdf5_data is not None:
+    hdf5_data.close()
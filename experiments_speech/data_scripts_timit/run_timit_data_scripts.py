@@ -3,61 +3,37 @@ Preprocessing script for TIMIT data. The same steps with VRNN (https://arxiv.org
 Z-forcing (https://arxiv.org/abs/1711.05411) and SRNN (https://arxiv.org/abs/1605.07571) are applied.
 
 You can download TIMIT dataset from https://catalog.ldc.upenn.edu/LDC93S1
+The `source` directory must be in PYTHONPATH (i.e., for `data_statistics`, `preprocessing_manifest` and
+`sharded_dataset`).
+Re-running the script rewrites only the splits whose files or parameters changed.
+
+Unlike Blizzard, the memory usage is not bounded. The splits are built in memory since the training samples are cut from
+the concatenation of all training files and interleaved across batches (see `reorder` in `timit_for_srnn.py`). Only the
+output is written shard by shard with `ShardWriter`. The peak memory is a few times the size of the decoded TIMIT audio.
 """
 
 import os
 import numpy as np
-from timit_for_srnn import load_wav_files_relative_path, create_timit_samples
+from timit_for_srnn import load_wav_files_relative_path, create_timit_samples, cancel_normalization, SAMPLINGRATE, OUTDIM, SEQ_LEN, BATCH_SIZE
+from data_statistics import RunningMoments
+from preprocessing_manifest import PreprocessingManifest
+from sharded_dataset import ShardWriter, INDEX_FILE
 
 # Path to the TIMIT dataset.
 TIMIT_DATA_PATH = '<>/TIMIT/'
 OUTPUT_DIR = "data_timit"
 OUTPUT_FILE_NAME = "timit_stcn"
+# Cache of the resampled wav files. Re-running the script only reads the cached arrays.
+WAV_CACHE_DIR = "wav_cache"
+# Number of decoding processes. If None, the number of cores.
+NUM_WORKERS = None
+# Number of samples per dataset shard.
+SHARD_SIZE = 1024
 
 if not os.path.exists(OUTPUT_DIR):
     os.mkdir(OUTPUT_DIR)
 
 
-def cancel_normalization(data_dicts):
-    """
-    Reverts the normalization.
-    """
-
-    def operate_single_data(data_dict):
-        new_data_dict = dict()
-        new_data_dict['samples'] = []
-        new_data_dict['targets'] = []
-        new_data_dict['preprocessing'] = []
-
-        mask_key = "mask_test" if "mask_test" in data_dict else "masks"
-        mask_exist = mask_key in data_dict
-
-        mean, std = data_dict['mean'], data_dict['std']
-        for idx in range(data_dict['samples'].shape[0]):
-            sample = data_dict['samples'][idx]
-            target = data_dict['targets'][idx]
-            if mask_exist:
-                seq_len = int(data_dict[mask_key][idx].sum())
-                sample = sample[:seq_len]
-                target = target[:seq_len]
-            new_sample = sample*std + mean
-            new_data_dict['samples'].append(new_sample)
-
-            new_target = target*std + mean
-            new_data_dict['targets'].append(new_target)
-
-        return new_data_dict
-
-    outputs = []
-    for data_dict in data_dicts:
-        if data_dict is not None:
-            outputs.append(operate_single_data(data_dict))
-        else:
-            outputs.append(None)
-
-    return outputs
-
-
 def calculate_statistics(training_dict, evaluation_dicts=None, keep_dims=None):
     """
     Calculates min, max, mean and std statistics on all dimensions and feature dimension.
@@ -70,20 +46,26 @@ def calculate_statistics(training_dict, evaluation_dicts=None, keep_dims=None):
             if eval_data_dict is not None:
                 eval_data_dict["samples"] = eval_data_dict["samples"][:, :, keep_dims]
 
-    all_samples = np.vstack(training_dict['samples'])
+    # Samples are reduced one by one instead of stacking the whole training split.
+    moments_all = RunningMoments(axis=None)
+    moments_channel = RunningMoments(axis=0)
+    for sample in training_dict['samples']:
+        moments_all.update(sample)
+        moments_channel.update(sample)
+    dtype = training_dict['samples'][0].dtype
 
-    std_channel = all_samples.std(axis=0)
+    std_channel = moments_channel.std.astype(dtype)
     std_channel[np.where(std_channel < 1e-6)] = 1.0
-    mean_channel = all_samples.mean(axis=0)
+    mean_channel = moments_channel.mean.astype(dtype)
 
-    statistics['mean_all'] = all_samples.mean()
-    statistics['std_all'] = all_samples.std()
-    statistics['min_all'] = all_samples.min()
-    statistics['max_all'] = all_samples.max()
+    statistics['mean_all'] = dtype.type(moments_all.mean)
+    statistics['std_all'] = dtype.type(moments_all.std)
+    statistics['min_all'] = moments_all.min
+    statistics['max_all'] = moments_all.max
     statistics['mean_channel'] = mean_channel
     statistics['std_channel'] = std_channel
-    statistics['min_channel'] = all_samples.min(axis=0)
-    statistics['max_channel'] = all_samples.max(axis=0)
+    statistics['min_channel'] = moments_channel.min
+    statistics['max_channel'] = moments_channel.max
 
     training_dict['statistics'] = statistics
     for eval_dict in evaluation_dicts:
@@ -111,9 +93,20 @@ print("NUMBER OF TRAIN FILES", len(train_files))
 print("NUMBER OF VALID FILES", len(valid_files))
 print("NUMBER OF TEST FILES", len(test_files))
 
-train_vector = load_wav_files_relative_path(TIMIT_DATA_PATH, train_files)
-valid_vector = load_wav_files_relative_path(TIMIT_DATA_PATH, valid_files)
-test_vector_lst = load_wav_files_relative_path(TIMIT_DATA_PATH, test_files)
+# Every split is normalized with the training statistics, i.e., it also depends on the training files.
+manifest = PreprocessingManifest(os.path.join(OUTPUT_DIR, OUTPUT_FILE_NAME + "_manifest.json"),
+                                 params=dict(sampling_rate=SAMPLINGRATE, outdim=OUTDIM, seq_len=SEQ_LEN, batch_size=BATCH_SIZE))
+split_inputs = dict(training=[os.path.join(TIMIT_DATA_PATH, f) for f in train_files])
+split_inputs['validation'] = [os.path.join(TIMIT_DATA_PATH, f) for f in valid_files] + split_inputs['training']
+split_inputs['test'] = [os.path.join(TIMIT_DATA_PATH, f) for f in test_files] + split_inputs['training']
+dirty_splits = [split for split in ["training", "validation", "test"] if manifest.is_dirty(split, split_inputs[split])]
+if len(dirty_splits) == 0:
+    print("All splits are up to date.")
+    exit()
+
+train_vector = load_wav_files_relative_path(TIMIT_DATA_PATH, train_files, NUM_WORKERS, WAV_CACHE_DIR)
+valid_vector = load_wav_files_relative_path(TIMIT_DATA_PATH, valid_files, NUM_WORKERS, WAV_CACHE_DIR)
+test_vector_lst = load_wav_files_relative_path(TIMIT_DATA_PATH, test_files, NUM_WORKERS, WAV_CACHE_DIR)
 
 u_train_vector, u_valid_vector, u_test_vector, x_train_vector, x_valid_vector, x_test_vector, mask_test, mean, std = create_timit_samples(train_vector, valid_vector, test_vector_lst)
 
@@ -129,18 +122,14 @@ training_dataset, validation_dataset, test_dataset = cancel_normalization([train
 training_dataset, eval_dataset = calculate_statistics(training_dataset, [validation_dataset, test_dataset])
 validation_dataset, test_dataset = eval_dataset
 
-# Save
-if training_dataset is not None:
-    print("# training samples: " + str(len(training_dataset['samples'])))
-    training_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE_NAME + "_training")
-    np.savez_compressed(training_path, **training_dataset)
-
-if validation_dataset is not None:
-    print("# validation samples: " + str(len(validation_dataset['samples'])))
-    validation_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE_NAME + "_validation")
-    np.savez_compressed(validation_path, **validation_dataset)
-
-if test_dataset is not None:
-    print("# test samples: " + str(len(test_dataset['samples'])))
-    test_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE_NAME + "_test")
-    np.savez_compressed(test_path, **test_dataset)
\ No newline at end of file
+# Save every split as a sharded dataset directory of variable-length sequences.
+for split_name, split_dataset in [("training", training_dataset), ("validation", validation_dataset), ("test", test_dataset)]:
+    if split_dataset is not None and split_name in dirty_splits:
+        print("# {} samples: {}".format(split_name, len(split_dataset['samples'])))
+        split_path = os.path.join(OUTPUT_DIR, OUTPUT_FILE_NAME + "_" + split_name)
+        writer = ShardWriter(split_path, shard_size=SHARD_SIZE, ragged=True, compute_statistics=False, preprocessing=split_dataset['preprocessing'])
+        writer.set_statistics(split_dataset['statistics'])
+        for sample, target in zip(split_dataset['samples'], split_dataset['targets']):
+            writer.add(samples=sample, targets=target)
+        writer.close()
+        manifest.mark_done(split_name, split_inputs[split_name], files=[os.path.join(split_path, INDEX_FILE)])
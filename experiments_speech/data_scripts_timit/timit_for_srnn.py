@@ -10,11 +10,18 @@ You can download TIMIT dataset from https://catalog.ldc.upenn.edu/LDC93S1
 """
 import os
 import fnmatch
+import hashlib
+import multiprocessing
 import numpy as np
 import librosa
 import random
 
 TIMIT_DIR = '<>/TIMIT/'
+# Resampled wav files are cached as float32 .npy files named by the content hash of the file and the sample rate. Set to
+# None to disable caching.
+WAV_CACHE_DIR = 'wav_cache'
+# Number of decoding processes. If None, the number of cores.
+NUM_WORKERS = None
 
 frac_in_validation = 0.05
 BATCH_SIZE = 64
@@ -39,10 +46,10 @@ def reorder(data_in, batch_size, model_seq_len, dtype='float32'):
     u_out = data_in[:data_resize].reshape((n_samples, model_seq_len, last_dim))
     x_out = data_in[1:data_resize + 1].reshape((n_samples, model_seq_len, last_dim))
 
-    out = np.zeros(n_samples, dtype='int32')
-    for i in range(n_batches):
-        val = range(i, n_batches * batch_size + i, n_batches)
-        out[i * batch_size:(i + 1) * batch_size] = val
+    # Sample i*batch_size + j is the i-th sample of the j-th stream, i.e., consecutive samples of a stream are in
+    # consecutive batches.
+    sample_idx = np.arange(n_samples, dtype='int32')
+    out = sample_idx // batch_size + (sample_idx % batch_size)*n_batches
 
     u_out = u_out[out]
     x_out = x_out[out]
@@ -60,42 +67,108 @@ def get_files(folder, file_end):
 
 
 def create_test_set(x_lst):
+    """
+    Pads the files into (n, max_len, OUTDIM) arrays of inputs (all but the last frame) and targets (all but the first
+    frame). The padded frames are copied at once by indexing the concatenated files with the file offsets.
+    """
     n = len(x_lst)
     x_lens = np.array([x.shape[0] for x in x_lst])
     max_len = x_lens.max() - 1
-    u_out = np.zeros((n, max_len, OUTDIM), dtype='float32')*np.nan
-    x_out = np.zeros((n, max_len, OUTDIM), dtype='float32')*np.nan
-    for row, vec in enumerate(x_lst):
-        l = len(vec) - 1
-        u = vec[:-1]  # all but last element
-        x = vec[1:]   # all but first element
-
-        x_out[row, :l] = x
-        u_out[row, :l] = u
-
-    mask = np.invert(np.isnan(x_out))
-    x_out[np.isnan(x_out)] = 0
-    u_out[np.isnan(u_out)] = 0
-    mask = mask[:, :, 0]
+    offsets = np.concatenate([[0], np.cumsum(x_lens)[:-1]])
+    x_concat = np.concatenate(x_lst, axis=0)
+
+    mask = np.arange(max_len)[np.newaxis, :] < (x_lens - 1)[:, np.newaxis]
+    rows, steps = np.nonzero(mask)
+    u_out = np.zeros((n, max_len, OUTDIM), dtype='float32')
+    x_out = np.zeros((n, max_len, OUTDIM), dtype='float32')
+    u_out[rows, steps] = x_concat[offsets[rows] + steps]  # all but last element
+    x_out[rows, steps] = x_concat[offsets[rows] + steps + 1]  # all but first element
+
     assert np.all((mask.sum(axis=1)+1) == x_lens)
     return u_out, x_out, mask.astype('float32')
 
 
-def load_wav_files(files):
-    wav_files = []
-    for i, wav_file in enumerate(files):
-        print(i, wav_file)
-        wav_files += [librosa.load(wav_file, sr=SAMPLINGRATE)[0]]
+def cancel_normalization(data_dicts):
+    """
+    Reverts the normalization and removes the padding of the samples and targets.
+    """
+
+    def unpad(padded, seq_lens):
+        if seq_lens is None:
+            return list(padded)
+        # Padding is at the end of the samples, i.e., the masked frames are the concatenated samples.
+        valid_steps = np.arange(padded.shape[1])[np.newaxis, :] < seq_lens[:, np.newaxis]
+        return np.split(padded[valid_steps], np.cumsum(seq_lens)[:-1])
+
+    def operate_single_data(data_dict):
+        mask_key = "mask_test" if "mask_test" in data_dict else "masks"
+        seq_lens = data_dict[mask_key].sum(axis=1).astype(np.int64) if mask_key in data_dict else None
+
+        mean, std = data_dict['mean'], data_dict['std']
+        new_data_dict = dict()
+        new_data_dict['samples'] = unpad(data_dict['samples']*std + mean, seq_lens)
+        new_data_dict['targets'] = unpad(data_dict['targets']*std + mean, seq_lens)
+        new_data_dict['preprocessing'] = []
+        return new_data_dict
+
+    outputs = []
+    for data_dict in data_dicts:
+        if data_dict is not None:
+            outputs.append(operate_single_data(data_dict))
+        else:
+            outputs.append(None)
+
+    return outputs
+
+
+def get_cache_path(wav_file, cache_dir, sr=SAMPLINGRATE):
+    # Content-addressed cache entry: a renamed or moved file is still a hit, a modified file is a miss.
+    with open(wav_file, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return os.path.join(cache_dir, digest[:2], "%s_%i.npy" % (digest, sr))
+
+
+def load_wav_file(wav_file, cache_dir=WAV_CACHE_DIR, sr=SAMPLINGRATE):
+    if cache_dir is None:
+        return librosa.load(wav_file, sr=sr)[0]
+
+    cache_path = get_cache_path(wav_file, cache_dir, sr)
+    if os.path.exists(cache_path):
+        return np.load(cache_path)
+
+    wav = librosa.load(wav_file, sr=sr)[0].astype(np.float32)
+    if not os.path.isdir(os.path.dirname(cache_path)):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Write-then-rename so that an interrupted run doesn't leave a truncated entry.
+    tmp_path = cache_path + ".%i.tmp" % os.getpid()
+    with open(tmp_path, 'wb') as f:
+        np.save(f, wav)
+    os.replace(tmp_path, cache_path)
+    return wav
+
+
+def _load_wav_file_worker(args):
+    return load_wav_file(*args)
+
+
+def load_wav_files(files, num_workers=NUM_WORKERS, cache_dir=WAV_CACHE_DIR):
+    """
+    Decodes and resamples the wav files in a process pool. The files are returned in the given order.
+    """
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        wav_files = []
+        for i, wav in enumerate(pool.imap(_load_wav_file_worker, [(f, cache_dir, SAMPLINGRATE) for f in files], chunksize=16)):
+            wav_files.append(wav)
+            if (i+1) % 500 == 0 or (i+1) == len(files):
+                print("Loaded %i of %i files" % (i+1, len(files)))
+    finally:
+        pool.terminate()
     return wav_files
 
 
-def load_wav_files_relative_path(data_dir, files):
-    wav_files = []
-    for i, wav_name in enumerate(files):
-        wav_file = os.path.join(data_dir, wav_name)
-        print(i, wav_file)
-        wav_files += [librosa.load(wav_file, sr=SAMPLINGRATE)[0]]
-    return wav_files
+def load_wav_files_relative_path(data_dir, files, num_workers=NUM_WORKERS, cache_dir=WAV_CACHE_DIR):
+    return load_wav_files([os.path.join(data_dir, wav_name) for wav_name in files], num_workers, cache_dir)
 
 
 def make_muliple(x, outdim):
@@ -159,9 +232,8 @@ def create_timit_samples(train_vector, valid_vector, test_vector_lst):
     assert np.sum(u_train_vector[:, 1:] - x_train_vector[:, :-1]) == 0.0
     assert np.sum(u_valid_vector[:, 1:] - x_valid_vector[:, :-1]) == 0.0
 
-    for row in range(u_test_vector.shape[0]):
-        l = int(mask_test[row].sum())
-        assert np.sum(u_test_vector[row, 1:l] - x_test_vector[row, :l-1]) == 0.0
+    test_diff = (u_test_vector[:, 1:] - x_test_vector[:, :-1])*mask_test[:, 1:, np.newaxis]
+    assert np.all(test_diff.sum(axis=(1, 2)) == 0.0)
 
     return u_train_vector, u_valid_vector, u_test_vector, x_train_vector, x_valid_vector, x_test_vector, mask_test, m, sd
 
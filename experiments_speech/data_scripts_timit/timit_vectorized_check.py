@@ -0,0 +1,108 @@
+import argparse
+import numpy as np
+from timit_for_srnn import reorder, create_test_set, cancel_normalization, OUTDIM
+
+"""
+Validation of the vectorized TIMIT sample assembly. `reorder`, `create_test_set` and `cancel_normalization` are compared
+with the per-row implementations they replace on random data. The outputs are checked to be exactly the same.
+
+Example run command:
+    python timit_vectorized_check.py --num_files 100
+"""
+
+
+def reference_reorder(data_in, batch_size, model_seq_len, dtype='float32'):
+    model_seq_len = int(model_seq_len)
+    last_dim = data_in.shape[-1]
+    if data_in.shape[0] % (batch_size * model_seq_len) == 0:
+        data_in = data_in[:-1]
+
+    data_resize = int((data_in.shape[0] // (batch_size * model_seq_len)) * model_seq_len * batch_size)
+    n_samples = int(data_resize // (model_seq_len))
+    n_batches = int(n_samples // batch_size)
+
+    u_out = data_in[:data_resize].reshape((n_samples, model_seq_len, last_dim))
+    x_out = data_in[1:data_resize + 1].reshape((n_samples, model_seq_len, last_dim))
+
+    out = np.zeros(n_samples, dtype='int32')
+    for i in range(n_batches):
+        val = range(i, n_batches * batch_size + i, n_batches)
+        out[i * batch_size:(i + 1) * batch_size] = val
+
+    return u_out[out].astype(dtype), x_out[out].astype(dtype)
+
+
+def reference_create_test_set(x_lst):
+    n = len(x_lst)
+    x_lens = np.array([x.shape[0] for x in x_lst])
+    max_len = x_lens.max() - 1
+    u_out = np.zeros((n, max_len, OUTDIM), dtype='float32')*np.nan
+    x_out = np.zeros((n, max_len, OUTDIM), dtype='float32')*np.nan
+    for row, vec in enumerate(x_lst):
+        l = len(vec) - 1
+        x_out[row, :l] = vec[1:]
+        u_out[row, :l] = vec[:-1]
+
+    mask = np.invert(np.isnan(x_out))
+    x_out[np.isnan(x_out)] = 0
+    u_out[np.isnan(u_out)] = 0
+    return u_out, x_out, mask[:, :, 0].astype('float32')
+
+
+def reference_cancel_normalization(data_dict):
+    new_data_dict = dict(samples=[], targets=[], preprocessing=[])
+    mask_key = "mask_test" if "mask_test" in data_dict else "masks"
+    mean, std = data_dict['mean'], data_dict['std']
+    for idx in range(data_dict['samples'].shape[0]):
+        sample = data_dict['samples'][idx]
+        target = data_dict['targets'][idx]
+        if mask_key in data_dict:
+            seq_len = int(data_dict[mask_key][idx].sum())
+            sample = sample[:seq_len]
+            target = target[:seq_len]
+        new_data_dict['samples'].append(sample*std + mean)
+        new_data_dict['targets'].append(target*std + mean)
+    return new_data_dict
+
+
+def assert_same_list(reference, vectorized, name):
+    assert len(reference) == len(vectorized), name + " lengths differ."
+    for ref, vec in zip(reference, vectorized):
+        assert ref.dtype == vec.dtype and np.array_equal(ref, vec), name + " outputs differ."
+
+
+def check_vectorized_implementations(num_files=100, batch_size=8, seq_len=40, seed=0):
+    """
+    Raises an AssertionError if a vectorized implementation doesn't reproduce the reference output.
+    """
+    rng = np.random.RandomState(seed)
+    mean, std = np.float32(rng.randn()), np.float32(rng.rand() + 0.5)
+
+    stream = rng.randn(batch_size*seq_len*7 + 3, OUTDIM).astype(np.float32)
+    for data_in in [stream, stream[:batch_size*seq_len*7]]:
+        for ref, vec in zip(reference_reorder(data_in, batch_size, seq_len), reorder(data_in, batch_size, seq_len)):
+            assert ref.dtype == vec.dtype and np.array_equal(ref, vec), "reorder outputs differ."
+
+    files = [((rng.randn(rng.randint(2, 60), OUTDIM) - mean)/std).astype(np.float32) for _ in range(num_files)]
+    u_test, x_test, mask_test = create_test_set(files)
+    for ref, vec in zip(reference_create_test_set(files), [u_test, x_test, mask_test]):
+        assert ref.dtype == vec.dtype and np.array_equal(ref, vec), "create_test_set outputs differ."
+
+    u_train, x_train = reorder(stream, batch_size, seq_len)
+    for data_dict in [dict(samples=u_train, targets=x_train, mean=mean, std=std),
+                      dict(samples=u_test, targets=x_test, masks=mask_test, mean=mean, std=std)]:
+        reference = reference_cancel_normalization(data_dict)
+        vectorized = cancel_normalization([data_dict, None])
+        assert vectorized[1] is None
+        for key in ['samples', 'targets']:
+            assert_same_list(reference[key], vectorized[0][key], "cancel_normalization")
+    print("Vectorized implementations match the reference implementations.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_files', type=int, default=100, help='Number of random test files.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    check_vectorized_implementations(num_files=args.num_files, seed=args.seed)
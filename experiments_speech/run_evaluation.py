@@ -6,12 +6,12 @@ import os
 import argparse
 import glob
 import time
-import math
 import warnings
 
 from tf_dataset import *
 from tf_models import *
-from tf_data_feeder import DataFeederTF
+from tf_data_feeder import EvaluationDataFeederTF
+from utils import get_session_config
 from loss import kld_normal_isotropic
 from configuration_speech import SpeechConfiguration as Configuration
 
@@ -109,7 +109,7 @@ def visualize_audio_samples(samples, ids, output_path, color_labels=None):
     pass
 
 
-def do_evaluation(config_obj, qualitative_analysis=True, quantitative_analysis=True, verbose=0):
+def do_evaluation(config_obj, qualitative_analysis=True, quantitative_analysis=True, verbose=0, streaming_chunk_size=0, num_importance_samples=1, importance_samples_per_pass=0):
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
     Model_cls = config_obj.model_cls
@@ -156,24 +156,17 @@ def do_evaluation(config_obj, qualitative_analysis=True, quantitative_analysis=T
         eval_data_path = config_obj.get('validation_data')
 
     evaluation_dataset = Dataset_cls(eval_data_path, preprocessing_ops=preprocessing_ops, var_len_seq=True)
-    num_validation_iterations = math.ceil(evaluation_dataset.num_samples/batch_size)
 
-    # Only use 1 queue thread, otherwise validation loop it gets blocked.
-    valid_data_feeder = DataFeederTF(evaluation_dataset, 1, batch_size, queue_capacity=1024, shuffle=False, allow_smaller_final_batch=True)
-    data_placeholders = valid_data_feeder.batch_queue(dynamic_pad=evaluation_dataset.is_dynamic, queue_capacity=512, queue_threads=4)
+    # Iterates over every sample once and in order, including the final smaller batch.
+    valid_data_feeder = EvaluationDataFeederTF(evaluation_dataset, batch_size, num_readers=config_obj.get('feeder_threads', 4))
+    data_placeholders = valid_data_feeder.batch
 
     # Create a session object and initialize parameters.
-    gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.95, allow_growth=True)
-    sess = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options, allow_soft_placement=True))
+    sess = tf.Session(config=get_session_config(config_obj))
 
-    if quantitative_analysis:
-        # Start filling the queues.
-        # Run model on validation data an report performance under the metric used for training.
-        coord = tf.train.Coordinator()
-        if config_obj.get('validate_model', False):
-            valid_data_feeder.init(sess, coord)
-        queue_threads = tf.train.start_queue_runners(coord=coord, sess=sess, start=True)
-        # queue_threads.append(valid_data_feeder.enqueue_threads)
+    # Streaming and importance-weighted evaluations feed the samples one by one. Hence, the data feeder is not used.
+    importance_weighted = quantitative_analysis and num_importance_samples > 1
+    use_data_feeder = quantitative_analysis and streaming_chunk_size < 1 and not importance_weighted
 
     print("Building the Network...")
     with tf.name_scope("validation"):
@@ -187,6 +180,19 @@ def do_evaluation(config_obj, qualitative_analysis=True, quantitative_analysis=T
         validation_model.build_graph()
         validation_model.ops_for_eval_mode[C.OUT_MU] = tf.nn.sigmoid(validation_model.ops_model_output[C.OUT_MU])
 
+    if importance_weighted:
+        # Repeats every sequence `importance_samples_per_pass` times in the graph.
+        with tf.name_scope("importance_weighted"):
+            importance_model = Model_cls(config=config_obj,
+                                         session=sess,
+                                         reuse=True,
+                                         mode=C.EVAL,
+                                         placeholders=data_placeholders,
+                                         input_dims=evaluation_dataset.input_dims,
+                                         target_dims=evaluation_dataset.target_dims,
+                                         importance_samples_per_pass=importance_samples_per_pass or num_importance_samples)
+            importance_model.build_graph()
+
     if qualitative_analysis:
         with tf.name_scope("sampling"):
             sampling_model = Model_cls(config=config_obj,
@@ -216,13 +222,12 @@ def do_evaluation(config_obj, qualitative_analysis=True, quantitative_analysis=T
     if quantitative_analysis:
         print("Calculating likelihood...")
         # Get final validation error.
-        valid_summary, valid_eval_loss = validation_model.evaluation_step_test_time(coord, queue_threads, 1, 1, num_validation_iterations)
-        try:
-            sess.run(valid_data_feeder.input_queue.close(cancel_pending_enqueues=True))
-            coord.request_stop()
-            coord.join(queue_threads, stop_grace_period_secs=5)
-        except:
-            pass
+        if use_data_feeder:
+            valid_summary, valid_eval_loss = validation_model.evaluation_step(1, 1, iterator_initializer=valid_data_feeder.initializer)
+        elif importance_weighted:
+            valid_eval_loss = importance_model.evaluation_step_importance_weighted(evaluation_dataset, num_importance_samples)
+        else:
+            valid_summary, valid_eval_loss = validation_model.evaluation_step_streaming(evaluation_dataset, streaming_chunk_size)
 
     if qualitative_analysis:
         print("Generating samples...")
@@ -319,4 +324,4 @@ if __name__ == '__main__':
         os.makedirs(config.get('eval_dir'))
 
     config.dump(config.get('eval_dir'))
-    do_evaluation(config, quantitative_analysis=args.quantitative, qualitative_analysis=args.qualitative, verbose=args.verbose)
\ No newline at end of file
+    do_evaluation(config, quantitative_analysis=args.quantitative, qualitative_analysis=args.qualitative, verbose=args.verbose, streaming_chunk_size=args.streaming_chunk_size, num_importance_samples=args.num_importance_samples, importance_samples_per_pass=args.importance_samples_per_pass)
\ No newline at end of file
@@ -1,5 +1,6 @@
 import tensorflow as tf
 from tf_train import TrainingEngine
+from tf_autotune import autotune_session_config, run_in_subprocess
 from constants import Constants as C
 from configuration_speech import SpeechConfiguration as Configuration
 from run_evaluation import do_evaluation
@@ -13,9 +14,9 @@ Example run command for STCN-dense model with GMM outputs on Blizzard dataset.
     python run_training.py 
         --experiment_name <a descriptive name such as `stcn_dense_gmm`>
         --json_file ./config_blizzard/stcn_dense_gmm.json 
-        --training_data <PATH-TO>/blizzard_stcn_training.npz 
-        --validation_data <PATH-TO>/blizzard_stcn_validation.npz  
-        --test_data <PATH-TO>/blizzard_stcn_test.npz 
+        --training_data <PATH-TO>/blizzard_stcn_training 
+        --validation_data <PATH-TO>/blizzard_stcn_validation  
+        --test_data <PATH-TO>/blizzard_stcn_test 
         --save_dir <PATH-TO>/runs 
         --eval_dir <PATH-TO>/evaluation_runs  
         --pp_zero_mean_norm_all_stats 
@@ -25,9 +26,9 @@ Example run command for Wavenet model with GMM outputs on TIMIT dataset.
     python run_training.py 
         --experiment_name <a descriptive name such as `wavenet_gmm`> 
         --json_file ./config_timit/wavenet_gmm.json 
-        --training_data <PATH-TO>/timit_stcn_training.npz 
-        --validation_data <PATH-TO>/timit_stcn_validation.npz 
-        --test_data <PATH-TO>/timit_stcn_test.npz 
+        --training_data <PATH-TO>/timit_stcn_training 
+        --validation_data <PATH-TO>/timit_stcn_validation 
+        --test_data <PATH-TO>/timit_stcn_test 
         --save_dir <PATH-TO>/runs 
         --eval_dir <PATH-TO>/evaluation_runs
         --pp_zero_mean_norm_all_stats 
@@ -38,14 +39,19 @@ Example run command for Wavenet model with GMM outputs on TIMIT dataset.
 def run_training(config_obj, early_stopping_tolerance=10, run_evaluation_after_training=False):
     training_engine = TrainingEngine(config_obj, early_stopping_tolerance)
     training_engine.run()
-    if config_obj.get("eval_dir", None) and run_evaluation_after_training:
+    # In distributed training, only the chief worker evaluates the model.
+    if training_engine.is_chief and config_obj.get("eval_dir", None) and run_evaluation_after_training:
         config_obj.set('eval_dir', os.path.join(config_obj.get("eval_dir"), config_obj.get('model_id')), override=True)
         if not os.path.exists(config_obj.get('eval_dir')):
             os.makedirs(config_obj.get('eval_dir'))
-        config_obj.dump(config.get('eval_dir'))
+        config_obj.dump(config_obj.get('eval_dir'))
         do_evaluation(config_obj, qualitative_analysis=True, quantitative_analysis=True, verbose=1)
 
 
+def run_training_process(config_cls, config_dict, early_stopping_tolerance=10, run_evaluation_after_training=False):
+    run_training(config_cls(**config_dict), early_stopping_tolerance, run_evaluation_after_training)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     Configuration.define_training_setup(parser)
@@ -72,5 +78,14 @@ if __name__ == '__main__':
 
     config = Configuration(**{**config_dict, **args_dict})
     config.set_experiment_name(experiment_name=args.experiment_name)
-    run_training(config, run_evaluation_after_training=args.run_evaluation_after_training, early_stopping_tolerance=10)
+    if args.autotune and args.task_type is None:
+        if args.model_id is not None:
+            autotune_file = os.path.join(config.get('model_dir'), 'autotune.json')
+        else:
+            autotune_file = os.path.splitext(args.json_file)[0] + "_autotune.json"
+        autotune_session_config(config, num_steps=args.autotune_steps, output_file=autotune_file)
+        # Thread pools of tensorflow are fixed in this process. Train in a fresh process with the best settings.
+        run_in_subprocess(run_training_process, Configuration, dict(config.config), run_evaluation_after_training=args.run_evaluation_after_training, early_stopping_tolerance=10)
+    else:
+        run_training(config, run_evaluation_after_training=args.run_evaluation_after_training, early_stopping_tolerance=10)
 
@@ -101,6 +101,15 @@ class Configuration(object):
         parser.add_argument('--'+C.PP_ZERO_MEAN_NORM, action="store_true", help='Applies zero-mean unit-variance normalization.')
         parser.add_argument('--'+C.PP_ZERO_MEAN_NORM_SEQ, action="store_true", help='Applies zero-mean unit-variance normalization with sequence stats.')
         parser.add_argument('--'+C.PP_ZERO_MEAN_NORM_ALL, action="store_true", help='Applies zero-mean unit-variance normalization with stats calcualted by using all data entries.')
+        # Distributed training.
+        parser.add_argument('--task_type', type=str, default=None, choices=[C.TASK_PS, C.TASK_WORKER], help='Role of this process in the cluster. If not set, training runs in a single process.')
+        parser.add_argument('--task_index', type=int, default=0, help='Index of this task within its role.')
+        parser.add_argument('--ps_hosts', type=str, default="localhost:2222", help='Comma separated list of parameter server host:port pairs.')
+        parser.add_argument('--worker_hosts', type=str, default="localhost:2223", help='Comma separated list of worker host:port pairs.')
+        parser.add_argument('--sync_replicas', action="store_true", help='Aggregates worker gradients synchronously. Otherwise workers update asynchronously.')
+        # CPU threading.
+        parser.add_argument('--autotune', action="store_true", help='Runs short training trials to pick CPU threading settings before training. Every trial and the training run in new processes. Best settings are written into <json_file>_autotune.json.')
+        parser.add_argument('--autotune_steps', type=int, default=20, help='Number of timed training steps per autotune trial.')
 
     @staticmethod
     def define_evaluation_setup(parser):
@@ -124,6 +133,9 @@ class Configuration(object):
         parser.add_argument('--qualitative', action="store_true", help='Run qualitative analysis.')
         parser.add_argument('--verbose', dest='verbose', type=int, default=0, help='Verbosity of logs.')
         parser.add_argument('--seed', dest='seed', type=int, default=None, help='Seed value.')
+        parser.add_argument('--streaming_chunk_size', type=int, default=0, help='If positive, evaluates the likelihood of sequences in chunks of this many steps. Memory usage is bounded by the chunk size.')
+        parser.add_argument('--num_importance_samples', type=int, default=1, help='If larger than 1, evaluates the importance-weighted bound of latent variable models with this many latent samples per sequence.')
+        parser.add_argument('--importance_samples_per_pass', type=int, default=0, help='Number of latent samples drawn in a single pass in importance-weighted evaluation. Lower values require less memory. If not set, all samples are drawn at once.')
 
     def set_experiment_name(self, use_template=True, experiment_name=None):
         """
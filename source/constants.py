@@ -11,10 +11,15 @@ class Constants(object):
     EVAL = 'evaluation'
     SAMPLE = 'sampling'
 
+    # Distributed training roles.
+    TASK_PS = 'ps'
+    TASK_WORKER = 'worker'
+
     # RNN cells
     GRU = 'gru'
     LSTM = 'lstm'
     BLSTM = 'blstm'
+    FUSED_LSTM = 'fused_lstm'  # Runs the whole sequence with a single op. See `FusedRNNLayer`.
     LayerNormLSTM = 'LayerNormBasicLSTMCell'
 
     # Activation functions
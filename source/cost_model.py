@@ -0,0 +1,516 @@
+import argparse
+import json
+from constants import Constants as C
+
+"""
+Static cost model of the models in `tf_models.py`. Given a json configuration and the data shape, it estimates without
+building a graph:
+- number of parameters (the same as `log_num_parameters`, i.e., model variables and the global step),
+- forward pass FLOPs of every layer for a batch (2 FLOPs per multiply-add of convolutions, dense layers and RNN cells.
+Element-wise operations are ignored.),
+- activation memory for a training batch, i.e., layer outputs that are kept for the backward pass (float32). If
+`recompute_segment_size` is set, only the outputs of the largest segment are kept in addition to the segment outputs.
+- receptive field size (see `receptive_field_size`),
+- FLOPs of drawing one step in sampling mode, following the `sample_function` of the model.
+
+Supported models are TCN, StochasticTCN with ladder latent layers, RNNAutoRegressive and VRNN. The costs follow the
+layer construction of the models. Hence, they need to be updated if the architectures change.
+
+Example run command:
+    python cost_model.py --json_file ../experiments_speech/config_timit/stcn_dense_gmm.json --input_dims 200 --target_dims 200 --sequence_length 40
+    python cost_model.py --json_file ../experiments_ink/config_iamondb/stcn.json --input_dims 3 --target_dims 2,1 --sequence_length 300
+"""
+
+BYTES_PER_VALUE = 4  # float32
+
+
+def receptive_field_size(filter_size, dilation_size_list):
+    """
+    Number of input steps a causal convolution stack with the given dilations has access to.
+    """
+    return (filter_size - 1)*sum(dilation_size_list) + 1
+
+
+class LayerCosts(object):
+    """
+    Keeps a list of layers with their number of parameters, forward FLOPs and number of activations (for a batch).
+
+    Args:
+        batch_size (int):
+    """
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.layers = []
+
+    def add(self, name, num_parameters, flops, num_activations, segment=None):
+        self.layers.append({'name': name,
+                            'parameters': int(num_parameters),
+                            'flops': int(flops),
+                            'activations': int(num_activations),
+                            'segment': segment})
+
+    def conv1d(self, name, seq_len, in_channels, out_channels, kernel_size=1, dilation=1, zero_padding=True, activation=True, segment=None):
+        """
+        `tf.layers.conv1d` with `valid` padding on an input that is optionally padded at the beginning.
+
+        Returns:
+            (int): output sequence length.
+        """
+        out_len = seq_len if zero_padding else seq_len - (kernel_size - 1)*dilation
+        num_parameters = kernel_size*in_channels*out_channels + out_channels
+        flops = 2*kernel_size*in_channels*out_channels*out_len*self.batch_size
+        num_activations = out_channels*out_len*self.batch_size*(2 if activation else 1)
+        self.add(name, num_parameters, flops, num_activations, segment)
+        return out_len
+
+    def dense(self, name, num_steps, in_units, out_units, activation=True, batch_norm=False):
+        """
+        `linear` layer of `tf_model_utils` applied on every step.
+        """
+        num_parameters = in_units*out_units + out_units
+        if batch_norm and activation:
+            num_parameters += 4*out_units  # gamma, beta, moving mean and moving variance.
+        flops = 2*in_units*out_units*num_steps*self.batch_size
+        num_activations = out_units*num_steps*self.batch_size*(2 if activation else 1)
+        self.add(name, num_parameters, flops, num_activations)
+
+    def elementwise(self, name, seq_len, channels, segment=None):
+        """
+        Parameter-free layers such as gating or residual additions. Only the outputs are counted.
+        """
+        self.add(name, 0, 0, channels*seq_len*self.batch_size, segment)
+
+    def rnn(self, name, num_steps, in_units, cell_config):
+        """
+        Stacked RNN cells created by `get_rnn_cell`.
+
+        Returns:
+            (int): output size.
+        """
+        cell_type = cell_config['cell_type'].lower()
+        size = cell_config['size']
+        for i in range(cell_config.get('num_layers', 1)):
+            if cell_type in [C.LSTM, C.BLSTM, C.FUSED_LSTM]:
+                num_parameters = (in_units + size)*4*size + 4*size
+                flops = 2*(in_units + size)*4*size
+                num_activations = 6*size  # Gates, cell and hidden states.
+            elif cell_type == C.GRU:
+                num_parameters = (in_units + size)*3*size + 3*size
+                flops = 2*(in_units + size)*3*size
+                num_activations = 4*size
+            elif cell_type == C.LayerNormLSTM.lower():
+                num_parameters = (in_units + size)*4*size + 10*size  # No bias, layer norm gain and shift for 4 gates and cell.
+                flops = 2*(in_units + size)*4*size
+                num_activations = 10*size
+            else:
+                raise Exception("Unsupported RNN Cell.")
+            self.add(name + "/cell_" + str(i), num_parameters, flops*num_steps*self.batch_size, num_activations*num_steps*self.batch_size)
+            in_units = size
+        return size
+
+    @property
+    def num_parameters(self):
+        return sum([layer['parameters'] for layer in self.layers])
+
+    @property
+    def flops(self):
+        return sum([layer['flops'] for layer in self.layers])
+
+    @property
+    def activation_memory(self):
+        """
+        Bytes of activations kept for the backward pass. Activations of recomputed segments are counted only for the
+        largest segment.
+        """
+        num_activations = sum([layer['activations'] for layer in self.layers if layer['segment'] is None])
+        segments = dict()
+        for layer in self.layers:
+            if layer['segment'] is not None:
+                segments[layer['segment']] = segments.get(layer['segment'], 0) + layer['activations']
+        if len(segments) > 0:
+            num_activations += max(segments.values())
+        return num_activations*BYTES_PER_VALUE
+
+
+def get_output_dims(loss_config, target_dims):
+    """
+    Output layer sizes created by `BaseTemporalModel.define_loss`.
+
+    Returns:
+        (list): (output key, size) pairs.
+    """
+    outputs = []
+    for loss_entry in loss_config.values():
+        key, loss_type = loss_entry['out_key'], loss_entry['type']
+        target_size = target_dims[loss_entry['target_idx']]
+        if loss_type in [C.NLL_NORMAL, C.NLL_BINORMAL]:
+            outputs.extend([(key + C.SUF_MU, target_size), (key + C.SUF_SIGMA, target_size)])
+        if loss_type == C.NLL_BINORMAL:
+            outputs.append((key + C.SUF_RHO, 1))
+        if loss_type in [C.NLL_GMM, C.NLL_BIGMM]:
+            num_components = loss_entry['num_components']
+            outputs.extend([(key + C.SUF_MU, target_size*num_components),
+                            (key + C.SUF_SIGMA, target_size*num_components),
+                            (key + C.SUF_COEFFICIENT, num_components)])
+        if loss_type == C.NLL_BIGMM:
+            outputs.append((key + C.SUF_RHO, loss_entry['num_components']))
+        if loss_type == C.NLL_BERNOULLI:
+            outputs.append((key + C.SUF_BINARY, target_size))
+        if loss_type in [C.NLL_CENT, C.NLL_CENT_BINARY]:
+            outputs.append((key + C.SUF_MU, target_size))
+    return outputs
+
+
+def temporal_block_costs(costs, name, seq_len, in_channels, num_filters, kernel_size, dilation, use_gate, use_residual, zero_padding, segment=None):
+    """
+    Costs of `TCN.temporal_block`.
+
+    Returns:
+        (int): output sequence length.
+    """
+    if use_gate:
+        out_len = costs.conv1d(name + "/filter_conv", seq_len, in_channels, num_filters, kernel_size, dilation, zero_padding, segment=segment)
+        costs.conv1d(name + "/gate_conv", seq_len, in_channels, num_filters, kernel_size, dilation, zero_padding, segment=segment)
+        costs.elementwise(name + "/gating", out_len, num_filters, segment=segment)
+    else:
+        out_len = costs.conv1d(name + "/causal_layer", seq_len, in_channels, num_filters, kernel_size, dilation, zero_padding, segment=segment)
+    costs.conv1d(name + "/block_output", out_len, num_filters, num_filters, activation=False, segment=segment)
+    if use_residual:
+        if in_channels != num_filters:
+            costs.conv1d(name + "/residual_layer", seq_len, in_channels, num_filters, activation=False, segment=segment)
+        costs.elementwise(name + "/residual_add", out_len, num_filters, segment=segment)
+    return out_len
+
+
+def temporal_stack_costs(costs, name, seq_len, in_channels, cnn_config, num_layers, kernel_size, is_training):
+    """
+    Costs of `TCN.build_temporal_block`. Blocks are assigned to recomputed segments if `recompute_segment_size` is set.
+
+    Returns:
+        (int): output sequence length.
+    """
+    segment_size = cnn_config.get('recompute_segment_size', 0)
+    for idx in range(num_layers):
+        segment = None
+        if is_training and segment_size > 0:
+            segment = name + "_segment_" + str(idx//segment_size)
+            # Output of a block is kept if it is the last block of the segment. Other kept outputs are ignored.
+            if (idx + 1) % segment_size == 0 or idx == num_layers - 1:
+                costs.elementwise(name + "/temporal_block_" + str(idx + 1) + "/kept_output", seq_len, cnn_config['num_filters'])
+        seq_len = temporal_block_costs(costs, name + "/temporal_block_" + str(idx + 1), seq_len, in_channels,
+                                       cnn_config['num_filters'], kernel_size, cnn_config['dilation_size'][idx],
+                                       cnn_config.get('use_gating', False), cnn_config.get('use_residual', False),
+                                       cnn_config.get('zero_padding', False), segment)
+        in_channels = cnn_config['num_filters']
+    return seq_len
+
+
+def latent_network_costs(costs, name, seq_len, in_channels, num_latent_units, latent_config):
+    """
+    Costs of a network parametrizing mu or sigma (or both if `shared_trunk`) of a latent variable. See
+    `LatentLayer.build_*_layer` methods.
+    """
+    structure = latent_config.get('layer_structure', C.LAYER_CONV1)
+    num_hidden_units = latent_config['num_hidden_units']
+    for i in range(latent_config['num_hidden_layers']):
+        if structure == C.LAYER_TCN:
+            temporal_block_costs(costs, name + "/hidden_" + str(i + 1), seq_len, in_channels, num_hidden_units,
+                                 latent_config.get('kernel_size', 1), latent_config.get('dilation', 1), True, False, True)
+        elif structure == C.LAYER_FC:
+            costs.dense(name + "/hidden_" + str(i + 1), seq_len, in_channels, num_hidden_units)
+        elif structure == C.LAYER_CONV1:
+            costs.conv1d(name + "/hidden_" + str(i + 1), seq_len, in_channels, num_hidden_units)
+        else:
+            raise Exception("Unknown latent layer type.")
+        in_channels = num_hidden_units
+
+    if structure == C.LAYER_TCN:
+        temporal_block_costs(costs, name + "/head", seq_len, in_channels, num_latent_units,
+                             latent_config.get('kernel_size', 1), latent_config.get('dilation', 1), True, False, True)
+    elif structure == C.LAYER_FC:
+        costs.dense(name + "/head", seq_len, in_channels, num_latent_units)
+    else:
+        costs.conv1d(name + "/head", seq_len, in_channels, num_latent_units)
+
+
+def ladder_latent_costs(costs, seq_len, num_filters, num_encoder_layers, latent_config, is_sampling):
+    """
+    Costs of `LadderLatentLayer`.
+
+    Returns:
+        (int): number of channels of the latent sample passed to the decoder.
+    """
+    vertical_dilation = latent_config.get('vertical_dilation', 1)
+    num_s_layers = int(num_encoder_layers/vertical_dilation)
+    latent_size = latent_config['latent_size'] if isinstance(latent_config['latent_size'], list) else [latent_config['latent_size']]*num_s_layers
+    top_down = latent_config.get('top_down_latents', True)
+    dynamic_prior = latent_config.get('dynamic_prior', False)
+    shared_trunk = latent_config.get('shared_trunk', False)
+
+    order = list(range(num_s_layers - 1, -1, -1)) if top_down else list(range(num_s_layers))
+    for i, sl in enumerate(order):
+        preceding_size = latent_size[order[i - 1]] if i > 0 else 0
+        dists = []
+        # Prior
+        if dynamic_prior and not (i == 0 and latent_config.get('use_fixed_pz1', False)):
+            dists.append((C.LATENT_P, num_filters + preceding_size))
+        elif i > 0:
+            dists.append((C.LATENT_P, preceding_size))
+        # Approximate posterior
+        if not (is_sampling and dynamic_prior):
+            recursive_q = latent_config.get('recursive_q', True) and i > 0
+            dists.append((C.LATENT_Q, num_filters + (preceding_size if recursive_q else 0)))
+
+        for scope, in_channels in dists:
+            scope = "latent/" + scope + "_" + str(sl + 1)
+            if shared_trunk:
+                latent_network_costs(costs, scope + "_trunk", seq_len, in_channels, 2*latent_size[sl], latent_config)
+            else:
+                latent_network_costs(costs, scope + "_mu", seq_len, in_channels, latent_size[sl], latent_config)
+                latent_network_costs(costs, scope + "_sigma", seq_len, in_channels, latent_size[sl], latent_config)
+
+    if latent_config.get('dense_z', False):
+        return sum(latent_size[:num_s_layers])
+    return latent_size[order[-1]]
+
+
+def output_layer_costs(costs, seq_len, in_channels, output_config, cnn_config, outputs):
+    """
+    Costs of `StochasticTCN.build_output_layer`.
+    """
+    out_layer_type = output_config.get('type', None) or C.LAYER_TCN
+    num_filters = cnn_config['num_filters'] if output_config.get('size', 0) < 1 else output_config.get('size')
+    if out_layer_type == C.LAYER_CONV1:
+        for idx in range(output_config.get('num_layers', 1)):
+            costs.conv1d("output_layer/out_conv1d_" + str(idx + 1), seq_len, in_channels, num_filters)
+            in_channels = num_filters
+    if out_layer_type == C.LAYER_TCN:
+        kernel_size = cnn_config['filter_size'] if output_config.get('filter_size', 0) < 1 else output_config.get('filter_size')
+        for idx in range(output_config.get('num_layers', 1)):
+            temporal_block_costs(costs, "output_layer/out_convCCN_" + str(idx + 1), seq_len, in_channels, num_filters,
+                                 kernel_size, 1, cnn_config.get('use_gating', False), cnn_config.get('use_residual', False), True)
+            in_channels = num_filters
+    for key, size in outputs:
+        costs.conv1d("output_layer/out_" + key, seq_len, in_channels, size, activation=False)
+
+
+def tcn_costs(config, input_dims, target_dims, seq_len, batch_size, mode=C.TRAIN):
+    """
+    Costs of `TCN` (i.e., Wavenet).
+    """
+    costs = LayerCosts(batch_size)
+    cnn_config = config['cnn_layer']
+    output_config = config['output_layer']
+    num_filters = cnn_config['num_filters']
+    zero_padding = cnn_config.get('zero_padding', False)
+
+    seq_len = costs.conv1d("causal_conv_layer_0", seq_len, sum(input_dims), num_filters, cnn_config['filter_size'], 1, zero_padding, activation=False)
+    seq_len = temporal_stack_costs(costs, "temporal_blocks", seq_len, num_filters, cnn_config, cnn_config['num_layers'], cnn_config['filter_size'], mode == C.TRAIN)
+
+    if cnn_config.get('use_skip', False):
+        in_channels = num_filters
+    else:
+        in_channels = num_filters*len(cnn_config.get('tcn_output_layer_idx', [-1]))
+    for idx in range(output_config.get('num_layers', 1)):
+        costs.conv1d("output_layer_hidden/conv1d_" + str(idx + 1), seq_len, in_channels, num_filters)
+        in_channels = num_filters
+    for key, size in get_output_dims(config['loss'], target_dims):
+        costs.conv1d("output_layer_" + key, seq_len, in_channels, size, activation=False)
+    return costs
+
+
+def stcn_costs(config, input_dims, target_dims, seq_len, batch_size, mode=C.TRAIN):
+    """
+    Costs of `StochasticTCN`. The input is shifted by one step. Hence the encoder runs on seq_len+1 steps.
+    """
+    costs = LayerCosts(batch_size)
+    cnn_config = config['cnn_layer']
+    latent_config = config['latent_layer']
+    num_filters = cnn_config['num_filters']
+    if latent_config['type'] != C.LATENT_LADDER_GAUSSIAN:
+        raise Exception("Only ladder latent layers are supported.")
+
+    enc_len = temporal_stack_costs(costs, "encoder", seq_len + 1, sum(input_dims), cnn_config, cnn_config['num_encoder_layers'], cnn_config['filter_size'], mode == C.TRAIN)
+    latent_len = enc_len - 1
+    decoder_channels = ladder_latent_costs(costs, latent_len, num_filters, cnn_config['num_encoder_layers'], latent_config, mode == C.SAMPLE)
+
+    if config.get('decoder_use_enc_skip', False):
+        decoder_channels += num_filters
+    if config.get('decoder_use_enc_last', False):
+        decoder_channels += num_filters
+    if config.get('decoder_use_raw_inputs', False):
+        decoder_channels += sum(input_dims)
+
+    num_decoder_layers = cnn_config.get('num_decoder_layers', 0)
+    if num_decoder_layers > 0:
+        decoder_filter_size = cnn_config.get("decoder_filter_size", cnn_config['filter_size'])
+        latent_len = temporal_stack_costs(costs, "decoder", latent_len, decoder_channels, cnn_config, num_decoder_layers, decoder_filter_size, mode == C.TRAIN)
+        decoder_channels = num_filters
+
+    output_layer_costs(costs, latent_len, decoder_channels, config['output_layer'], cnn_config, get_output_dims(config['loss'], target_dims))
+    return costs
+
+
+def fully_connected_costs(costs, name, num_steps, in_units, layer_config):
+    """
+    Costs of `fully_connected_layer` of `tf_model_utils`.
+
+    Returns:
+        (int): output size.
+    """
+    size = layer_config.get('size', 256)
+    for i in range(layer_config.get('num_layers', 1)):
+        costs.dense(name + "/dense_" + str(i + 1), num_steps, in_units, size, batch_norm=layer_config.get('use_batch_norm', False))
+        in_units = size
+    return in_units
+
+
+def rnn_costs(config, input_dims, target_dims, seq_len, batch_size, mode=C.TRAIN):
+    """
+    Costs of `RNNAutoRegressive`.
+    """
+    costs = LayerCosts(batch_size)
+    in_units = sum(input_dims)
+    input_config = config.get('input_layer', None)
+    if input_config is not None and input_config.get("num_layers", 0) > 0:
+        in_units = fully_connected_costs(costs, "input_layer", seq_len, in_units, input_config)
+
+    in_units = costs.rnn("rnn_layer", seq_len, in_units, config['rnn_layer'])
+    in_units = fully_connected_costs(costs, "output_layer_hidden", seq_len, in_units, config['output_layer'])
+    for key, size in get_output_dims(config['loss'], target_dims):
+        costs.dense("output_layer_" + key, seq_len, in_units, size, activation=False)
+    return costs
+
+
+def vrnn_costs(config, input_dims, target_dims, seq_len, batch_size, mode=C.TRAIN):
+    """
+    Costs of `VRNN` with `VRNNCell`. Both training and sampling modes build all of the cell components at every step.
+    """
+    costs = LayerCosts(batch_size)
+    h_dim = config['hidden_size']
+    latent_h_dim = config.get('latent_hidden_size', h_dim)
+    z_dim = config['latent_size']
+    num_linear_layers = config.get('num_fc_layers', 1)
+    batch_norm = config['use_batch_norm_fc']
+    latent_rnn_size = config['latent_rnn']['size']
+
+    def phi(name, in_units, count_parameters=True):
+        for i in range(num_linear_layers):
+            costs.dense(name + "/dense_" + str(i + 1), seq_len, in_units, h_dim, batch_norm=batch_norm)
+            if not count_parameters:
+                costs.layers[-1]['parameters'] = 0
+            in_units = h_dim
+        return h_dim
+
+    def latent(name, in_units):
+        costs.dense(name + "/hidden", seq_len, in_units, latent_h_dim, batch_norm=batch_norm)
+        costs.dense(name + "/mu", seq_len, latent_h_dim, z_dim, activation=False)
+        costs.dense(name + "/sigma", seq_len, latent_h_dim, z_dim)
+
+    if config.get('input_rnn', None):
+        phi_x_size = costs.rnn("phi_x_input", seq_len, input_dims[0], config['input_rnn'])
+    else:
+        phi_x_size = phi("phi_x_input", input_dims[0])
+
+    latent("latent_z_p", latent_rnn_size)
+    phi("phi_z", z_dim)
+    latent("latent_z_q", phi_x_size + latent_rnn_size)
+    phi("phi_z_q", z_dim, count_parameters=False)  # Shares parameters with phi_z.
+
+    output_in_units = h_dim + (latent_rnn_size if config.get('use_latent_h_in_outputs', True) else 0)
+    if config.get('output_rnn', None):
+        output_size = costs.rnn("phi_x_output", seq_len, output_in_units, config['output_rnn'])
+    else:
+        output_size = phi("phi_x_output", output_in_units)
+    for key, size in get_output_dims(config['loss'], target_dims):
+        costs.dense(key, seq_len, output_size, size, activation=False)
+
+    costs.rnn("latent_rnn", seq_len, phi_x_size + h_dim, config['latent_rnn'])
+    return costs
+
+
+def get_costs(config, input_dims, target_dims, seq_len, batch_size, mode=C.TRAIN):
+    """
+    Returns a `LayerCosts` object of the model given by `model_cls`.
+    """
+    model_cls = config['model_cls']
+    if model_cls == 'TCN':
+        return tcn_costs(config, input_dims, target_dims, seq_len, batch_size, mode)
+    elif model_cls == 'StochasticTCN':
+        return stcn_costs(config, input_dims, target_dims, seq_len, batch_size, mode)
+    elif model_cls == 'RNNAutoRegressive':
+        return rnn_costs(config, input_dims, target_dims, seq_len, batch_size, mode)
+    elif model_cls == 'VRNN':
+        return vrnn_costs(config, input_dims, target_dims, seq_len, batch_size, mode)
+    else:
+        raise Exception("Unknown model " + str(model_cls))
+
+
+def estimate_costs(config, input_dims, target_dims, seq_len, batch_size=None):
+    """
+    Estimates the costs of a model.
+
+    Args:
+        config (dict): experiment configuration.
+        input_dims (list): input feature sizes.
+        target_dims (list): target feature sizes.
+        seq_len (int): number of steps of training samples.
+        batch_size (int): if not set, the `batch_size` of the configuration is used.
+
+    Returns:
+        (dict): `num_parameters`, `layers` (list of per layer costs), `forward_flops` and `training_flops` (forward and
+            backward passes, approximated as 3x forward FLOPs) of a batch, `activation_memory` in bytes,
+            `receptive_field_size` and `sampling_flops_per_step` for a single sample.
+    """
+    batch_size = batch_size or config['batch_size']
+    training_costs = get_costs(config, input_dims, target_dims, seq_len, batch_size, C.TRAIN)
+
+    report = dict()
+    report['num_parameters'] = training_costs.num_parameters + 1  # global_step
+    report['layers'] = training_costs.layers
+    report['forward_flops'] = training_costs.flops
+    report['training_flops'] = 3*training_costs.flops
+    report['activation_memory'] = training_costs.activation_memory
+
+    if config['model_cls'] in ['TCN', 'StochasticTCN']:
+        cnn_config = config['cnn_layer']
+        report['receptive_field_size'] = receptive_field_size(cnn_config['filter_size'], cnn_config['dilation_size'])
+        # Every sampling step runs the model on the last `receptive_field_size` steps (+1 dummy step for STCN).
+        sampling_len = report['receptive_field_size'] + (1 if config['model_cls'] == 'StochasticTCN' else 0)
+        report['sampling_flops_per_step'] = get_costs(config, input_dims, target_dims, sampling_len, 1, C.SAMPLE).flops
+    else:
+        # Recurrent models have access to the whole history.
+        report['receptive_field_size'] = None
+        report['sampling_flops_per_step'] = get_costs(config, input_dims, target_dims, 1, 1, C.SAMPLE).flops
+    return report
+
+
+def print_report(report, verbose=True):
+    if verbose:
+        print("{:<60} {:>12} {:>16} {:>14}".format("layer", "parameters", "MFLOPs", "activations MB"))
+        for layer in report['layers']:
+            print("{:<60} {:>12} {:>16.2f} {:>14.2f}".format(layer['name'], layer['parameters'], layer['flops']/1e6,
+                                                             layer['activations']*BYTES_PER_VALUE/2**20))
+        print("")
+    print("# of parameters: " + str(report['num_parameters']))
+    print("Forward pass: {:.3f} GFLOPs/batch".format(report['forward_flops']/1e9))
+    print("Training step: {:.3f} GFLOPs/batch".format(report['training_flops']/1e9))
+    print("Activation memory: {:.1f} MB/batch".format(report['activation_memory']/2**20))
+    print("Receptive field size: " + str(report['receptive_field_size']))
+    print("Sampling: {:.3f} MFLOPs/step".format(report['sampling_flops_per_step']/1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json_file', required=True, type=str, help='Path to a configuration saved as json file.')
+    parser.add_argument('--input_dims', required=True, type=str, help='Comma separated input feature sizes.')
+    parser.add_argument('--target_dims', required=True, type=str, help='Comma separated target feature sizes.')
+    parser.add_argument('--sequence_length', required=True, type=int, help='Number of steps of training samples.')
+    parser.add_argument('--batch_size', type=int, default=None, help='If not set, batch size of the configuration is used.')
+    parser.add_argument('--summary', action="store_true", help='Prints only the summary.')
+    args = parser.parse_args()
+
+    config_dict = json.load(open(args.json_file, 'r'))
+    input_dims = [int(dim) for dim in args.input_dims.split(",")]
+    target_dims = [int(dim) for dim in args.target_dims.split(",")]
+    print_report(estimate_costs(config_dict, input_dims, target_dims, args.sequence_length, args.batch_size), verbose=not args.summary)
@@ -0,0 +1,155 @@
+import multiprocessing
+import numpy as np
+
+"""
+Exact streaming data statistics.
+
+- `RunningMoments` keeps count, mean, sum of squared deviations (M2), min and max. Every chunk is reduced once with its
+exact moments, which are then combined by the parallel update of Chan et al.:
+    delta = mean_b - mean_a
+    mean = mean_a + delta*n_b/n
+    M2 = M2_a + M2_b + delta^2*n_a*n_b/n
+Hence, the result does not depend on the chunking, and chunks can be reduced independently (i.e., in parallel).
+- `hdf5_moments` reduces consecutive row ranges of an hdf5 array in a process pool. Every chunk is read once.
+"""
+
+
+class RunningMoments(object):
+    """
+    Streaming mean, variance, min and max. If `axis` is None, statistics are calculated over all elements. Otherwise
+    the given axes are reduced, e.g. `axis=0` for per-channel statistics of (sequence_length, feature_size) samples.
+    """
+    def __init__(self, axis=None):
+        self.axis = axis
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, data):
+        """
+        Adds a chunk of data.
+
+        Args:
+            data (np.ndarray): chunk of data.
+
+        Returns:
+            (RunningMoments): self.
+        """
+        data = np.asarray(data)
+        count = data.size if self.axis is None else int(np.prod([data.shape[ax] for ax in np.atleast_1d(self.axis)]))
+        if count == 0:
+            return self
+        data64 = data.astype(np.float64)
+        chunk = RunningMoments(self.axis)
+        chunk.count = count
+        chunk.mean = data64.mean(axis=self.axis)
+        chunk.m2 = np.square(data64 - (chunk.mean if self.axis is None else np.expand_dims(chunk.mean, self.axis))).sum(axis=self.axis)
+        chunk.min = data.min(axis=self.axis)
+        chunk.max = data.max(axis=self.axis)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Combines the moments of another `RunningMoments` object calculated on disjoint data.
+
+        Args:
+            other (RunningMoments):
+
+        Returns:
+            (RunningMoments): self.
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.min, self.max = other.count, other.mean, other.m2, other.min, other.max
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta*(other.count/count)
+        self.m2 = self.m2 + other.m2 + np.square(delta)*(self.count*other.count/count)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count = count
+        return self
+
+    def to_dict(self):
+        """
+        Returns json serializable moments.
+        """
+        to_list = lambda value: np.asarray(value).tolist()
+        return dict(axis=self.axis, count=self.count, mean=to_list(self.mean), m2=to_list(self.m2),
+                    min=to_list(self.min) if self.count > 0 else None, max=to_list(self.max) if self.count > 0 else None)
+
+    @staticmethod
+    def from_dict(moments_dict):
+        moments = RunningMoments(moments_dict['axis'])
+        moments.count = moments_dict['count']
+        if moments.count > 0:
+            moments.mean = np.asarray(moments_dict['mean'])
+            moments.m2 = np.asarray(moments_dict['m2'])
+            moments.min = np.asarray(moments_dict['min'])
+            moments.max = np.asarray(moments_dict['max'])
+        return moments
+
+    @property
+    def variance(self):
+        """
+        Population variance.
+        """
+        return self.m2/max(self.count, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+def _hdf5_chunk_moments(args):
+    import tables
+    path, node_name, start, end, axis = args
+    with tables.open_file(path, mode='r') as hdf5_file:
+        return RunningMoments(axis).update(hdf5_file.get_node(node_name)[start:end])
+
+
+def hdf5_moments(path, node_name='/data', start=0, end=None, chunk_size=1000, num_workers=1, axis=None, verbose=False):
+    """
+    Calculates the moments of rows [start, end) of an hdf5 array by reading every chunk once.
+
+    Args:
+        path (str): path to the hdf5 file.
+        node_name (str): path to the array in the file.
+        start (int): first row.
+        end (int): last row (excluded). If None, number of rows.
+        chunk_size (int): number of rows per chunk.
+        num_workers (int): number of processes. If 1, chunks are reduced in this process.
+        axis: axes to reduce (see `RunningMoments`).
+        verbose (bool): prints the progress.
+
+    Returns:
+        (RunningMoments):
+    """
+    import tables
+    if end is None:
+        with tables.open_file(path, mode='r') as hdf5_file:
+            end = hdf5_file.get_node(node_name).nrows
+
+    chunks = [(path, node_name, i, min(i + chunk_size, end), axis) for i in range(start, end, chunk_size)]
+    moments = RunningMoments(axis)
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+        chunk_moments = pool.imap(_hdf5_chunk_moments, chunks)
+    else:
+        pool = None
+        chunk_moments = map(_hdf5_chunk_moments, chunks)
+
+    try:
+        for i, chunk in enumerate(chunk_moments):
+            moments.merge(chunk)
+            if verbose:
+                print("[%d / %d]" % (i + 1, len(chunks)))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return moments
@@ -1,6 +1,8 @@
+import os
 import numpy as np
 from constants import Constants
 from data_operators import Operator
+from sharded_dataset import load_sharded_dataset, dequantize, ShardedArray
 
 C = Constants()
 """
@@ -14,6 +16,9 @@ The `sample_generator` method returns a generator yielding one sample at a time
 `sample_shape` and `sample_tf_type`.
 
 The way the data is passed is not restricted. A child class can read the data from numpy array, list, dictionary, etc.
+A `data_path` directory is read as a sharded dataset (see `sharded_dataset.py`), i.e., samples are memory-mapped from
+the shards instead of being loaded into memory. If the data dictionary has `quantization` metadata, the samples are stored
+in a smaller data type (e.g. int16) and dequantized into float32 when they are fed.
 """
 
 
@@ -22,7 +27,9 @@ class BaseDataset(object):
     Acts as a data container. Loads and parses data, and provides basic functionality.
     """
     def __init__(self, data_path):
-        if isinstance(data_path, str):
+        if isinstance(data_path, str) and os.path.isdir(data_path):
+            self.data_dict = load_sharded_dataset(data_path)
+        elif isinstance(data_path, str):
             self.data_dict = dict(np.load(data_path))
         elif isinstance(data_path, dict):
             self.data_dict = data_path
@@ -35,10 +42,15 @@ class BaseDataset(object):
         self.sample_tf_type = None
         self.sample_key = None
 
-    def sample_generator(self):
+    def sample_generator(self, shard_index=0, num_shards=1):
         """
         Creates a generator object which returns one data sample at a time. It is used by DataFeeder objects.
 
+        Args:
+            shard_index (int): index of the shard to iterate over.
+            num_shards (int): if larger than 1, only every `num_shards`-th sample starting from `shard_index` is used.
+                It allows parallel readers without duplicates.
+
         Returns:
             (generator): that yields one sample consisting of a list of data elements.
         """
@@ -88,6 +100,7 @@ class Dataset(BaseDataset):
         # the sample or not.
         self.selector = None
 
+        self.quantization = self.data_dict['quantization'].tolist() if "quantization" in self.data_dict else None
         self.applied_preprocessing = self.data_dict['preprocessing'].tolist() if "preprocessing" in self.data_dict else []
         self.data_stats = self.data_dict.get('statistics').tolist() if 'statistics' in self.data_dict else {}
         self.data_stats["normalize_targets"] = True
@@ -148,20 +161,35 @@ class Dataset(BaseDataset):
         """
         return self.unnormalize(sample)
 
+    def dequantize(self, sample):
+        """
+        Converts a stored sample (or batch of samples) into float32 values if the data is quantized.
+        """
+        if self.quantization is None:
+            return sample
+        return dequantize(sample, **self.quantization)
+
     def preprocess_sample(self, input_sample, target_sample):
         if self.preprocessor is not None:
             input_sample, target_sample = self.preprocessor.apply(np.expand_dims(input_sample, axis=0),
                                                                   np.expand_dims(target_sample, axis=0))
         return input_sample[0], target_sample[0]
 
-    def sample_generator(self):
+    def sample_generator(self, shard_index=0, num_shards=1):
         """
         Creates a generator object which returns one data sample at a time. It is used by DataFeeder objects.
 
+        Args:
+            shard_index (int): index of the shard to iterate over.
+            num_shards (int): if larger than 1, only every `num_shards`-th sample starting from `shard_index` is used.
+
         Returns:
             (generator): each sample is a list of data elements.
         """
         for idx, [input_sample, target_sample, seq_len] in enumerate(zip(self.samples, self.targets, self.sequence_lengths)):
+            if idx % num_shards != shard_index:
+                continue
+            input_sample, target_sample = self.dequantize(input_sample), self.dequantize(target_sample)
             if self.perturbator is not None:
                 input_sample = self.perturbator(input_sample)
 
@@ -205,8 +233,8 @@ class Dataset(BaseDataset):
                 batch_targets = np.zeros((batch_size, max_len, self.target_feature_size))
                 batch_mask = np.zeros((batch_size, max_len))
                 for id, sample_idx in enumerate(batch_sample_idx):
-                    batch_inputs[id] = self.samples[sample_idx]
-                    batch_targets[id] = self.targets[sample_idx]
+                    batch_inputs[id] = self.dequantize(self.samples[sample_idx])
+                    batch_targets[id] = self.dequantize(self.targets[sample_idx])
                     batch_mask[id] = np.ones((batch_seq_len[id]))
 
                 yield [batch_seq_len, batch_inputs, batch_targets, batch_mask]
@@ -227,8 +255,8 @@ class Dataset(BaseDataset):
         shortest_seq_len = np.inf
         seq_len_list, input_sample_list, target_sample_list = [], [], []
         for i in sample_idx:
-            input_sample = self.samples[i]
-            target_sample = self.targets[i]
+            input_sample = self.dequantize(self.samples[i])
+            target_sample = self.dequantize(self.targets[i])
             seq_len = self.sequence_lengths[i]
             shortest_seq_len = seq_len if shortest_seq_len > seq_len else shortest_seq_len
 
@@ -259,6 +287,8 @@ class Dataset(BaseDataset):
         Returns (np.array):
             List of lengths of each sequence sample in the dataset.
         """
+        if isinstance(self.samples, ShardedArray):
+            return self.samples.sequence_lengths()
         return np.array([s.shape[0] for s in self.samples], dtype=np.int32)
 
     def __get_seq_len(self):
@@ -345,8 +375,8 @@ class PaddedDataset(Dataset):
             indices = np.arange(self.num_samples)
 
         for batch_indices in chunk(indices, batch_size):
-            batch_input = self.samples[batch_indices]
-            batch_target = self.targets[batch_indices]
+            batch_input = self.dequantize(self.samples[batch_indices])
+            batch_target = self.dequantize(self.targets[batch_indices])
 
             if return_mask:
                 batch_seq_len = self.masks[batch_indices]
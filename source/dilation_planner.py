@@ -0,0 +1,204 @@
+import argparse
+import copy
+import json
+from cost_model import estimate_costs, receptive_field_size
+
+"""
+Searches dilation schedules of TCN and StochasticTCN models reaching a target receptive field at minimum cost.
+
+- Candidate schedules are cycles of exponentially increasing dilations [1, b, b^2, ..., b^(c-1)] repeated r times (i.e.,
+the Wavenet schedule), for every `filter_size`, base b and cycle length c. The base is at most `filter_size` so that the
+receptive field has no holes. Schedules with a receptive field out of [target, max_receptive_field] are skipped.
+- For StochasticTCN models every divisor of the number of encoder layers is tried as `vertical_dilation`, as long as the
+number of latent layers is allowed. `latent_size` list of the base configuration is truncated or extended with its last
+entry.
+- The cost of a candidate is estimated by `cost_model.estimate_costs` on the base configuration with the new
+`cnn_layer` and `latent_layer` blocks. Candidates exceeding the budget are discarded. The remaining ones on the Pareto
+front of cost against receptive field are reported, cheapest first.
+
+Example run command:
+    python dilation_planner.py --json_file ../experiments_speech/config_blizzard/stcn_dense_gmm.json --input_dims 200 --target_dims 200 --sequence_length 40 --receptive_field 156 --output_file ./blizzard_schedules.json
+"""
+
+COST_KEYS = ['training_flops', 'sampling_flops_per_step', 'activation_memory', 'num_parameters']
+
+
+def get_dilation_schedules(filter_size, min_receptive_field, max_receptive_field, max_layers, max_cycle_length=10):
+    """
+    Generates repeated exponential dilation cycles.
+
+    Args:
+        filter_size (int):
+        min_receptive_field (int): schedules with smaller receptive field are skipped.
+        max_receptive_field (int): schedules with larger receptive field are skipped.
+        max_layers (int): maximum number of convolutional layers.
+        max_cycle_length (int): maximum number of layers in a cycle.
+
+    Returns:
+        (list): list of dilation lists.
+    """
+    schedules = []
+    for base in range(2, max(2, filter_size) + 1):
+        for cycle_length in range(1, min(max_layers, max_cycle_length) + 1):
+            if base > 2 and cycle_length == 1:
+                continue  # Same as base 2.
+            cycle = [base**i for i in range(cycle_length)]
+            for num_cycles in range(1, max_layers//cycle_length + 1):
+                dilations = cycle*num_cycles
+                rf = receptive_field_size(filter_size, dilations)
+                if rf > max_receptive_field:
+                    break
+                if rf >= min_receptive_field and dilations not in schedules:
+                    schedules.append(dilations)
+    return schedules
+
+
+def get_latent_config(latent_config, num_encoder_layers, vertical_dilation):
+    """
+    Creates `latent_layer` block for the given number of stochastic layers.
+    """
+    new_config = copy.deepcopy(latent_config)
+    new_config['vertical_dilation'] = vertical_dilation
+    num_s_layers = num_encoder_layers//vertical_dilation
+    latent_size = latent_config['latent_size']
+    if isinstance(latent_size, list):
+        new_config['latent_size'] = latent_size[:num_s_layers] + [latent_size[-1]]*max(0, num_s_layers - len(latent_size))
+    return new_config
+
+
+def get_candidates(config, filter_sizes, min_receptive_field, max_receptive_field, max_layers, num_latent_layers=None):
+    """
+    Creates (cnn_layer, latent_layer) blocks of the candidate schedules. `latent_layer` is None for TCN models.
+
+    Args:
+        config (dict): base configuration.
+        filter_sizes (list): candidate filter sizes.
+        min_receptive_field (int): target receptive field.
+        max_receptive_field (int): maximum receptive field.
+        max_layers (int): maximum number of convolutional layers.
+        num_latent_layers (list): allowed number of stochastic layers. If None, any number is allowed.
+
+    Returns:
+        (list): list of (cnn_layer, latent_layer) blocks.
+    """
+    candidates = []
+    for filter_size in filter_sizes:
+        for dilations in get_dilation_schedules(filter_size, min_receptive_field, max_receptive_field, max_layers):
+            cnn_config = copy.deepcopy(config['cnn_layer'])
+            cnn_config['filter_size'] = filter_size
+            cnn_config['dilation_size'] = dilations
+
+            if config['model_cls'] == 'TCN':
+                cnn_config['num_layers'] = len(dilations)
+                candidates.append((cnn_config, None))
+            elif config['model_cls'] == 'StochasticTCN':
+                cnn_config['num_encoder_layers'] = len(dilations)
+                for vertical_dilation in range(1, len(dilations) + 1):
+                    if len(dilations) % vertical_dilation != 0:
+                        continue
+                    if num_latent_layers is not None and len(dilations)//vertical_dilation not in num_latent_layers:
+                        continue
+                    candidates.append((cnn_config, get_latent_config(config['latent_layer'], len(dilations), vertical_dilation)))
+            else:
+                raise Exception("Dilation schedules are defined for TCN and StochasticTCN models only.")
+    return candidates
+
+
+def get_pareto_front(results, cost_key):
+    """
+    Returns the results which are not dominated in both cost and receptive field, sorted by cost.
+    """
+    results = sorted(results, key=lambda result: (result[cost_key], -result['receptive_field_size']))
+    pareto_front = []
+    for result in results:
+        if len(pareto_front) == 0 or result['receptive_field_size'] > pareto_front[-1]['receptive_field_size']:
+            pareto_front.append(result)
+    return pareto_front
+
+
+def plan_dilations(config, input_dims, target_dims, seq_len, min_receptive_field, max_receptive_field=None, budget=None,
+                   cost_key='training_flops', filter_sizes=(2, 3, 4), max_layers=30, num_latent_layers=None):
+    """
+    Searches the dilation schedules on the Pareto front of cost against receptive field.
+
+    Args:
+        config (dict): base configuration.
+        input_dims (list): input feature sizes.
+        target_dims (list): target feature sizes.
+        seq_len (int): number of steps of training samples.
+        min_receptive_field (int): target receptive field.
+        max_receptive_field (int): maximum receptive field. If None, 2*min_receptive_field.
+        budget (float): maximum cost. If None, no limit.
+        cost_key (str): one of `COST_KEYS`.
+        filter_sizes (list): candidate filter sizes.
+        max_layers (int): maximum number of convolutional layers.
+        num_latent_layers (list): allowed number of stochastic layers. If None, any number is allowed.
+
+    Returns:
+        (list): Pareto optimal results with costs and `cnn_layer` (and `latent_layer`) blocks.
+    """
+    max_receptive_field = max_receptive_field or 2*min_receptive_field
+    results = []
+    for cnn_config, latent_config in get_candidates(config, filter_sizes, min_receptive_field, max_receptive_field, max_layers, num_latent_layers):
+        candidate_config = copy.deepcopy(config)
+        candidate_config['cnn_layer'] = cnn_config
+        if latent_config is not None:
+            candidate_config['latent_layer'] = latent_config
+        report = estimate_costs(candidate_config, input_dims, target_dims, seq_len)
+        if budget is not None and report[cost_key] > budget:
+            continue
+
+        result = {key: report[key] for key in COST_KEYS + ['receptive_field_size']}
+        result['cnn_layer'] = cnn_config
+        if latent_config is not None:
+            result['latent_layer'] = latent_config
+        results.append(result)
+    return get_pareto_front(results, cost_key)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json_file', required=True, type=str, help='Path to the base configuration saved as json file.')
+    parser.add_argument('--input_dims', required=True, type=str, help='Comma separated input feature sizes.')
+    parser.add_argument('--target_dims', required=True, type=str, help='Comma separated target feature sizes.')
+    parser.add_argument('--sequence_length', required=True, type=int, help='Number of steps of training samples.')
+    parser.add_argument('--receptive_field', required=True, type=int, help='Target receptive field size.')
+    parser.add_argument('--max_receptive_field', type=int, default=None, help='Maximum receptive field size. Default is 2*receptive_field.')
+    parser.add_argument('--budget', type=float, default=None, help='Maximum cost.')
+    parser.add_argument('--cost', type=str, default='training_flops', choices=COST_KEYS, help='Cost to minimize.')
+    parser.add_argument('--filter_sizes', type=str, default="2,3,4", help='Comma separated candidate filter sizes.')
+    parser.add_argument('--max_layers', type=int, default=30, help='Maximum number of convolutional layers.')
+    parser.add_argument('--num_latent_layers', type=str, default=None, help='Comma separated allowed number of stochastic layers. If not set, the number of latent layers of the base configuration is used.')
+    parser.add_argument('--output_file', type=str, default=None, help='Json file to save the Pareto optimal config blocks.')
+    args = parser.parse_args()
+
+    config_dict = json.load(open(args.json_file, 'r'))
+    input_dims = [int(dim) for dim in args.input_dims.split(",")]
+    target_dims = [int(dim) for dim in args.target_dims.split(",")]
+    filter_sizes = [int(size) for size in args.filter_sizes.split(",")]
+
+    num_latent_layers = None
+    if args.num_latent_layers is not None:
+        num_latent_layers = [int(num) for num in args.num_latent_layers.split(",")]
+    elif config_dict['model_cls'] == 'StochasticTCN':
+        latent_config = config_dict['latent_layer']
+        num_latent_layers = [config_dict['cnn_layer']['num_encoder_layers']//latent_config.get('vertical_dilation', 1)]
+
+    base_report = estimate_costs(config_dict, input_dims, target_dims, args.sequence_length)
+    print("Base configuration: receptive field {}, {} {}".format(base_report['receptive_field_size'], args.cost, base_report[args.cost]))
+
+    pareto_front = plan_dilations(config_dict, input_dims, target_dims, args.sequence_length, args.receptive_field,
+                                  args.max_receptive_field, args.budget, args.cost, filter_sizes, args.max_layers, num_latent_layers)
+
+    print("{:>8} {:>12} {:>8} {:>10} {:>16}  {}".format("rf", "filter_size", "layers", "vertical", args.cost, "dilations"))
+    for result in pareto_front:
+        print("{:>8} {:>12} {:>8} {:>10} {:>16.4g}  {}".format(result['receptive_field_size'],
+                                                              result['cnn_layer']['filter_size'],
+                                                              len(result['cnn_layer']['dilation_size']),
+                                                              result.get('latent_layer', {}).get('vertical_dilation', "-"),
+                                                              result[args.cost],
+                                                              result['cnn_layer']['dilation_size']))
+
+    if args.output_file is not None:
+        json.dump(pareto_front, open(args.output_file, 'w'), indent=4, sort_keys=True)
+        print("Config blocks are saved into " + args.output_file)
@@ -0,0 +1,164 @@
+import os
+import json
+import hashlib
+
+"""
+Manifest of incremental preprocessing runs.
+
+- The manifest is a json file recording the preprocessing parameters, the content hashes of the input files and the
+outputs (shards) created from them. Hashes are cached by file size and modification time, so unchanged files are not
+read again.
+- Every output has a signature: the hash of the parameters, the hashes of its input files and any extra dependency
+(e.g. split boundaries or statistics). An output is rebuilt only if it is missing or its signature changed.
+- Input files are assigned to fixed-size groups once. Known files keep their group and new files fill new groups.
+Hence, adding recordings creates new shards only, while a changed or deleted file invalidates its own group.
+- The manifest is saved after every completed output, i.e., an interrupted run resumes from the missing outputs.
+
+Example:
+    manifest = PreprocessingManifest(manifest_path, params=dict(sample_rate=16000, sz=8000))
+    for shard_name, shard_files in manifest.assign_groups(input_files, group_size=200):
+        if manifest.is_dirty(shard_name, shard_files):
+            output_path = process(shard_files)
+            manifest.mark_done(shard_name, shard_files, outputs=dict(path=output_path))
+"""
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Returns the sha1 digest of the file content.
+    """
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class PreprocessingManifest(object):
+    """
+    Keeps track of the inputs and outputs of a preprocessing pipeline (see the module docstring).
+    """
+    def __init__(self, path, params):
+        """
+
+        Args:
+            path (str): path to the json file.
+            params (dict): json serializable preprocessing parameters. If they differ from the recorded ones, all
+                outputs are invalidated.
+        """
+        self.path = path
+        self.params = json.loads(json.dumps(params, sort_keys=True))
+        self.inputs = dict()
+        self.shards = dict()
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+            self.inputs = manifest.get('inputs', dict())
+            if manifest.get('params') == self.params:
+                self.shards = manifest.get('shards', dict())
+            else:
+                print("Preprocessing parameters are changed. All outputs are rebuilt.")
+
+    def input_hash(self, path):
+        """
+        Returns the content hash of an input file. The file is read only if its size or modification time changed.
+        """
+        stat = os.stat(path)
+        record = self.inputs.get(path)
+        if record is None or record['size'] != stat.st_size or record['mtime'] != stat.st_mtime_ns:
+            record = dict(size=stat.st_size, mtime=stat.st_mtime_ns, hash=file_hash(path))
+            self.inputs[path] = record
+        return record['hash']
+
+    def signature(self, input_files, extra=None):
+        """
+        Hash of the parameters, input file contents and extra dependencies.
+
+        Args:
+            input_files (list): paths to the input files.
+            extra: json serializable dependencies other than the input files.
+
+        Returns:
+            (str): signature.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(json.dumps([self.params, extra], sort_keys=True).encode('utf-8'))
+        for path in input_files:
+            hasher.update(self.input_hash(path).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def is_dirty(self, name, input_files, extra=None):
+        """
+        Returns True if the output `name` must be (re)built, i.e., it is not recorded, its signature changed or one of
+        its output files is missing.
+        """
+        record = self.shards.get(name)
+        if record is None or record['signature'] != self.signature(input_files, extra):
+            return True
+        return not all(os.path.exists(path) for path in record.get('files', []))
+
+    def mark_done(self, name, input_files, extra=None, files=None, **outputs):
+        """
+        Records a completed output and saves the manifest.
+
+        Args:
+            name (str): output name.
+            input_files (list): paths to the input files.
+            extra: json serializable dependencies other than the input files.
+            files (list): paths to the output files.
+            **outputs: json serializable information on the output (e.g. number of rows, statistics).
+        """
+        record = dict(outputs)
+        record['inputs'] = list(input_files)
+        record['signature'] = self.signature(input_files, extra)
+        record['files'] = list(files or [])
+        self.shards[name] = record
+        self.save()
+
+    def get(self, name):
+        """
+        Returns the record of a completed output.
+        """
+        return self.shards[name]
+
+    def assign_groups(self, input_files, group_size, prefix='group'):
+        """
+        Assigns input files to groups of at most `group_size` files. Files keep their previous group, and new files
+        are assigned to new groups in the given order. Deleted files are removed from their groups, and empty groups
+        are dropped.
+
+        Args:
+            input_files (list): paths to the input files.
+            group_size (int): maximum number of files per group.
+            prefix (str): group names are `prefix` followed by the group index.
+
+        Returns:
+            (list): (group name, list of input files) tuples in the group order.
+        """
+        input_set = set(input_files)
+        groups = []
+        assigned = set()
+        for name in sorted(name for name in self.shards if name.startswith(prefix + "_")):
+            files = [path for path in self.shards[name]['inputs'] if path in input_set]
+            if len(files) > 0:
+                groups.append((name, files))
+                assigned.update(files)
+            else:
+                del self.shards[name]
+
+        new_files = [path for path in input_files if path not in assigned]
+        next_idx = int(groups[-1][0].split("_")[-1]) + 1 if len(groups) > 0 else 0
+        for i in range(0, len(new_files), group_size):
+            groups.append(("%s_%05d" % (prefix, next_idx), new_files[i:i + group_size]))
+            next_idx += 1
+        return groups
+
+    def save(self):
+        """
+        Writes the manifest into a temporary file first so that an interrupted run doesn't corrupt it.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(params=self.params, inputs=self.inputs, shards=self.shards), f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
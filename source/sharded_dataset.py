@@ -0,0 +1,341 @@
+import os
+import json
+import numpy as np
+from data_statistics import RunningMoments
+
+"""
+Sharded dataset representation written by preprocessing scripts and read by `BaseDataset`.
+
+A dataset is a directory with `index.json` and .npy shards of at most `shard_size` samples per data key (e.g.
+`samples`, `targets`):
+- Fixed-length samples of a shard are stored in `<key>_<shard>.npy` with shape (#_samples, seq_len, feature_size).
+- Variable-length samples are concatenated along the time axis, and `<key>_<shard>_offsets.npy` keeps the start of
+every sample (#_samples + 1 entries).
+- `index.json` keeps the shard sizes, data keys, statistics and other small entries (e.g. `preprocessing`).
+- `samples` and `targets` can be stored in a smaller data type (int16, uint8 or float16) with `quantization` metadata
+{dtype, scale, offset}. The stored values are `round((value - offset)/scale)`, and `Dataset` feeds `value*scale + offset`
+in float32. Integer data of the same type (e.g. int16 audio) is stored losslessly with scale 1 and offset 0.
+
+`ShardWriter` buffers one shard at a time and accumulates the statistics of `samples` on the fly. Hence, the memory
+used by the writer doesn't depend on the dataset size. The total memory of a preprocessing script depends on how it
+produces the samples: the Blizzard and IAM-OnDB scripts stream the data, whereas the TIMIT script builds the splits in
+memory and only writes them through the writer. `ShardedArray` provides list-like access to the memory-mapped shards of
+a key.
+
+Example:
+    writer = ShardWriter("./blizzard_stcn_training", ragged=False, preprocessing=[])
+    for block in blocks:
+        writer.add_batch(samples=block)
+    writer.close()
+    dataset = Dataset("./blizzard_stcn_training")
+"""
+
+INDEX_FILE = "index.json"
+QUANTIZATION_DTYPES = ['int16', 'uint8', 'float16']
+QUANTIZED_KEYS = ['samples', 'targets']
+
+
+def quantization_params(min_value, max_value, dtype='int16'):
+    """
+    Returns quantization metadata mapping [min_value, max_value] onto the range of an integer `dtype`. Float16 data is
+    stored without scaling.
+
+    Args:
+        min_value (float): minimum data value.
+        max_value (float): maximum data value.
+        dtype (str): one of `QUANTIZATION_DTYPES`.
+
+    Returns:
+        (dict): quantization metadata.
+    """
+    if dtype not in QUANTIZATION_DTYPES:
+        raise Exception("Quantization type isn't supported: " + str(dtype))
+    if np.issubdtype(np.dtype(dtype), np.floating):
+        return dict(dtype=dtype, scale=1.0, offset=0.0)
+    info = np.iinfo(dtype)
+    scale = max(float(max_value) - float(min_value), 1e-12)/(int(info.max) - int(info.min))
+    return dict(dtype=dtype, scale=scale, offset=float(min_value) - int(info.min)*scale)
+
+
+def quantize(data, dtype, scale=1.0, offset=0.0):
+    """
+    Converts data into the quantized representation, i.e., `round((data - offset)/scale)` clipped to the `dtype` range.
+    Data of the same type is returned as it is if scale and offset are identity.
+    """
+    dtype = np.dtype(dtype)
+    data = np.asarray(data)
+    if data.dtype == dtype and scale == 1.0 and offset == 0.0:
+        return data
+    values = (data.astype(np.float64) - offset)/scale
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        values = np.clip(np.round(values), info.min, info.max)
+    return values.astype(dtype)
+
+
+def dequantize(data, scale=1.0, offset=0.0, **kwargs):
+    """
+    Converts quantized data into float32 values.
+    """
+    return np.asarray(data).astype(np.float32)*np.float32(scale) + np.float32(offset)
+
+
+def to_json_value(value):
+    """
+    Converts numpy values in (nested) dictionaries and lists into json serializable values.
+    """
+    if isinstance(value, dict):
+        return {key: to_json_value(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(val) for val in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
+
+
+class ShardWriter(object):
+    """
+    Streams samples into a sharded dataset directory.
+
+    Args:
+        output_dir (str): dataset directory.
+        shard_size (int): maximum number of samples per shard.
+        ragged (bool): whether samples are variable-length sequences.
+        compute_statistics (bool): accumulates min, max, mean and std of `samples` on all and feature dimensions.
+            Ignored if the statistics are given by `set_statistics`. Statistics are calculated before quantization.
+        quantization (dict): {dtype, scale, offset} to store `samples` and `targets` in a smaller data type (see
+            `quantization_params`). If None, the data is stored as it is.
+        **extras: small entries stored in the index (e.g. `preprocessing`).
+    """
+    def __init__(self, output_dir, shard_size=4096, ragged=False, compute_statistics=True, quantization=None, **extras):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.ragged = ragged
+        self.extras = to_json_value(extras)
+        self.quantization = None
+        if quantization is not None:
+            if quantization.get('dtype') not in QUANTIZATION_DTYPES:
+                raise Exception("Quantization type isn't supported: " + str(quantization.get('dtype')))
+            self.quantization = dict(dtype=quantization['dtype'], scale=float(quantization.get('scale', 1.0)),
+                                     offset=float(quantization.get('offset', 0.0)))
+            self.extras['quantization'] = self.quantization
+        self.statistics = None
+
+        self.moments_all = RunningMoments(axis=None) if compute_statistics else None
+        self.moments_channel = RunningMoments(axis=0) if compute_statistics else None
+
+        self.keys = None
+        self.buffer = None
+        self.num_buffered = 0
+        self.shards = []
+        self.dtypes = dict()
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        # A partially written dataset must not be mistaken for a complete one.
+        if os.path.exists(os.path.join(output_dir, INDEX_FILE)):
+            os.remove(os.path.join(output_dir, INDEX_FILE))
+
+    def add(self, **sample):
+        """
+        Adds one sample. Every call must pass the same keys.
+
+        Args:
+            **sample: sample of every data key, e.g. samples=(seq_len, feature_size) array.
+        """
+        self.add_batch(**{key: [value] for key, value in sample.items()})
+
+    def add_batch(self, **samples):
+        """
+        Adds a batch of samples, i.e., (batch_size, seq_len, feature_size) arrays or lists of samples.
+        """
+        if self.keys is None:
+            self.keys = sorted(samples.keys())
+            self.buffer = {key: [] for key in self.keys}
+        elif sorted(samples.keys()) != self.keys:
+            raise Exception("Samples must have the same keys: " + str(self.keys))
+
+        num_samples = len(samples[self.keys[0]])
+        start = 0
+        while start < num_samples:
+            end = min(num_samples, start + self.shard_size - self.num_buffered)
+            for key in self.keys:
+                self.buffer[key].append(samples[key][start:end])
+            if self.moments_all is not None and 'samples' in samples:
+                for sample in samples['samples'][start:end] if self.ragged else [samples['samples'][start:end]]:
+                    sample = np.asarray(sample)
+                    self.moments_all.update(sample)
+                    self.moments_channel.update(sample.reshape((-1, sample.shape[-1])))
+            self.num_buffered += end - start
+            start = end
+            if self.num_buffered == self.shard_size:
+                self.flush()
+
+    def set_statistics(self, statistics):
+        """
+        Stores the given statistics (e.g. training statistics in evaluation splits) instead of the accumulated ones.
+        """
+        self.statistics = to_json_value(statistics)
+
+    def flush(self):
+        """
+        Writes the buffered samples into a new shard.
+        """
+        if self.num_buffered == 0:
+            return
+        shard_idx = len(self.shards)
+        files = dict()
+        for key in self.keys:
+            if self.ragged:
+                samples = [np.asarray(sample) for chunk in self.buffer[key] for sample in chunk]
+                offsets = np.cumsum([0] + [len(sample) for sample in samples], dtype=np.int64)
+                data = np.concatenate(samples, axis=0)
+                files[key + "_offsets"] = self.save_array("%s_%05d_offsets.npy" % (key, shard_idx), offsets)
+            else:
+                data = np.concatenate([np.asarray(chunk) for chunk in self.buffer[key]], axis=0)
+            if self.quantization is not None and key in QUANTIZED_KEYS:
+                data = quantize(data, **self.quantization)
+            files[key] = self.save_array("%s_%05d.npy" % (key, shard_idx), data)
+            self.dtypes[key] = data.dtype.str
+            self.buffer[key] = []
+
+        self.shards.append(dict(num_samples=self.num_buffered, files=files))
+        self.num_buffered = 0
+
+    def save_array(self, file_name, array):
+        np.save(os.path.join(self.output_dir, file_name), array)
+        return file_name
+
+    def accumulated_statistics(self):
+        """
+        Returns the statistics of the samples added so far.
+
+        Returns:
+            (dict): min, max, mean and std on all and feature dimensions, or None if no statistics are accumulated.
+        """
+        if self.moments_all is None or self.moments_all.count == 0:
+            return None
+        std_channel = self.moments_channel.std
+        std_channel[np.where(std_channel < 1e-6)] = 1.0
+        return to_json_value(dict(mean_all=self.moments_all.mean, std_all=self.moments_all.std,
+                                  min_all=self.moments_all.min, max_all=self.moments_all.max,
+                                  mean_channel=self.moments_channel.mean, std_channel=std_channel,
+                                  min_channel=self.moments_channel.min, max_channel=self.moments_channel.max))
+
+    def close(self):
+        """
+        Writes the last shard and the index.
+
+        Returns:
+            (dict): the statistics.
+        """
+        self.flush()
+        statistics = self.statistics if self.statistics is not None else self.accumulated_statistics()
+
+        index = dict(keys=self.keys or [], ragged=self.ragged, dtypes=self.dtypes, shards=self.shards,
+                     num_samples=sum(shard['num_samples'] for shard in self.shards), statistics=statistics,
+                     extras=self.extras)
+        with open(os.path.join(self.output_dir, INDEX_FILE + ".tmp"), 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(os.path.join(self.output_dir, INDEX_FILE + ".tmp"), os.path.join(self.output_dir, INDEX_FILE))
+        return statistics
+
+
+class ShardedArray(object):
+    """
+    List-like access to the samples of a data key. Shards are memory-mapped when first accessed.
+
+    Args:
+        data_dir (str): dataset directory.
+        index (dict): content of `index.json`.
+        key (str): data key.
+    """
+    def __init__(self, data_dir, index, key):
+        self.data_dir = data_dir
+        self.key = key
+        self.ragged = index['ragged']
+        self.shard_files = [shard['files'] for shard in index['shards']]
+        self.shard_starts = np.cumsum([0] + [shard['num_samples'] for shard in index['shards']])
+        self.num_samples = int(self.shard_starts[-1])
+        self.dtype = np.dtype(index['dtypes'][key]) if key in index['dtypes'] else None
+        self.shards = [None]*len(self.shard_files)
+        self.offsets = [None]*len(self.shard_files)
+
+    def load_shard(self, shard_idx):
+        if self.shards[shard_idx] is None:
+            files = self.shard_files[shard_idx]
+            self.shards[shard_idx] = np.load(os.path.join(self.data_dir, files[self.key]), mmap_mode='r')
+            if self.ragged:
+                self.offsets[shard_idx] = np.load(os.path.join(self.data_dir, files[self.key + "_offsets"]))
+        return self.shards[shard_idx]
+
+    def get_sample(self, idx):
+        if idx < 0:
+            idx += self.num_samples
+        if idx < 0 or idx >= self.num_samples:
+            raise IndexError("Sample index out of range.")
+        shard_idx = int(np.searchsorted(self.shard_starts, idx, side='right')) - 1
+        shard = self.load_shard(shard_idx)
+        local_idx = idx - self.shard_starts[shard_idx]
+        if self.ragged:
+            offsets = self.offsets[shard_idx]
+            return shard[offsets[local_idx]:offsets[local_idx + 1]]
+        return shard[local_idx]
+
+    def sequence_lengths(self):
+        """
+        Returns the lengths of the samples without reading the data.
+        """
+        if not self.ragged:
+            return np.concatenate([self.load_shard(i).shape[1]*np.ones(len(self.load_shard(i)), dtype=np.int32)
+                                   for i in range(len(self.shards))] or [np.zeros(0, dtype=np.int32)])
+        lengths = []
+        for shard_idx in range(len(self.shards)):
+            self.load_shard(shard_idx)
+            lengths.append(np.diff(self.offsets[shard_idx]).astype(np.int32))
+        return np.concatenate(lengths) if len(lengths) > 0 else np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        for idx in range(self.num_samples):
+            yield self.get_sample(idx)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return self.get_sample(int(idx))
+        if isinstance(idx, slice):
+            idx = range(*idx.indices(self.num_samples))
+        samples = [self.get_sample(int(i)) for i in idx]
+        return samples if self.ragged else np.stack(samples)
+
+
+def load_sharded_dataset(data_dir, materialize_keys=None):
+    """
+    Creates a data dictionary of a sharded dataset directory. `samples` and `targets` are `ShardedArray`s and the other
+    keys (e.g. masks) are loaded into memory.
+
+    Args:
+        data_dir (str): dataset directory.
+        materialize_keys (list): data keys to load into memory. If None, all but `samples` and `targets`.
+
+    Returns:
+        (dict): data dictionary.
+    """
+    with open(os.path.join(data_dir, INDEX_FILE), 'r') as f:
+        index = json.load(f)
+
+    data_dict = dict()
+    for key in index['keys']:
+        array = ShardedArray(data_dir, index, key)
+        if (materialize_keys is None and key not in ['samples', 'targets']) or (materialize_keys is not None and key in materialize_keys):
+            array = array[:] if array.ragged else np.asarray(array[:])
+        data_dict[key] = array
+
+    for key, value in index['extras'].items():
+        data_dict[key] = np.array(value)
+    if index['statistics'] is not None:
+        statistics = {key: np.array(value, dtype=np.float32) for key, value in index['statistics'].items()}
+        data_dict['statistics'] = np.array(statistics, dtype=object)
+    return data_dict
@@ -0,0 +1,181 @@
+import tensorflow as tf
+import numpy as np
+import os
+import json
+import time
+import queue
+import multiprocessing
+from tf_train import TrainingEngine
+
+"""
+Picks CPU threading settings for the host by running short timed training trials of the actual model.
+
+- Tuned parameters are `intra_op_parallelism_threads`, `inter_op_parallelism_threads` and `feeder_threads` (number of
+threads of the batch queue). They are tuned one after another (coordinate search), keeping the best value of the
+previous parameters.
+- If `cpu_cores` is set in the configuration, the process is pinned to these cores and candidate thread counts are
+chosen w.r.t. the number of pinned cores.
+- Every trial runs in a fresh (spawned) python process. Tensorflow creates its thread pools with the settings of the
+first session in a process and ignores the settings of the later sessions. Hence, the training must also run in a new
+process (see `run_in_subprocess`) after the autotuning.
+- Best settings are written back into the run configuration and into a separate json file, if given. The json
+configuration of the user is not modified.
+"""
+
+
+class TrialEngine(TrainingEngine):
+    """
+    Training engine building the training model only.
+    """
+    def run_trial(self, num_steps, num_warmup_steps):
+        """
+        Builds the training graph and returns the average time per training step.
+        """
+        with tf.device(self.device_setter):
+            self.create_models()
+            self.gradient_check()
+        self.session.run(tf.group(tf.global_variables_initializer(), tf.local_variables_initializer()))
+
+        self.coordinator = tf.train.Coordinator()
+        for data_feeder in self.data_feeders:
+            data_feeder.init(self.session, self.coordinator)
+        self.queue_threads = tf.train.start_queue_runners(sess=self.session, coord=self.coordinator)
+        self.queue_threads.append(self.training_data_feeder.enqueue_threads)
+
+        run_ops = [self.train_op]
+        if self.training_staging_area:
+            for i in range(256):
+                self.session.run(self.training_staging_area.preload_op)
+            run_ops.append(self.training_staging_area.preload_op)
+
+        # The first steps include one-time costs such as memory allocation and filling the queues.
+        for _ in range(num_warmup_steps):
+            self.session.run(run_ops)
+        start_time = time.perf_counter()
+        for _ in range(num_steps):
+            self.session.run(run_ops)
+        time_per_step = (time.perf_counter() - start_time)/num_steps
+
+        self.finalize_training()
+        return time_per_step
+
+
+def _subprocess_target(result_queue, function, args, kwargs):
+    try:
+        result_queue.put((True, function(*args, **kwargs)))
+    except Exception as e:
+        result_queue.put((False, repr(e)))
+        raise
+
+
+def run_in_subprocess(function, *args, **kwargs):
+    """
+    Calls `function` in a fresh python process started by `spawn` and returns its return value. The process doesn't
+    inherit the tensorflow runtime (i.e., thread pools) of the caller.
+
+    Args:
+        function: module level function. Its arguments and return value must be picklable.
+        *args: positional arguments of `function`.
+        **kwargs: keyword arguments of `function`.
+
+    Returns:
+        Return value of `function`.
+    """
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=_subprocess_target, args=(result_queue, function, args, kwargs))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = result_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                # The result may have arrived right before the process exited.
+                try:
+                    result = result_queue.get(timeout=1)
+                except queue.Empty:
+                    raise Exception("Subprocess exited with code {} without a result.".format(process.exitcode))
+    process.join()
+    success, value = result
+    if not success:
+        raise Exception("Subprocess failed: " + value)
+    return value
+
+
+def time_trial(config_cls, config_dict, num_steps, num_warmup_steps):
+    """
+    Creates the configuration from `config_dict` and returns the average time per training step of a trial.
+    """
+    config = config_cls(**config_dict)
+    return TrialEngine(config, early_stopping_tolerance=0).run_trial(num_steps, num_warmup_steps)
+
+
+def get_thread_candidates(num_cores):
+    """
+    Candidate values for each tuned parameter given the number of available cores.
+    """
+    intra_op = sorted(set([num_cores, max(1, num_cores//2), max(1, num_cores//4)]), reverse=True)
+    inter_op = [1, 2, 4]
+    feeder = [1, 2, 4]
+    return [('intra_op_parallelism_threads', intra_op),
+            ('inter_op_parallelism_threads', inter_op),
+            ('feeder_threads', feeder)]
+
+
+def autotune_session_config(config, num_steps=20, num_warmup_steps=10, output_file=None):
+    """
+    Runs timed training trials, each in a new process, and sets the fastest threading configuration.
+
+    Args:
+        config (Configuration): experiment configuration. Updated with the best settings.
+        num_steps (int): number of timed training steps per trial.
+        num_warmup_steps (int): number of training steps before timing.
+        output_file (str): path to a json file. If given, the best settings are written into it.
+
+    Returns:
+        (dict): best settings.
+    """
+    if config.get('cpu_cores', None):
+        num_cores = len(config.get('cpu_cores'))
+    elif hasattr(os, "sched_getaffinity"):
+        num_cores = len(os.sched_getaffinity(0))
+    else:
+        num_cores = os.cpu_count()
+
+    # Trials only need the training model.
+    original_settings = {key: config.get(key, None) for key in ['validate_model', 'test_model']}
+    config.set('validate_model', False, override=True)
+    config.set('test_model', False, override=True)
+
+    best_settings = {'intra_op_parallelism_threads': num_cores,
+                     'inter_op_parallelism_threads': 2,
+                     'feeder_threads': config.get('feeder_threads', 4)}
+    best_time = np.inf
+    for param, candidates in get_thread_candidates(num_cores):
+        for value in candidates:
+            trial_settings = dict(best_settings)
+            trial_settings[param] = value
+            for key, val in trial_settings.items():
+                config.set(key, val, override=True)
+
+            time_per_step = run_in_subprocess(time_trial, type(config), dict(config.config), num_steps, num_warmup_steps)
+            print("Autotune: intra_op {}, inter_op {}, feeder {} \t time/batch = {:.3f}".format(trial_settings['intra_op_parallelism_threads'],
+                                                                                             trial_settings['inter_op_parallelism_threads'],
+                                                                                             trial_settings['feeder_threads'],
+                                                                                             time_per_step))
+            if time_per_step < best_time:
+                best_time = time_per_step
+                best_settings = trial_settings
+
+    for key, val in original_settings.items():
+        config.set(key, val, override=True)
+    for key, val in best_settings.items():
+        config.set(key, val, override=True)
+    print("Autotune: best settings {} with {:.3f} sec/batch.".format(best_settings, best_time))
+
+    if output_file is not None:
+        json.dump(best_settings, open(output_file, 'w'), indent=4, sort_keys=True)
+        print("Autotune: settings are written into " + output_file)
+
+    return best_settings
@@ -0,0 +1,504 @@
+import tensorflow as tf
+import numpy as np
+import copy
+import glob
+import os
+import time
+from constants import Constants as C
+from utils import get_session_config, get_peak_rss
+from tf_autotune import run_in_subprocess
+from tf_models import TCN
+from tf_model_utils import get_rnn_cell, FusedRNNLayer
+
+"""
+Benchmarks training step throughput of models with synthetic data.
+
+- Models are built as in `TrainingEngine`, but inputs are constant tensors of random values. Hence, the input pipeline
+is not measured.
+- The first step includes one-time costs such as graph optimization, memory allocation and XLA compilation. It is
+reported separately as `first_step`.
+- A benchmark compares the same configuration under different settings (i.e., config overrides) such as
+`{"use_xla": True}`. Every setting runs in a fresh process since XLA flags and thread pools are fixed per process.
+- The number of XLA clusters is counted in the partitioned graphs of a traced step. It is 0 if XLA didn't compile any
+op, e.g., XLA isn't available in the tensorflow build.
+- Micro-benchmarks time a single building block (i.e., forward and backward pass of a temporal block).
+"""
+
+
+def update_config_dict(config_dict, overrides):
+    """
+    Updates configuration entries. Nested dictionaries such as `cnn_layer` are updated rather than replaced.
+    """
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config_dict.get(key, None), dict):
+            update_config_dict(config_dict[key], value)
+        else:
+            config_dict[key] = copy.deepcopy(value)
+    return config_dict
+
+
+def create_synthetic_placeholders(batch_size, sequence_length, input_dims, target_dims):
+    """
+    Creates constant input tensors with the same keys as the data feeders.
+
+    Args:
+        batch_size (int):
+        sequence_length (int):
+        input_dims (list): input feature sizes.
+        target_dims (list): target feature sizes.
+
+    Returns:
+        (dict): placeholders dictionary.
+    """
+    rng = np.random.RandomState(C.SEED)
+    placeholders = dict()
+    placeholders[C.PL_INPUT] = tf.constant(rng.randn(batch_size, sequence_length, sum(input_dims)).astype(np.float32))
+    placeholders[C.PL_TARGET] = tf.constant(rng.randn(batch_size, sequence_length, sum(target_dims)).astype(np.float32))
+    placeholders[C.PL_SEQ_LEN] = tf.constant(np.ones(batch_size, dtype=np.int32)*sequence_length)
+    placeholders[C.PL_IDX] = tf.constant(np.arange(batch_size, dtype=np.int32))
+    return placeholders
+
+
+def benchmark_training_step(config, input_dims, target_dims, sequence_length, num_steps=50, num_warmup_steps=5):
+    """
+    Builds the training graph of the given configuration and measures training step time.
+
+    Args:
+        config (Configuration): experiment configuration.
+        input_dims (list): input feature sizes.
+        target_dims (list): target feature sizes.
+        sequence_length (int): number of time-steps.
+        num_steps (int): number of timed training steps.
+        num_warmup_steps (int): number of training steps after the first step and before timing.
+
+    Returns:
+        (dict): `first_step` time in seconds, `steps_per_sec` and `num_parameters`.
+    """
+    tf.reset_default_graph()
+    tf.set_random_seed(config.get('seed', C.SEED))
+    session = tf.Session(config=get_session_config(config))
+    global_step = tf.Variable(1, trainable=False, name='global_step')
+
+    placeholders = create_synthetic_placeholders(config.get('batch_size'), sequence_length, input_dims, target_dims)
+    with tf.name_scope(C.TRAIN):
+        model = config.model_cls(config=config,
+                                 session=session,
+                                 reuse=False,
+                                 mode=C.TRAIN,
+                                 placeholders=placeholders,
+                                 input_dims=input_dims,
+                                 target_dims=target_dims,
+                                 global_step=global_step)
+        model.build_graph()
+
+    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+    with tf.control_dependencies(update_ops):
+        optimizer = tf.train.AdamOptimizer(config.get('learning_rate'))
+        train_op = optimizer.minimize(model.loss, global_step=global_step)
+    session.run(tf.global_variables_initializer())
+
+    start_time = time.perf_counter()
+    session.run(train_op)
+    first_step_time = time.perf_counter() - start_time
+
+    for _ in range(num_warmup_steps):
+        session.run(train_op)
+    start_time = time.perf_counter()
+    for _ in range(num_steps):
+        session.run(train_op)
+    steps_per_sec = num_steps/(time.perf_counter() - start_time)
+
+    num_parameters = int(np.sum([np.prod(v.shape.as_list()) for v in tf.trainable_variables()]))
+    num_xla_clusters = count_xla_clusters(session, train_op)
+    session.close()
+    tf.reset_default_graph()
+    return {'first_step': first_step_time, 'steps_per_sec': steps_per_sec, 'num_parameters': num_parameters, 'xla_clusters': num_xla_clusters}
+
+
+def count_xla_clusters(session, fetches):
+    """
+    Runs `fetches` once and counts the XLA cluster launches in the partitioned graphs that are actually executed.
+
+    Args:
+        session (tf.Session):
+        fetches: ops or tensors to run.
+
+    Returns:
+        (int): number of XLA clusters.
+    """
+    run_options = tf.RunOptions(output_partition_graphs=True)
+    run_metadata = tf.RunMetadata()
+    session.run(fetches, options=run_options, run_metadata=run_metadata)
+    # Depending on the tensorflow version, a cluster is launched by a single `XlaLaunch` or by an `_XlaCompile` and
+    # `_XlaRun` pair.
+    launch_ops = ['XlaLaunch', '_XlaLaunch', '_XlaCompile']
+    return sum([1 for graph in run_metadata.partition_graphs for node in graph.node if node.op in launch_ops])
+
+
+def benchmark_setting(Configuration_cls, config_dict, input_dims, target_dims, sequence_length, num_steps=50):
+    """
+    Creates the configuration from `config_dict` and runs `benchmark_training_step`.
+    """
+    return benchmark_training_step(Configuration_cls(**config_dict), input_dims, target_dims, sequence_length, num_steps=num_steps)
+
+
+def compare_settings(Configuration_cls, config_paths, settings, input_dims, target_dims, sequence_length, num_steps=50):
+    """
+    Runs `benchmark_training_step` for every configuration file and setting, and prints a summary table.
+
+    Args:
+        Configuration_cls: experiment specific configuration class.
+        config_paths (list): paths to json configuration files.
+        settings (list): list of (name, dict) tuples where dict contains config overrides.
+        input_dims (list): input feature sizes.
+        target_dims (list): target feature sizes.
+        sequence_length (int): number of time-steps.
+        num_steps (int): number of timed training steps.
+
+    Returns:
+        (dict): results for every (config path, setting name) pair.
+    """
+    results = dict()
+    for config_path in config_paths:
+        config_dict = Configuration_cls.from_json(config_path)
+        for setting_name, overrides in settings:
+            setting_config_dict = update_config_dict(copy.deepcopy(config_dict), overrides)
+            results[(config_path, setting_name)] = run_in_subprocess(benchmark_setting, Configuration_cls, setting_config_dict,
+                                                                     input_dims, target_dims, sequence_length, num_steps)
+            print("{} [{}]: first step {:.2f} sec, {:.2f} steps/sec, {} xla clusters".format(config_path, setting_name,
+                                                                                           results[(config_path, setting_name)]['first_step'],
+                                                                                           results[(config_path, setting_name)]['steps_per_sec'],
+                                                                                           results[(config_path, setting_name)]['xla_clusters']))
+
+    print("\n{:<60} {:<15} {:>12} {:>12} {:>10} {:>13}".format("config", "setting", "first step", "steps/sec", "speedup", "xla clusters"))
+    for config_path in config_paths:
+        baseline = results[(config_path, settings[0][0])]['steps_per_sec']
+        for setting_name, _ in settings:
+            result = results[(config_path, setting_name)]
+            print("{:<60} {:<15} {:>12.2f} {:>12.2f} {:>10.2f} {:>13}".format(config_path, setting_name, result['first_step'],
+                                                                             result['steps_per_sec'], result['steps_per_sec']/baseline,
+                                                                             result['xla_clusters']))
+    return results
+
+
+def find_config_files(experiment_dir):
+    """
+    Returns json configuration files shipped with an experiment (i.e., `config_*` folders).
+    """
+    return sorted(glob.glob(os.path.join(experiment_dir, "config_*", "*.json")))
+
+
+def benchmark_xla(Configuration_cls, config_paths, input_dims, target_dims, sequence_length, num_steps=50):
+    """
+    Compares training step time with and without XLA JIT compilation. `first_step` includes the compilation time. A
+    speedup is only attributable to XLA if clusters are formed with `use_xla`.
+    """
+    settings = [("default", {"use_xla": False}),
+                ("xla", {"use_xla": True})]
+    results = compare_settings(Configuration_cls, config_paths, settings, input_dims, target_dims, sequence_length, num_steps)
+    for config_path in config_paths:
+        if results[(config_path, "xla")]['xla_clusters'] == 0:
+            print("Warning: no XLA clusters are formed for " + config_path + ". XLA is not applied.")
+    return results
+
+
+def benchmark_fused_gate(Configuration_cls, config_paths, input_dims, target_dims, sequence_length, num_steps=50):
+    """
+    Compares training step time of models with separate and fused filter/gate convolutions in gated temporal blocks.
+    """
+    settings = [("default", {"cnn_layer": {"fused_gate": False}}),
+                ("fused_gate", {"cnn_layer": {"fused_gate": True}})]
+    return compare_settings(Configuration_cls, config_paths, settings, input_dims, target_dims, sequence_length, num_steps)
+
+
+def benchmark_gated_block(batch_size=32, sequence_length=300, num_filters=256, kernel_size=2, dilations=(1, 2, 4, 8, 16), num_steps=100, session_config=None):
+    """
+    Micro-benchmark timing forward and backward passes of a single gated temporal block with separate and fused
+    filter/gate convolutions. Both implementations share the same variables. Hence, it also reports the maximum absolute
+    difference between their outputs.
+
+    Args:
+        batch_size (int):
+        sequence_length (int):
+        num_filters (int): number of input and output channels.
+        kernel_size (int): filter width.
+        dilations (list): dilation rates to be benchmarked.
+        num_steps (int): number of timed steps.
+        session_config (tf.ConfigProto): session configuration.
+
+    Returns:
+        (dict): time per step in milliseconds for every (dilation, implementation) pair.
+    """
+    results = dict()
+    for dilation in dilations:
+        tf.reset_default_graph()
+        inputs = tf.constant(np.random.RandomState(C.SEED).randn(batch_size, sequence_length, num_filters).astype(np.float32))
+        ops = dict()
+        for fused_gate, reuse in [(False, False), (True, True)]:
+            with tf.variable_scope('temporal_block', reuse=reuse):
+                output, _ = TCN.temporal_block(inputs, num_filters=num_filters, kernel_size=kernel_size, dilation=dilation,
+                                               activation_fn=None, use_gate=True, use_residual=True, zero_padding=True,
+                                               fused_gate=fused_gate)
+            ops[fused_gate] = (output, tf.group(*tf.gradients(tf.reduce_sum(output), [inputs] + tf.trainable_variables())))
+
+        with tf.Session(config=session_config) as session:
+            session.run(tf.global_variables_initializer())
+            output_default, output_fused = session.run([ops[False][0], ops[True][0]])
+            max_diff = np.abs(output_default - output_fused).max()
+
+            for fused_gate, name in [(False, "default"), (True, "fused_gate")]:
+                for _ in range(5):
+                    session.run(ops[fused_gate][1])
+                start_time = time.perf_counter()
+                for _ in range(num_steps):
+                    session.run(ops[fused_gate][1])
+                results[(dilation, name)] = (time.perf_counter() - start_time)*1000/num_steps
+        print("dilation {}: default {:.2f} ms, fused_gate {:.2f} ms, speedup {:.2f}, max abs diff {:.2e}".format(dilation,
+                                                                                                              results[(dilation, "default")],
+                                                                                                              results[(dilation, "fused_gate")],
+                                                                                                              results[(dilation, "default")]/results[(dilation, "fused_gate")],
+                                                                                                              max_diff))
+    tf.reset_default_graph()
+    return results
+
+
+def benchmark_rnn_layer(batch_size=32, sequence_length=300, input_size=200, size=512, num_layers=(1, 2), num_steps=20, session_config=None):
+    """
+    Micro-benchmark timing forward and backward passes of stacked LSTM layers unrolled by `tf.nn.dynamic_rnn`
+    (`lstm` and `blstm` cells) and run by `FusedRNNLayer` (`fused_lstm`). Runs on CPU unless a session configuration
+    is given.
+
+    Args:
+        batch_size (int):
+        sequence_length (int):
+        input_size (int): input feature size.
+        size (int): number of LSTM units.
+        num_layers (list): number of stacked layers to be benchmarked.
+        num_steps (int): number of timed steps.
+        session_config (tf.ConfigProto): session configuration.
+
+    Returns:
+        (dict): sequences per second for every (num_layers, cell_type) pair.
+    """
+    session_config = session_config or tf.ConfigProto(device_count={'GPU': 0})
+    cell_types = [C.LSTM, C.BLSTM, C.FUSED_LSTM]
+    results = dict()
+    for num_layer in num_layers:
+        tf.reset_default_graph()
+        inputs = tf.constant(np.random.RandomState(C.SEED).randn(batch_size, sequence_length, input_size).astype(np.float32))
+        seq_len = tf.constant([sequence_length]*batch_size)
+        ops = dict()
+        for cell_type in cell_types:
+            with tf.variable_scope(cell_type):
+                cell_config = {'cell_type': cell_type, 'size': size, 'num_layers': num_layer}
+                if cell_type == C.FUSED_LSTM:
+                    cell = FusedRNNLayer(**cell_config)
+                    output, _ = cell(inputs, sequence_length=seq_len, initial_state=cell.zero_state(batch_size, tf.float32))
+                else:
+                    cell = get_rnn_cell(**cell_config)
+                    output, _ = tf.nn.dynamic_rnn(cell, inputs, sequence_length=seq_len, dtype=tf.float32)
+                variables = tf.trainable_variables(scope=cell_type)
+            ops[cell_type] = tf.group(*tf.gradients(tf.reduce_sum(output), [inputs] + variables))
+
+        with tf.Session(config=session_config) as session:
+            session.run(tf.global_variables_initializer())
+            for cell_type in cell_types:
+                for _ in range(3):
+                    session.run(ops[cell_type])
+                start_time = time.perf_counter()
+                for _ in range(num_steps):
+                    session.run(ops[cell_type])
+                results[(num_layer, cell_type)] = batch_size*num_steps/(time.perf_counter() - start_time)
+        print("{} layer(s): ".format(num_layer) + ", ".join(["{} {:.2f} seq/sec".format(cell_type, results[(num_layer, cell_type)]) for cell_type in cell_types]) +
+              ", speedup over lstm {:.2f}".format(results[(num_layer, C.FUSED_LSTM)]/results[(num_layer, C.LSTM)]))
+    tf.reset_default_graph()
+    return results
+
+
+def benchmark_shared_trunk(Configuration_cls, config_paths, input_dims, target_dims, sequence_length, num_steps=50):
+    """
+    Compares training step time of ladder latent layers with separate and shared mu/sigma networks. Only configurations
+    with 5 stochastic layers are used.
+    """
+    ladder_config_paths = []
+    for config_path in config_paths:
+        latent_config = Configuration_cls.from_json(config_path).get('latent_layer', {})
+        if latent_config.get('type', None) == C.LATENT_LADDER_GAUSSIAN and len(latent_config.get('latent_size', [])) == 5:
+            ladder_config_paths.append(config_path)
+
+    settings = [("default", {"latent_layer": {"shared_trunk": False}}),
+                ("shared_trunk", {"latent_layer": {"shared_trunk": True}})]
+    return compare_settings(Configuration_cls, ladder_config_paths, settings, input_dims, target_dims, sequence_length, num_steps)
+
+
+def benchmark_space_to_batch(Configuration_cls, config_paths, input_dims, target_dims, sequence_length, num_steps=50):
+    """
+    Compares training step time of models with dilated convolutions and with space-to-batch convolutions.
+    """
+    settings = [("default", {"space_to_batch_conv": False}),
+                ("space_to_batch", {"space_to_batch_conv": True})]
+    return compare_settings(Configuration_cls, config_paths, settings, input_dims, target_dims, sequence_length, num_steps)
+
+
+def benchmark_vrnn_input_layer(Configuration_cls, config_paths, input_dims, target_dims, sequence_length, num_steps=50):
+    """
+    Compares training step time of VRNN models applying phi(x) in the recurrence and before the recurrence. Only VRNN
+    configurations are used.
+    """
+    vrnn_config_paths = [config_path for config_path in config_paths if Configuration_cls.from_json(config_path).get('model_cls') == 'VRNN']
+    settings = [("default", {"precompute_input_layer": False}),
+                ("precompute_input", {"precompute_input_layer": True})]
+    return compare_settings(Configuration_cls, vrnn_config_paths, settings, input_dims, target_dims, sequence_length, num_steps)
+
+
+def benchmark_dilated_conv(Configuration_cls, config_paths, input_dims, target_dims, sequence_length, num_steps=100, session_config=None):
+    """
+    Micro-benchmark timing forward and backward passes of a causal convolution layer with dilated and space-to-batch
+    implementations for every dilation size used by the given configurations. Both implementations share the same
+    variables. It also reports whether the outputs are exactly equal.
+
+    Returns:
+        (dict): time per step in milliseconds for every (dilation, implementation) pair.
+    """
+    dilations = set()
+    batch_size, num_filters, kernel_size = 0, 0, 2
+    for config_path in config_paths:
+        cnn_config = Configuration_cls.from_json(config_path).get('cnn_layer', {})
+        dilations.update(cnn_config.get('dilation_size', []))
+        batch_size = max(batch_size, Configuration_cls.from_json(config_path)['batch_size'])
+        num_filters = max(num_filters, cnn_config.get('num_filters', 0))
+        kernel_size = max(kernel_size, cnn_config.get('filter_size', 2))
+
+    results = dict()
+    for dilation in sorted(dilations):
+        tf.reset_default_graph()
+        inputs = tf.constant(np.random.RandomState(C.SEED).randn(batch_size, sequence_length, num_filters).astype(np.float32))
+        ops = dict()
+        for space_to_batch, reuse in [(False, False), (True, True)]:
+            TCN.space_to_batch = space_to_batch
+            with tf.variable_scope('causal_conv', reuse=reuse):
+                output = TCN.causal_conv_layer(inputs, num_filters=num_filters, kernel_size=kernel_size, dilation=dilation,
+                                               zero_padding=True, activation_fn=None)
+            ops[space_to_batch] = (output, tf.group(*tf.gradients(tf.reduce_sum(output), [inputs] + tf.trainable_variables())))
+        TCN.space_to_batch = False
+
+        with tf.Session(config=session_config) as session:
+            session.run(tf.global_variables_initializer())
+            output_default, output_s2b = session.run([ops[False][0], ops[True][0]])
+            is_equal = np.array_equal(output_default, output_s2b)
+            max_diff = np.abs(output_default - output_s2b).max()
+
+            for space_to_batch, name in [(False, "default"), (True, "space_to_batch")]:
+                for _ in range(5):
+                    session.run(ops[space_to_batch][1])
+                start_time = time.perf_counter()
+                for _ in range(num_steps):
+                    session.run(ops[space_to_batch][1])
+                results[(dilation, name)] = (time.perf_counter() - start_time)*1000/num_steps
+        print("dilation {}: default {:.2f} ms, space_to_batch {:.2f} ms, speedup {:.2f}, exactly equal {} (max abs diff {:.2e})".format(dilation,
+                                                                                                                                     results[(dilation, "default")],
+                                                                                                                                     results[(dilation, "space_to_batch")],
+                                                                                                                                     results[(dilation, "default")]/results[(dilation, "space_to_batch")],
+                                                                                                                                     is_equal, max_diff))
+    tf.reset_default_graph()
+    return results
+
+
+def build_recompute_blocks(config, input_dims, target_dims, sequence_length, batch_size, segment_sizes, num_layers):
+    """
+    Builds the temporal blocks of a TCN-based configuration for every `recompute_segment_size` in `segment_sizes`. The
+    blocks share variables in the `recompute_check` scope.
+
+    Returns:
+        (dict, list): losses for every segment size and the trainable variables of the blocks.
+    """
+    placeholders = create_synthetic_placeholders(batch_size, sequence_length, input_dims, target_dims)
+    model = config.model_cls(config=config, session=None, reuse=False, mode=C.TRAIN, placeholders=placeholders,
+                             input_dims=input_dims, target_dims=target_dims,
+                             global_step=tf.Variable(1, trainable=False, name='global_step'))
+    inputs = tf.constant(np.random.RandomState(C.SEED).randn(batch_size, sequence_length, model.cnn_layer_config['num_filters']).astype(np.float32))
+
+    losses = dict()
+    for i, recompute_segment_size in enumerate(segment_sizes):
+        model.cnn_layer_config['recompute_segment_size'] = recompute_segment_size
+        with tf.variable_scope('recompute_check', reuse=i > 0):
+            blocks, blocks_no_res = model.build_temporal_block(inputs, num_layers, i > 0, model.cnn_layer_config['filter_size'])
+        losses[recompute_segment_size] = tf.add_n([tf.reduce_sum(tf.square(block)) for block in [blocks[-1]] + blocks_no_res])
+    model.cnn_layer_config['recompute_segment_size'] = 0
+    return losses, tf.trainable_variables('recompute_check')
+
+
+def time_recompute_setting(Configuration_cls, config_dict, input_dims, target_dims, sequence_length, batch_size,
+                           segment_size, num_layers, num_steps, session_config=None):
+    """
+    Times the backward pass of the temporal blocks with a single `recompute_segment_size` and measures the memory. It
+    is called in a fresh process, since the peak resident set size of a process never decreases.
+
+    Returns:
+        (dict): time per step in milliseconds, peak resident set size of the process and its increase during the steps
+        in bytes.
+    """
+    tf.reset_default_graph()
+    losses, block_variables = build_recompute_blocks(Configuration_cls(**config_dict), input_dims, target_dims, sequence_length,
+                                                     batch_size, [segment_size], num_layers)
+    train_op = tf.group(*tf.gradients(losses[segment_size], block_variables))
+    with tf.Session(config=session_config) as session:
+        session.run(tf.global_variables_initializer())
+        peak_rss_before = get_peak_rss()
+        for _ in range(3):
+            session.run(train_op)
+        start_time = time.perf_counter()
+        for _ in range(num_steps):
+            session.run(train_op)
+        time_per_step = (time.perf_counter() - start_time)*1000/num_steps
+    peak_rss = get_peak_rss()
+    return {'time': time_per_step, 'peak_rss': peak_rss, 'step_rss': peak_rss - peak_rss_before}
+
+
+def benchmark_recompute(Configuration_cls, config_paths, input_dims, target_dims, sequence_length, num_steps=20, segment_size=2, batch_size=4, session_config=None):
+    """
+    Checks temporal blocks whose activations are recomputed in the backward pass (`recompute_segment_size`) and compares
+    their step time and memory with stored activations. The blocks of every TCN-based configuration are built twice
+    with shared variables, with and without recomputation. Every trainable variable of the blocks must get a gradient,
+    and the gradients must match the ones calculated with stored activations.
+
+    Memory is measured by the peak resident set size of a fresh process per setting, which is valid on CPU where the
+    tensorflow allocator doesn't collect statistics. `step rss` is the increase of the peak during the training steps,
+    i.e., mostly the activations kept for the backward pass.
+
+    Returns:
+        (dict): maximum absolute gradient difference, and time per step in milliseconds, peak resident set size and its
+        increase during the steps in bytes for every configuration and setting.
+    """
+    results = dict()
+    for config_path in config_paths:
+        config_dict = update_config_dict(Configuration_cls.from_json(config_path), {"cnn_layer": {"recompute_segment_size": 0}})
+        config = Configuration_cls(**config_dict)
+        if not issubclass(config.model_cls, TCN):
+            continue
+
+        tf.reset_default_graph()
+        num_layers = min(len(config.get('cnn_layer')['dilation_size']), 2*segment_size + 1)
+        losses, block_variables = build_recompute_blocks(config, input_dims, target_dims, sequence_length, batch_size, [0, segment_size], num_layers)
+        grads = {key: tf.gradients(loss, block_variables) for key, loss in losses.items()}
+        missing = [var.op.name for var, grad in zip(block_variables, grads[segment_size]) if grad is None]
+        assert len(missing) == 0, "No gradients with recomputation: " + str(missing)
+
+        with tf.Session(config=session_config) as session:
+            session.run(tf.global_variables_initializer())
+            grads_default, grads_recompute = session.run([grads[0], grads[segment_size]])
+            max_diff = max(np.abs(default - recompute).max() for default, recompute in zip(grads_default, grads_recompute))
+            max_value = max(np.abs(default).max() for default in grads_default)
+            assert max_diff <= 1e-4*max(max_value, 1.0), "Gradients with recomputation differ: {:.2e}".format(max_diff)
+        tf.reset_default_graph()
+
+        results[config_path] = {'max_diff': max_diff}
+        for key, name in [(0, "default"), (segment_size, "recompute")]:
+            results[config_path][name] = run_in_subprocess(time_recompute_setting, Configuration_cls, config_dict, input_dims, target_dims,
+                                                           sequence_length, batch_size, key, num_layers, num_steps, session_config)
+        print("{}: {} blocks, max abs gradient diff {:.2e}".format(config_path, num_layers, max_diff))
+        for name in ["default", "recompute"]:
+            result = results[config_path][name]
+            print("    {:<10} {:>8.2f} ms, peak rss {:>8.1f} MB, step rss {:>8.1f} MB".format(name, result['time'], result['peak_rss']/2**20,
+                                                                                            result['step_rss']/2**20))
+    return results
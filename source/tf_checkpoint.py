@@ -0,0 +1,152 @@
+import tensorflow as tf
+import numpy as np
+import argparse
+import copy
+import json
+import os
+import re
+from constants import Constants as C
+
+"""
+Checkpoint conversion utilities.
+
+Separate mu/sigma latent networks to shared trunk (see `LadderLatentLayer.build_latent_dist_shared`):
+- Hidden layers of the trunk are initialized with the hidden layers of the mu network. Hidden layers of the sigma network
+are dropped. Hence, the converted model is a warm-start rather than an exact copy and needs fine-tuning.
+- Output layers of mu and sigma networks are concatenated into the 2*latent_size output layer of the trunk. For `tcn`
+latent layers, the 1x1 output convolution of the gated head becomes a block-diagonal kernel.
+- Optimizer slots (i.e., Adam moments) are converted in the same way so that the training can be continued.
+
+Example run command:
+    python tf_checkpoint.py --model_dir <PATH-TO>/runs/tf-<model_id>-stcn --output_dir <PATH-TO>/runs/tf-<new_model_id>-stcn_shared
+"""
+
+# Variable scopes of latent networks, i.e., "latent/p_3_mu/conv1d/kernel".
+LATENT_SCOPE_REGEX = re.compile("^([" + C.LATENT_P + C.LATENT_Q + "]_[0-9]+)_mu$")
+
+
+def get_layer_name(base_name, idx):
+    """
+    Name of the idx-th layer created by `tf.layers` in the same variable scope.
+    """
+    return base_name if idx == 0 else base_name + "_" + str(idx)
+
+
+def block_diagonal(kernel_1, kernel_2):
+    """
+    Creates a 1x1 convolution kernel applying kernel_1 and kernel_2 to the first and second halves of the channels.
+    """
+    width, in_1, out_1 = kernel_1.shape
+    _, in_2, out_2 = kernel_2.shape
+    kernel = np.zeros((width, in_1 + in_2, out_1 + out_2), dtype=kernel_1.dtype)
+    kernel[:, :in_1, :out_1] = kernel_1
+    kernel[:, in_1:, out_1:] = kernel_2
+    return kernel
+
+
+def convert_shared_trunk_variables(variables, layer_structure, num_hidden_layers):
+    """
+    Maps variables of separate mu/sigma latent networks to the shared trunk layout.
+
+    Args:
+        variables (dict): variable name and numpy array pairs.
+        layer_structure (str): `layer_structure` of latent layer config.
+        num_hidden_layers (int): `num_hidden_layers` of latent layer config.
+
+    Returns:
+        (dict): converted variables.
+    """
+    if layer_structure == C.LAYER_CONV1:
+        concat_layers = [get_layer_name("conv1d", num_hidden_layers)]
+        block_diagonal_layers = []
+    elif layer_structure == C.LAYER_FC:
+        concat_layers = [get_layer_name("dense", num_hidden_layers)]
+        block_diagonal_layers = []
+    elif layer_structure == C.LAYER_TCN:
+        # Every temporal block consists of filter, gate and output convolutions.
+        concat_layers = [get_layer_name("conv1d", 3*num_hidden_layers), get_layer_name("conv1d", 3*num_hidden_layers + 1)]
+        block_diagonal_layers = [get_layer_name("conv1d", 3*num_hidden_layers + 2)]
+    else:
+        raise Exception("Unknown latent layer type.")
+
+    converted = dict()
+    for name, value in variables.items():
+        components = name.split("/")
+        scope_idx = [i for i, component in enumerate(components) if LATENT_SCOPE_REGEX.match(component)]
+        sigma_scope_idx = [i for i, component in enumerate(components) if component.endswith("_sigma") and LATENT_SCOPE_REGEX.match(component[:-6] + "_mu")]
+        if len(sigma_scope_idx) > 0:
+            continue  # Merged with the corresponding mu variable.
+        if len(scope_idx) == 0:
+            converted[name] = value
+            continue
+
+        i = scope_idx[0]
+        scope = LATENT_SCOPE_REGEX.match(components[i]).group(1)
+        trunk_name = "/".join(components[:i] + [scope + "_trunk"] + components[i + 1:])
+        sigma_name = "/".join(components[:i] + [scope + "_sigma"] + components[i + 1:])
+        layer_name = components[i + 1]
+        is_kernel = components[i + 2] == "kernel"
+
+        if layer_name in concat_layers:
+            converted[trunk_name] = np.concatenate([value, variables[sigma_name]], axis=-1)
+        elif layer_name in block_diagonal_layers:
+            if is_kernel:
+                converted[trunk_name] = block_diagonal(value, variables[sigma_name])
+            else:
+                converted[trunk_name] = np.concatenate([value, variables[sigma_name]], axis=-1)
+        else:
+            converted[trunk_name] = value
+    return converted
+
+
+def convert_to_shared_trunk(checkpoint_path, output_dir, latent_config):
+    """
+    Converts a checkpoint of a model with separate mu/sigma latent networks and saves it into `output_dir`.
+
+    Args:
+        checkpoint_path (str): checkpoint prefix, i.e., <model_dir>/model-10000.
+        output_dir (str): directory of the converted checkpoint.
+        latent_config (dict): `latent_layer` configuration of the model.
+
+    Returns:
+        (str): path of the converted checkpoint.
+    """
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    variables = {name: reader.get_tensor(name) for name in reader.get_variable_to_shape_map().keys()}
+    converted = convert_shared_trunk_variables(variables, latent_config.get('layer_structure', C.LAYER_CONV1), latent_config['num_hidden_layers'])
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with tf.Graph().as_default():
+        var_list = {name: tf.Variable(value, name=name) for name, value in converted.items()}
+        saver = tf.train.Saver(var_list=var_list, save_relative_paths=True)
+        with tf.Session() as session:
+            session.run(tf.global_variables_initializer())
+            save_path = saver.save(session, os.path.join(output_dir, 'model'), global_step=int(variables.get('global_step', 0)))
+
+    print("{} variables are converted into {} variables.".format(len(variables), len(converted)))
+    return save_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', required=True, type=str, help='Model directory containing config.json and checkpoints.')
+    parser.add_argument('--checkpoint_id', type=str, default=None, help='Model checkpoint. If not set, then the last checkpoint is used.')
+    parser.add_argument('--output_dir', required=True, type=str, help='Directory of the converted model.')
+    args = parser.parse_args()
+
+    config_dict = json.load(open(os.path.join(args.model_dir, 'config.json'), 'r'))
+    if args.checkpoint_id is None:
+        checkpoint_path = tf.train.latest_checkpoint(args.model_dir)
+    else:
+        checkpoint_path = os.path.join(args.model_dir, args.checkpoint_id)
+
+    save_path = convert_to_shared_trunk(checkpoint_path, args.output_dir, config_dict['latent_layer'])
+
+    # Configuration of the converted model.
+    new_config_dict = copy.deepcopy(config_dict)
+    new_config_dict['latent_layer']['shared_trunk'] = True
+    new_config_dict['model_dir'] = os.path.abspath(args.output_dir)
+    new_config_dict['checkpoint_id'] = os.path.basename(save_path)
+    json.dump(new_config_dict, open(os.path.join(args.output_dir, 'config.json'), 'w'), indent=4, sort_keys=True)
+    print("Converted model: " + save_path)
@@ -13,17 +13,22 @@ class DataFeederTF(object):
     Uses threads to enqueue data asynchronously, and hides I/O latency.
     """
 
-    def __init__(self, dataset, num_epochs, batch_size=16, queue_capacity=512, shuffle=True, allow_smaller_final_batch=False):
+    def __init__(self, dataset, num_epochs, batch_size=16, queue_capacity=512, shuffle=True, allow_smaller_final_batch=False,
+                 shard_index=0, num_shards=1):
         """
 
         Args:
             dataset (Dataset):
             batch_size:
             queue_capacity:
+            shard_index (int): index of the dataset shard to feed (see `Dataset.sample_generator`).
+            num_shards (int): number of shards, i.e., number of workers in distributed training.
         """
         assert(isinstance(dataset, BaseDataset))
 
         self.dataset = dataset
+        self.shard_index = shard_index
+        self.num_shards = num_shards
         self.num_epochs = num_epochs
         self.batch_size = batch_size
         self.queue_capacity = queue_capacity
@@ -106,14 +111,14 @@ class DataFeederTF(object):
         return self.batch
 
     def __enqueue(self, tf_session, tf_coord):
-        sample_generator = self.dataset.sample_generator()
+        sample_generator = self.dataset.sample_generator(shard_index=self.shard_index, num_shards=self.num_shards)
         while self.epoch <= self.num_epochs and not tf_coord.should_stop():
             try:
                 sample = next(sample_generator)
                 feed_dict = {pl: val for pl, val in zip(self.queue_placeholders, sample)}
                 tf_session.run(self.enqueue_op, feed_dict=feed_dict)
             except StopIteration:
-                sample_generator = self.dataset.sample_generator()
+                sample_generator = self.dataset.sample_generator(shard_index=self.shard_index, num_shards=self.num_shards)
                 self.epoch += 1
             except tf.errors.CancelledError:
                 pass
@@ -123,6 +128,55 @@ class DataFeederTF(object):
         self.enqueue_threads.start()
 
 
+class EvaluationDataFeederTF(object):
+    """
+    Finite input pipeline iterating over all samples of a dataset exactly once and in the original order, including the
+    final smaller batch. Samples are read by `num_readers` parallel generators, each yielding every `num_readers`-th
+    sample (see `sample_generator`), and interleaved back into the original order. Variable-length samples are padded
+    per batch.
+
+    The iterator must be initialized before every pass over the data. Then, the evaluation loop runs until
+    `tf.errors.OutOfRangeError` is raised. See `BaseTemporalModel.evaluation_step`. Hence, the same feeder is used for
+    validation during training and in evaluation scripts.
+    """
+
+    def __init__(self, dataset, batch_size=16, num_readers=4, prefetch_size=2):
+        """
+
+        Args:
+            dataset (Dataset):
+            batch_size:
+            num_readers: number of parallel sample generators.
+            prefetch_size: number of batches prepared in advance.
+        """
+        assert(isinstance(dataset, BaseDataset))
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.num_readers = max(1, num_readers)
+
+        output_types = tuple(self.dataset.sample_tf_type)
+        output_shapes = tuple(tf.TensorShape(shape) for shape in self.dataset.sample_shape)
+
+        def shard_generator(shard_index):
+            return self.dataset.sample_generator(shard_index=shard_index, num_shards=self.num_readers)
+
+        def shard_dataset(shard_index):
+            return tf.data.Dataset.from_generator(shard_generator, output_types, output_shapes, args=(shard_index,))
+
+        # sloppy=False keeps the round-robin order of the shards, i.e., the original order of the samples.
+        samples = tf.data.Dataset.range(self.num_readers).apply(tf.contrib.data.parallel_interleave(shard_dataset,
+                                                                                                   cycle_length=self.num_readers,
+                                                                                                   block_length=1,
+                                                                                                   sloppy=False))
+        samples = samples.map(lambda *sample: dict(zip(self.dataset.sample_key, sample)))
+        batches = samples.padded_batch(self.batch_size, padded_shapes=samples.output_shapes).prefetch(prefetch_size)
+
+        self.iterator = batches.make_initializable_iterator()
+        self.initializer = self.iterator.initializer
+        self.batch = self.iterator.get_next()
+
+
 class TFStagingArea(object):
 
     def __init__(self, tensors, device_name=None):
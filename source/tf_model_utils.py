@@ -66,6 +66,72 @@ def linear(input_layer, output_size, activation_fn=None, batch_norm=False, is_tr
     return dense_layer
 
 
+def time_to_batch(input_layer, dilation):
+    """
+    Splits the sequences into `dilation` interleaved sub-sequences and stacks them along the batch dimension, i.e.,
+    (batch_size, seq_len, num_channels) -> (dilation*batch_size, seq_len/dilation, num_channels) where the j-th
+    sub-sequence consists of steps j, j+dilation, j+2*dilation, ... A dilated convolution on the input is then an
+    ordinary convolution on the sub-sequences. The input is zero-padded at the end if seq_len is not a multiple of
+    dilation.
+
+    Args:
+        input_layer: tensor with shape (batch_size, seq_len, num_channels).
+        dilation (int):
+
+    Returns:
+        (tensor): sub-sequences.
+    """
+    num_channels = input_layer.shape.as_list()[-1]
+    input_shape = tf.shape(input_layer)
+    padding_steps = tf.mod(-input_shape[1], dilation)
+    padded_input = tf.pad(input_layer, [[0, 0], [0, padding_steps], [0, 0]])
+    sub_seq_len = (input_shape[1] + padding_steps)//dilation
+
+    sub_sequences = tf.reshape(padded_input, [input_shape[0], sub_seq_len, dilation, num_channels])
+    sub_sequences = tf.transpose(sub_sequences, [2, 0, 1, 3])
+    return tf.reshape(sub_sequences, [dilation*input_shape[0], sub_seq_len, num_channels])
+
+
+def batch_to_time(input_layer, dilation, seq_len):
+    """
+    Inverse of `time_to_batch`. Interleaves the sub-sequences and crops the sequence to `seq_len` steps.
+
+    Args:
+        input_layer: tensor with shape (dilation*batch_size, sub_seq_len, num_channels).
+        dilation (int):
+        seq_len: length of the output sequence, at most dilation*sub_seq_len.
+
+    Returns:
+        (tensor): sequences with shape (batch_size, seq_len, num_channels).
+    """
+    num_channels = input_layer.shape.as_list()[-1]
+    input_shape = tf.shape(input_layer)
+    sequences = tf.reshape(input_layer, [dilation, input_shape[0]//dilation, input_shape[1], num_channels])
+    sequences = tf.transpose(sequences, [1, 2, 0, 3])
+    sequences = tf.reshape(sequences, [input_shape[0]//dilation, input_shape[1]*dilation, num_channels])
+    return sequences[:, :seq_len]
+
+
+def repeat_batch(tensor, num_repeats):
+    """
+    Repeats every sample of a batch `num_repeats` times consecutively, i.e., (batch_size, ...) ->
+    (num_repeats*batch_size, ...) where the samples i*num_repeats, ..., (i+1)*num_repeats-1 are copies of the i-th
+    sample. Static shape of the remaining dimensions is kept.
+
+    Args:
+        tensor: tensor with at least one dimension.
+        num_repeats (int):
+
+    Returns:
+        (tensor): repeated batch.
+    """
+    rank = tensor.shape.ndims
+    static_shape = tensor.shape.as_list()
+    dynamic_shape = tf.shape(tensor)
+    tiled = tf.tile(tf.expand_dims(tensor, 1), [1, num_repeats] + [1]*(rank - 1))
+    return tf.reshape(tiled, [-1] + [static_shape[i] if static_shape[i] is not None else dynamic_shape[i] for i in range(1, rank)])
+
+
 def fully_connected_layer(input_layer, is_training=True, **kwargs):
     """
     Creates fully connected layers.
@@ -186,6 +252,9 @@ def get_rnn_cell(**kwargs):
         rnn_cell_constructor = tf.contrib.rnn.LSTMCell
     elif cell_type == C.BLSTM:
         rnn_cell_constructor = tf.contrib.rnn.LSTMBlockCell
+    elif cell_type == C.FUSED_LSTM:
+        # Step-wise counterpart of `FusedRNNLayer` for recurrences which can't be run on the whole sequence at once.
+        rnn_cell_constructor = tf.contrib.rnn.LSTMBlockCell
     elif cell_type.lower() == C.GRU:
         rnn_cell_constructor = tf.contrib.rnn.GRUCell
     elif cell_type.lower() == C.LayerNormLSTM:
@@ -220,6 +289,81 @@ def get_rnn_cell(**kwargs):
     return cell
 
 
+class FusedRNNLayer(object):
+    """
+    Stacked LSTM layer running the whole sequence with `LSTMBlockFusedCell` instead of unrolling a cell step by step in
+    `tf.nn.dynamic_rnn`. It is a replacement of `get_rnn_cell` + `tf.nn.dynamic_rnn` pair if the inputs are known in
+    advance. The state has the same structure as the state of the corresponding `MultiRNNCell`, i.e., an
+    `LSTMStateTuple` per layer.
+
+    `dropout_keep_prob` is interpreted as documented in `get_rnn_cell`: a list is applied on the inputs of every layer,
+    a scalar is applied on the inputs and outputs of the stack. Dropout is applied only if `is_training` is True. Note
+    that `get_rnn_cell` ignores a scalar `dropout_keep_prob`, i.e., `lstm` and `blstm` cells are trained without dropout
+    while `fused_lstm` applies it. Every dropout op draws its own mask.
+    """
+    def __init__(self, size, num_layers=1, dropout_keep_prob=1.0, is_training=True, **kwargs):
+        self.size = size
+        self.num_layers = num_layers
+        self.dropout_keep_prob = dropout_keep_prob
+        self.is_training = is_training
+
+        self.layer_keep_probs = [1.0]*num_layers
+        self.input_keep_prob = 1.0
+        self.output_keep_prob = 1.0
+        if is_training:
+            if isinstance(dropout_keep_prob, list) and len(dropout_keep_prob) == num_layers:
+                self.layer_keep_probs = dropout_keep_prob
+            elif not isinstance(dropout_keep_prob, list):
+                self.input_keep_prob = dropout_keep_prob
+                self.output_keep_prob = dropout_keep_prob
+
+        self.cells = [tf.contrib.rnn.LSTMBlockFusedCell(size, name="lstm_fused_cell_" + str(i)) for i in range(num_layers)]
+
+    @property
+    def state_size(self):
+        state_size = [tf.contrib.rnn.LSTMStateTuple(self.size, self.size)]*self.num_layers
+        return tuple(state_size) if self.num_layers > 1 else state_size[0]
+
+    @property
+    def output_size(self):
+        return self.size
+
+    def zero_state(self, batch_size, dtype):
+        state = [tf.contrib.rnn.LSTMStateTuple(tf.zeros((batch_size, self.size), dtype=dtype), tf.zeros((batch_size, self.size), dtype=dtype)) for _ in range(self.num_layers)]
+        return tuple(state) if self.num_layers > 1 else state[0]
+
+    def __call__(self, inputs, sequence_length, initial_state, scope=None):
+        """
+        Args:
+            inputs: batch-major inputs with shape (batch_size, seq_len, feature_size).
+            sequence_length: length of every sequence in the batch.
+            initial_state: same structure as `zero_state`.
+            scope:
+
+        Returns:
+            (outputs, state) where outputs have shape (batch_size, seq_len, size). Outputs after the sequence length
+            are zero and the state is the state at the last valid step as in `tf.nn.dynamic_rnn`.
+        """
+        initial_state = initial_state if self.num_layers > 1 else (initial_state,)
+        with tf.variable_scope(scope or "fused_rnn"):
+            hidden = tf.transpose(inputs, [1, 0, 2])  # The fused op is time-major.
+            if self.input_keep_prob < 1.0:
+                hidden = tf.nn.dropout(hidden, keep_prob=self.input_keep_prob)
+
+            output_state = []
+            for i, cell in enumerate(self.cells):
+                if self.layer_keep_probs[i] < 1.0:
+                    hidden = tf.nn.dropout(hidden, keep_prob=self.layer_keep_probs[i])
+                hidden, (state_c, state_h) = cell(hidden, initial_state=tuple(initial_state[i]), dtype=tf.float32, sequence_length=sequence_length)
+                output_state.append(tf.contrib.rnn.LSTMStateTuple(state_c, state_h))
+
+            if self.output_keep_prob < 1.0:
+                hidden = tf.nn.dropout(hidden, keep_prob=self.output_keep_prob)
+            outputs = tf.transpose(hidden, [1, 0, 2])
+
+        return outputs, tuple(output_state) if self.num_layers > 1 else output_state[0]
+
+
 def get_decay_variable(global_step, config, name=None):
     """
     Creates a variable decaying in time with respect to the global step.
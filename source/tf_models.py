@@ -6,8 +6,11 @@ import math
 import copy
 import tf_loss
 from tf_model_utils import get_reduce_loss_func, get_rnn_cell, linear, fully_connected_layer, get_activation_fn, get_decay_variable
+from tf_model_utils import time_to_batch, batch_to_time, FusedRNNLayer, repeat_batch
+from cost_model import receptive_field_size
 from constants import Constants as C
 from tf_rnn_cells import VRNNCell
+from utils import get_peak_rss
 
 """
 Vanilla variational recurrent neural network model.
@@ -39,6 +42,8 @@ class LatentLayer(object):
         self.layer_fc = self.layer_structure == C.LAYER_FC
         self.layer_tcn = self.layer_structure == C.LAYER_TCN
         self.global_step = kwargs.get("global_step", None)
+        # Whether log importance weights of the latent samples are evaluated. See `build_log_importance_ratio`.
+        self.importance_weighted = kwargs.get("importance_weighted", False)
 
         self.ops_loss = dict()
 
@@ -69,6 +74,33 @@ class LatentLayer(object):
         """
         raise NotImplementedError('subclasses must override sample method')
 
+    def build_log_importance_ratio(self, sequence_mask):
+        """
+        Builds log p(z) - log q(z|x) of the latent samples drawn from the approximate posterior.
+        Args:
+            sequence_mask: mask to be applied on variable-length sequences.
+        Returns:
+            (batch_size, ) log density ratio summed over time-steps.
+        """
+        raise NotImplementedError('subclasses must override build_log_importance_ratio method')
+
+    @staticmethod
+    def log_density_ratio(z, q_dist, p_dist, sequence_mask):
+        """
+        Calculates log N(z; p_mu, p_sigma) - log N(z; q_mu, q_sigma) of isotropic Gaussian distributions.
+        Args:
+            z: latent sample with shape (batch_size, seq_len, latent_size).
+            q_dist: (mu, sigma) of the approximate posterior.
+            p_dist: (mu, sigma) of the prior.
+            sequence_mask: mask to be applied on variable-length sequences.
+        Returns:
+            (batch_size, ) log density ratio summed over time-steps.
+        """
+        with tf.name_scope("log_density_ratio"):
+            log_p = tf_loss.logli_normal_isotropic(z, p_dist[0], p_dist[1])
+            log_q = tf_loss.logli_normal_isotropic(z, q_dist[0], q_dist[1])
+            return tf.reduce_sum(sequence_mask*(log_p - log_q), axis=[1, 2])
+
     @staticmethod
     def build_tcn_layer(input_layer, num_latent_units, latent_activation_fn, kernel_size, dilation, num_hidden_layers, num_hidden_units, is_training):
         """
@@ -154,7 +186,7 @@ class GaussianLatentLayer(LatentLayer):
     VAE latent space for time-series data, modeled by a Gaussian distribution with diagonal covariance matrix.
     """
     def __init__(self, config, mode, reuse, **kwargs):
-        super(GaussianLatentLayer, self).__init__(config, mode, reuse, )
+        super(GaussianLatentLayer, self).__init__(config, mode, reuse, **kwargs)
 
         self.use_temporal_kld = self.config.get('use_temporal_kld', False)
         self.tkld_weight = self.config.get('tkld_weight', 0.1)
@@ -167,6 +199,7 @@ class GaussianLatentLayer(LatentLayer):
         self.q_mu = None
         self.p_sigma = None
         self.q_sigma = None
+        self.latent_sample = None
 
     def build_loss(self, sequence_mask, reduce_loss_fn, loss_ops_dict, **kwargs):
         """
@@ -175,13 +208,11 @@ class GaussianLatentLayer(LatentLayer):
         """
         loss_key = "loss_kld"
         with tf.name_scope("kld_loss"):
-            self.ops_loss[loss_key] = self.kld_weight*reduce_loss_fn(
-                sequence_mask*tf_loss.kld_normal_isotropic(self.q_mu,
-                                                           self.q_sigma,
-                                                           self.p_mu,
-                                                           self.p_sigma,
-                                                           reduce_sum=False))
+            seq_kld_loss = sequence_mask*tf_loss.kld_normal_isotropic(self.q_mu, self.q_sigma, self.p_mu, self.p_sigma, reduce_sum=False)
+            self.ops_loss[loss_key] = self.kld_weight*reduce_loss_fn(seq_kld_loss)
             loss_ops_dict[loss_key] = self.ops_loss[loss_key]
+            if kwargs.get("step_loss_dict", None) is not None:
+                kwargs["step_loss_dict"][loss_key] = self.kld_weight*tf.reduce_sum(seq_kld_loss, axis=2)
 
         if self.is_training and self.use_temporal_kld:
             prior_step = 1
@@ -302,6 +333,7 @@ class GaussianLatentLayer(LatentLayer):
                 eps = tf.random_normal(tf.shape(self.q_sigma), 0.0, 1.0, dtype=tf.float32)
                 q_z = tf.add(self.q_mu, tf.multiply(self.q_sigma, eps))
                 latent_sample = q_z
+            self.latent_sample = latent_sample
 
         # Register latent ops and summaries.
         if output_ops_dict is not None:
@@ -323,6 +355,9 @@ class GaussianLatentLayer(LatentLayer):
 
         return latent_sample
 
+    def build_log_importance_ratio(self, sequence_mask):
+        return LatentLayer.log_density_ratio(self.latent_sample, (self.q_mu, self.q_sigma), (self.p_mu, self.p_sigma), sequence_mask)
+
 
 class LadderLatentLayer(LatentLayer):
     """
@@ -338,6 +373,9 @@ class LadderLatentLayer(LatentLayer):
         self.vertical_dilation = self.config.get('vertical_dilation', 1)
         # Draw a new sample from the approximated posterior whenever needed. Otherwise, draw once and use it every time.
         self.use_same_q_sample = self.config.get('use_same_q_sample', False)
+        # Importance weights require a single sample per stochastic layer which is used everywhere.
+        if self.importance_weighted:
+            self.use_same_q_sample = True
         # Whether the top-most prior is dynamic or not. LadderVAE paper uses standard N(0,I) prior.
         self.use_fixed_pz1 = self.config.get('use_fixed_pz1', False)
         # Prior is calculated by using the deterministic representations at previous step.
@@ -351,6 +389,9 @@ class LadderLatentLayer(LatentLayer):
         self.top_down_latents = self.config.get('top_down_latents', True)
         # Network type (i.e., dense, convolutional, etc.) we use to parametrize the latent distributions.
         self.latent_layer_structure = self.config.get('layer_structure', C.LAYER_CONV1)
+        # Whether mu and sigma are predicted by a single network or by two separate networks. See
+        # `build_latent_dist_shared` and `tf_checkpoint.py` to convert checkpoints of separate networks.
+        self.shared_trunk = self.config.get('shared_trunk', False)
 
         # Annealing KL-divergence weight or using fixed weight.
         kld_weight = self.config.get('kld_weight', 1)
@@ -376,6 +417,7 @@ class LadderLatentLayer(LatentLayer):
         self.p_dists = None  # List of prior distributions.
         self.kld_loss_terms = []  # List of KLD loss term.
         self.latent_samples = []  # List of latent samples.
+        self.q_samples = None  # List of posterior samples per stochastic layer, used in importance weights.
 
     def build_latent_dist_conv1(self, input_, idx, scope, reuse):
         with tf.name_scope(scope):
@@ -452,6 +494,51 @@ class LadderLatentLayer(LatentLayer):
 
         return (mu, sigma),  (flat_mu, flat_sigma)
 
+    def build_latent_dist_shared(self, input_, idx, scope, reuse):
+        """
+        Parametrizes mu and sigma by a single hidden stack with 2*latent_size outputs. The first half is used as mu and
+        softplus of the second half as sigma.
+        """
+        latent_size = self.config['latent_size'][idx]
+        with tf.name_scope(scope):
+            with tf.variable_scope(scope + '_trunk', reuse=reuse):
+                if self.latent_layer_structure == C.LAYER_FC:
+                    params, _ = LatentLayer.build_fc_layer(input_layer=input_,
+                                                           num_latent_units=2*latent_size,
+                                                           latent_activation_fn=None,
+                                                           num_hidden_layers=self.config["num_hidden_layers"],
+                                                           num_hidden_units=self.config["num_hidden_units"],
+                                                           hidden_activation_fn=self.config["hidden_activation_fn"],
+                                                           is_training=self.is_training)
+                elif self.latent_layer_structure == C.LAYER_TCN:
+                    params, _ = LatentLayer.build_tcn_layer(input_layer=input_,
+                                                            num_latent_units=2*latent_size,
+                                                            latent_activation_fn=None,
+                                                            kernel_size=self.config.get("kernel_size", 1),
+                                                            dilation=self.config.get("dilation", 1),
+                                                            num_hidden_layers=self.config["num_hidden_layers"],
+                                                            num_hidden_units=self.config["num_hidden_units"],
+                                                            is_training=self.is_training)
+                elif self.latent_layer_structure == C.LAYER_CONV1:
+                    params, _ = LatentLayer.build_conv1_layer(input_layer=input_,
+                                                              num_latent_units=2*latent_size,
+                                                              latent_activation_fn=None,
+                                                              num_hidden_layers=self.config["num_hidden_layers"],
+                                                              num_hidden_units=self.config["num_hidden_units"],
+                                                              hidden_activation_fn=self.config["hidden_activation_fn"],
+                                                              is_training=self.is_training)
+                else:
+                    raise Exception("Unknown latent layer type.")
+
+            mu, sigma = tf.split(params, 2, axis=-1)
+            sigma = tf.nn.softplus(sigma)
+            if self.config.get('latent_sigma_threshold', 0) > 0:
+                sigma = tf.clip_by_value(sigma, 1e-3, self.config.get('latent_sigma_threshold'))
+            flat_mu = tf.reshape(mu, [-1, latent_size])
+            flat_sigma = tf.reshape(sigma, [-1, latent_size])
+
+        return (mu, sigma), (flat_mu, flat_sigma)
+
     def build_latent_dist(self, input_, idx, scope, reuse):
         """
         Given the input parametrizes a Normal distribution.
@@ -463,7 +550,9 @@ class LadderLatentLayer(LatentLayer):
         Returns:
             mu and sigma tensors.
         """
-        if self.latent_layer_structure == C.LAYER_FC:
+        if self.shared_trunk:
+            return self.build_latent_dist_shared(input_, idx, scope, reuse)
+        elif self.latent_layer_structure == C.LAYER_FC:
             return self.build_latent_dist_fc(input_, idx, scope, reuse)
         elif self.latent_layer_structure == C.LAYER_TCN:
             return self.build_latent_dist_tcn(input_, idx, scope, reuse)
@@ -500,6 +589,7 @@ class LadderLatentLayer(LatentLayer):
         self.q_approximate = [0]*self.num_s_layers
         self.q_dists = [0]*self.num_s_layers
         self.p_dists = [0]*self.num_s_layers
+        self.q_samples = [0]*self.num_s_layers
 
         # Indexing latent variables.
         if self.top_down_latents:
@@ -552,6 +642,7 @@ class LadderLatentLayer(LatentLayer):
 
         posterior_sample_scope = "app_posterior_" + str(sl+1)
         posterior_sample = self.draw_latent_sample(posterior[0], posterior[1], p_dist[0], p_dist[1], scope=posterior_sample_scope, idx=sl)
+        self.q_samples[sl] = posterior_sample
         if self.dense_z:
             self.latent_samples.append(posterior_sample)
 
@@ -611,12 +702,15 @@ class LadderLatentLayer(LatentLayer):
             # Draw a new sample from the approximated posterior distribution of this layer.
             posterior_sample_scope = "app_posterior_" + str(sl+1)
             posterior_sample = self.draw_latent_sample(posterior[0], posterior[1], p_dist[0], p_dist[1], posterior_sample_scope, sl)
+            self.q_samples[sl] = posterior_sample
             if self.dense_z:
                 self.latent_samples.append(posterior_sample)
 
         # TODO Missing an activation function. Do we need one here?
         if self.dense_z:  # Concatenate the latent samples of all stochastic layers.
             return tf.concat(self.latent_samples, axis=-1)
+        elif self.importance_weighted:  # Use the sample of the final stochastic layer the weights are calculated for.
+            return posterior_sample
         else:  # Use a latent sample from the final stochastic layer.
             return self.draw_latent_sample(posterior[0], posterior[1], p_dist[0], p_dist[1], posterior_sample_scope, sl)
 
@@ -627,12 +721,15 @@ class LadderLatentLayer(LatentLayer):
         """
         # eval_dict contains each KLD term and latent q, p distributions for further analysis.
         eval_dict = kwargs.get("eval_dict", None)
+        # step_loss_dict contains KLD terms before the reduction over time steps.
+        step_loss_dict = kwargs.get("step_loss_dict", None)
         if eval_dict is not None:
             eval_dict["q_dists"] = self.q_dists
             eval_dict["p_dists"] = self.p_dists
         if not self.is_sampling:
             loss_key = "loss_kld"
             kld_loss = 0.0
+            step_kld_loss = 0.0
             with tf.name_scope("kld_loss"):
                 for sl in range(self.num_s_layers-1, -1, -1):
                     with tf.name_scope("kld_" + str(sl)):
@@ -650,6 +747,11 @@ class LadderLatentLayer(LatentLayer):
 
                         self.kld_loss_terms.append(kld_term)
                         kld_loss += kld_term
+                        if step_loss_dict is not None:
+                            step_kld_term = self.kld_weight*tf.reduce_sum(seq_kld_loss, axis=2)
+                            if not self.is_training:
+                                step_loss_dict["KL"+str(sl)] = step_kld_term
+                            step_kld_loss += step_kld_term
                         if eval_dict is not None:
                             eval_dict["summary_kld_" + str(sl)] = kld_term
                             eval_dict["sequence_kld_" + str(sl)] = seq_kld_loss
@@ -657,6 +759,18 @@ class LadderLatentLayer(LatentLayer):
                 # Optimization is done through the accumulated term (i.e., loss_ops_dict[loss_key]).
                 self.ops_loss[loss_key] = kld_loss
                 loss_ops_dict[loss_key] = kld_loss
+                if step_loss_dict is not None:
+                    step_loss_dict[loss_key] = step_kld_loss
+
+    def build_log_importance_ratio(self, sequence_mask):
+        """
+        Sums the log density ratios of all stochastic layers. Note that p(z) of a layer is conditioned on the sample of
+        the preceding layer.
+        """
+        log_ratio = 0.0
+        for sl in range(self.num_s_layers):
+            log_ratio += LatentLayer.log_density_ratio(self.q_samples[sl], self.q_dists[sl], self.p_dists[sl], sequence_mask)
+        return log_ratio
 
     @classmethod
     def draw_latent_sample(cls, posterior_mu, posterior_sigma, prior_mu, prior_sigma, scope, idx):
@@ -724,6 +838,15 @@ class BaseTemporalModel(object):
         self.pl_inputs = placeholders[C.PL_INPUT]
         self.pl_targets = placeholders[C.PL_TARGET]
         self.pl_seq_length = placeholders[C.PL_SEQ_LEN]
+
+        # Importance-weighted evaluation. Every sample of the batch is repeated `importance_samples_per_pass` times in
+        # the graph such that as many latent samples are drawn in a single pass. Note that `self.placeholders` must be
+        # fed with the original batch. See `evaluation_step_importance_weighted` method.
+        self.importance_samples_per_pass = kwargs.get("importance_samples_per_pass", 0)
+        if self.importance_samples_per_pass > 0:
+            self.pl_inputs = repeat_batch(self.pl_inputs, self.importance_samples_per_pass)
+            self.pl_targets = repeat_batch(self.pl_targets, self.importance_samples_per_pass)
+            self.pl_seq_length = repeat_batch(self.pl_seq_length, self.importance_samples_per_pass)
         self.seq_loss_mask = tf.expand_dims(tf.sequence_mask(lengths=self.pl_seq_length, dtype=tf.float32), -1)
 
         # Create an activation function for std predictions.
@@ -787,6 +910,15 @@ class BaseTemporalModel(object):
         # To keep track of loss ops. List of loss terms that must be evaluated by session.run during training.
         self.ops_loss = dict()
 
+        # Loss terms before reduction with shape (batch_size, seq_len), i.e., summed over the feature dimension. They
+        # are accumulated over chunks of a sequence in streaming evaluation. See `evaluate_streaming` method.
+        self.ops_loss_per_step = dict()
+        # (initial state, final state) ops of recurrent models, carried over chunks in streaming evaluation.
+        self.streaming_state_ops = None
+        # Log importance weights log p(x|z) + log p(z) - log q(z|x) with shape (batch_size, ). Only latent variable
+        # models create it if `importance_samples_per_pass` is set.
+        self.ops_log_importance_weight = None
+
         # (Default) graph ops to be fed into session.run while evaluating the model. Note that tf_evaluate* codes expect
         # to get these op results.
         self.ops_evaluation = dict()
@@ -932,6 +1064,7 @@ class BaseTemporalModel(object):
                     self.likelihood += logli_term
                     loss_term = -loss_entry['weight']*self.reduce_loss_fn(self.seq_loss_mask*logli_term)
                     self.ops_loss[loss_key] = loss_term
+                    self.ops_loss_per_step[loss_key] = -loss_entry['weight']*tf.reduce_sum(self.seq_loss_mask*logli_term, axis=2)
 
     def build_total_loss(self):
         """
@@ -1000,26 +1133,40 @@ class BaseTemporalModel(object):
         if step % self.print_every_step == 0:
             time_elapsed = (time.perf_counter() - start_time)
             self.log_loss(ops_run_loop_results['loss'], step, epoch, time_elapsed, prefix=self.mode + ": ")
+            if 'peak_memory' in ops_run_loop_results:
+                # The device allocator statistics are 0 on CPU. The peak resident set size covers the CPU runs.
+                print(self.mode + ": peak memory = {:.1f} MB, peak rss = {:.1f} MB".format(ops_run_loop_results['peak_memory']/2**20, get_peak_rss()/2**20))
 
         return ops_run_loop_results
 
-    def evaluation_step(self, step, epoch, num_iterations, feed_dict=None):
+    def evaluation_step(self, step, epoch, num_iterations=None, feed_dict=None, iterator_initializer=None):
         """
-        Evaluation loop function. Evaluates the whole validation/test dataset and logs performance.
+        Evaluation loop function. Evaluates the whole validation/test dataset and logs performance. If the model is fed
+        by an `EvaluationDataFeederTF`, the loop runs until the iterator is exhausted. Losses are weighted by the number
+        of samples in a batch. Hence, the smaller final batch is handled exactly.
 
         Args:
             step: current step.
             epoch: current epoch.
-            num_iterations: number of steps.
+            num_iterations: number of steps. If None, runs until `tf.errors.OutOfRangeError` is raised.
             feed_dict (dict): feed dictionary.
+            iterator_initializer: initializer op of the evaluation data iterator, which is run before the loop.
 
         Returns: summary object.
         """
         self.reset_validation_loss()
         start_time = time.perf_counter()
-        for i in range(num_iterations):
-            ops_run_loop_results = self.session.run(self.ops_run_loop, feed_dict=feed_dict)
+        if iterator_initializer is not None:
+            self.session.run(iterator_initializer)
+
+        i = 0
+        while num_iterations is None or i < num_iterations:
+            try:
+                ops_run_loop_results = self.session.run(self.ops_run_loop, feed_dict=feed_dict)
+            except tf.errors.OutOfRangeError:
+                break
             self.update_validation_loss(ops_run_loop_results)
+            i += 1
 
         summary, total_loss = self.get_validation_summary()
 
@@ -1028,28 +1175,171 @@ class BaseTemporalModel(object):
 
         return summary, total_loss
 
-    def evaluation_step_test_time(self, coord, threads, step, epoch, num_iterations, feed_dict=None):
+    def evaluation_step_streaming(self, dataset, chunk_size, step=1, epoch=1):
         """
-        Makes sure that all samples are used.
+        Evaluates every sample of the dataset in chunks of `chunk_size` steps (see `evaluate_streaming`). Unlike
+        `evaluation_step`, the memory usage does not depend on the sequence length.
+
+        Args:
+            dataset (Dataset): evaluation dataset.
+            chunk_size (int): number of steps evaluated at once.
+            step: current step.
+            epoch: current epoch.
+
+        Returns: summary object.
         """
         self.reset_validation_loss()
         start_time = time.perf_counter()
-        for i in range(num_iterations-1):
-            ops_run_loop_results = self.session.run(self.ops_run_loop, feed_dict=feed_dict)
+        for seq_len, input_sample, target_sample, _ in dataset.sample_generator():
+            ops_run_loop_results = self.evaluate_streaming(np.expand_dims(input_sample, axis=0),
+                                                           np.expand_dims(target_sample, axis=0),
+                                                           np.reshape(seq_len, [1]),
+                                                           chunk_size)
             self.update_validation_loss(ops_run_loop_results)
-        try:
-            coord.request_stop()
-            coord.join(threads, stop_grace_period_secs=0.5)
-        except:
-            pass
-        ops_run_loop_results = self.session.run(self.ops_run_loop, feed_dict=feed_dict)
-        self.update_validation_loss(ops_run_loop_results)
 
         summary, total_loss = self.get_validation_summary()
         time_elapsed = (time.perf_counter() - start_time)
         self.log_loss(total_loss, step, epoch, time_elapsed, prefix=self.mode + ": ")
         return summary, total_loss
 
+    def build_log_importance_weights(self, log_latent_ratio):
+        """
+        Builds log importance weights of the latent samples by adding log-likelihood terms (see `ops_loss_per_step`) to
+        the log density ratio of the latent samples. Note that the likelihood terms are scaled by the loss weights.
+
+        Args:
+            log_latent_ratio: (batch_size, ) log p(z) - log q(z|x) summed over time-steps.
+        """
+        with tf.name_scope("log_importance_weight"):
+            log_likelihood = 0.0
+            for loss_name in self.loss_config:
+                log_likelihood -= tf.reduce_sum(self.ops_loss_per_step["loss_" + loss_name], axis=1)
+            self.ops_log_importance_weight = log_likelihood + log_latent_ratio
+
+    def evaluation_step_importance_weighted(self, dataset, num_samples, step=1, epoch=1):
+        """
+        Evaluates the importance-weighted bound (https://arxiv.org/abs/1509.00519) on every sample of the dataset with
+        `num_samples` latent samples:
+            log p(x) >= log(1/K sum_k p(x|z_k)p(z_k)/q(z_k|x)), z_k ~ q(z|x)
+        A session call draws `importance_samples_per_pass` samples at once. Hence, the memory usage is controlled by
+        `importance_samples_per_pass` rather than `num_samples`. The log weights are reduced by log-sum-exp.
+
+        Args:
+            dataset (Dataset): evaluation dataset.
+            num_samples (int): number of latent samples per sequence (K).
+            step: current step.
+            epoch: current epoch.
+
+        Returns:
+            (dict): negative importance-weighted bound (`total_loss`) and negative ELBO (`elbo`) reduced as the
+            training loss.
+        """
+        assert self.ops_log_importance_weight is not None, "The model must be a latent variable model built with importance_samples_per_pass."
+        num_passes = int(math.ceil(num_samples/self.importance_samples_per_pass))
+        run_ops = {'log_weight': self.ops_log_importance_weight, 'num_steps': tf.reduce_sum(self.seq_loss_mask, axis=[1, 2])}
+
+        iw_loss, elbo_loss, num_steps = [], [], []
+        start_time = time.perf_counter()
+        for seq_len, input_sample, target_sample, _ in dataset.sample_generator():
+            feed_dict = {self.placeholders[C.PL_INPUT]: np.expand_dims(input_sample, axis=0),
+                         self.placeholders[C.PL_TARGET]: np.expand_dims(target_sample, axis=0),
+                         self.placeholders[C.PL_SEQ_LEN]: np.reshape(seq_len, [1])}
+            log_weights = []
+            for _ in range(num_passes):
+                results = self.session.run(run_ops, feed_dict=feed_dict)
+                log_weights.append(results['log_weight'])
+            log_weights = np.concatenate(log_weights)[:num_samples]
+
+            max_log_weight = log_weights.max()
+            iw_loss.append(-(max_log_weight + np.log(np.exp(log_weights - max_log_weight).sum()) - np.log(num_samples)))
+            elbo_loss.append(-log_weights.mean())
+            num_steps.append(results['num_steps'][0])
+
+        eval_loss = {'total_loss': self.reduce_streaming_loss(np.array(iw_loss), np.array(num_steps)),
+                     'elbo': self.reduce_streaming_loss(np.array(elbo_loss), np.array(num_steps))}
+        time_elapsed = (time.perf_counter() - start_time)
+        self.log_loss(eval_loss, step, epoch, time_elapsed, prefix=self.mode + " (K=" + str(num_samples) + "): ")
+        return eval_loss
+
+    def streaming_context_size(self):
+        """
+        Number of past steps the model needs to make a prediction at the current step, excluding the state carried over
+        by recurrent models.
+        """
+        return 0
+
+    def evaluate_streaming(self, input_sequence, target_sequence, seq_len, chunk_size):
+        """
+        Evaluates a batch of sequences in chunks of `chunk_size` steps. Each chunk is preceded by
+        `streaming_context_size()` steps and the final state of the previous chunk is fed as the initial state of
+        recurrent models. Hence, the model sees the same history as in the full-sequence evaluation. Loss terms of
+        the new steps are accumulated and reduced at the end. Note that the latent samples of the variational models
+        are drawn per chunk. Hence, the losses of these models are identical to the full-sequence evaluation in
+        expectation only.
+
+        Args:
+            input_sequence (np.ndarray): (batch_size, seq_len, input_size)
+            target_sequence (np.ndarray): (batch_size, seq_len, target_size)
+            seq_len (np.ndarray): (batch_size, ) length of the sequences.
+            chunk_size (int): number of new steps per chunk.
+
+        Returns:
+            (dict): evaluated `ops_loss` terms and batch size in the same format with the `ops_run_loop` results.
+        """
+        assert chunk_size > 0, "Chunk size must be positive."
+        context_size = self.streaming_context_size()
+        batch_size, total_len = input_sequence.shape[0], input_sequence.shape[1]
+
+        run_ops = {'loss': self.ops_loss_per_step, 'mask': self.seq_loss_mask}
+        if self.streaming_state_ops is not None:
+            run_ops['state'] = self.streaming_state_ops[1]
+
+        loss_sums = {loss_key: np.zeros(batch_size) for loss_key in self.ops_loss_per_step}
+        num_steps = np.zeros(batch_size)
+        state = None
+        for start_idx in range(0, total_len, chunk_size):
+            end_idx = min(start_idx + chunk_size, total_len)
+            chunk_start_idx = max(0, start_idx - context_size)
+
+            feed_dict = {self.pl_inputs: input_sequence[:, chunk_start_idx:end_idx],
+                         self.pl_targets: target_sequence[:, chunk_start_idx:end_idx],
+                         self.pl_seq_length: np.clip(seq_len - chunk_start_idx, 0, end_idx - chunk_start_idx)}
+            if state is not None:
+                feed_dict[self.streaming_state_ops[0]] = state
+            results = self.session.run(run_ops, feed_dict=feed_dict)
+            state = results.get('state', None)
+
+            # Losses are aligned with the last steps of the chunk. Drop the context steps.
+            num_new_steps = min(end_idx - start_idx, results['mask'].shape[1])
+            if num_new_steps > 0:
+                for loss_key, loss_value in results['loss'].items():
+                    loss_sums[loss_key] += loss_value[:, -num_new_steps:].sum(axis=1)
+                num_steps += results['mask'][:, -num_new_steps:, 0].sum(axis=1)
+
+        eval_loss = dict()
+        for loss_key, loss_sum in loss_sums.items():
+            eval_loss[loss_key] = self.reduce_streaming_loss(loss_sum, num_steps)
+        eval_loss['total_loss'] = sum([loss for loss_key, loss in eval_loss.items() if loss_key.startswith("loss")])
+        return {'loss': eval_loss, 'batch_size': batch_size}
+
+    def reduce_streaming_loss(self, loss_sum, num_steps):
+        """
+        Numpy counterpart of the reduce function (see `get_reduce_loss_func`) for the losses accumulated over chunks.
+
+        Args:
+            loss_sum (np.ndarray): (batch_size, ) sequence loss.
+            num_steps (np.ndarray): (batch_size, ) number of steps.
+        """
+        reduce_loss = self.config.get('reduce_loss')
+        if reduce_loss == C.R_MEAN_SEQUENCE:
+            return loss_sum.mean()
+        elif reduce_loss == C.R_MEAN_STEP:
+            return (loss_sum/num_steps).mean()
+        elif reduce_loss == C.R_SUM:
+            return loss_sum.sum()
+        else:
+            raise Exception(str(reduce_loss) + " is not supported in streaming evaluation.")
+
     def log_loss(self, eval_loss, step=0, epoch=0, time_elapsed=None, prefix=""):
         """
         Prints status messages during training. It is called in the main training loop.
@@ -1167,14 +1457,23 @@ class TCN(BaseTemporalModel):
     Causal convolutional network from `Wavenet: A Generative Model for Raw Audio` (https://arxiv.org/abs/1609.03499)
     paper.
     """
+    # If True, dilated convolutions are computed as ordinary convolutions on `dilation` interleaved sub-sequences (see
+    # `time_to_batch`). It is set by the `space_to_batch_conv` config and applies to all causal convolutions of the
+    # graph, including latent and output layers.
+    space_to_batch = False
+
     def __init__(self, config, session, reuse, mode, placeholders, input_dims, target_dims, **kwargs):
         super(TCN, self).__init__(config, session, reuse, mode, placeholders, input_dims, target_dims, **kwargs)
+        TCN.space_to_batch = config.get('space_to_batch_conv', False)
 
         self.input_layer_config = config.get('input_layer', None)
         self.cnn_layer_config = config.get('cnn_layer')
         self.use_gate = self.cnn_layer_config.get('use_gating', False)
         self.use_residual = self.cnn_layer_config.get('use_residual', False)
         self.use_skip = self.cnn_layer_config.get('use_skip', False)
+        # If True, filter and gate convolutions of gated blocks are computed by a single convolution. See
+        # `causal_gated_layer_fused`.
+        self.fused_gate = self.cnn_layer_config.get('fused_gate', False)
         # Concatenates representations of these layers for the outputs.
         self.tcn_output_layer_idx = self.cnn_layer_config.get('tcn_output_layer_idx', [-1])
         # If True, at every layer the input sequence is padded with zeros at the beginning such that the output length
@@ -1198,7 +1497,7 @@ class TCN(BaseTemporalModel):
 
     @staticmethod
     def receptive_field_size(filter_size, dilation_size_list):
-        return (filter_size - 1)*sum(dilation_size_list) + 1
+        return receptive_field_size(filter_size, dilation_size_list)
 
     @staticmethod
     def causal_conv_layer(input_layer, num_filters, kernel_size, dilation, zero_padding, activation_fn):
@@ -1212,15 +1511,38 @@ class TCN(BaseTemporalModel):
                 input_shape[1] += padding_steps
             padded_input_layer.set_shape(input_shape)
 
-        conv_layer = tf.layers.conv1d(inputs=padded_input_layer,
-                                      filters=num_filters,
-                                      kernel_size=kernel_size,
-                                      strides=1,
-                                      padding='valid',
-                                      dilation_rate=dilation,
-                                      activation=activation_fn)
+        if TCN.space_to_batch and dilation > 1 and kernel_size > 1:
+            output_width = tf.shape(padded_input_layer)[1] - padding_steps
+            conv_layer = tf.layers.conv1d(inputs=time_to_batch(padded_input_layer, dilation),
+                                          filters=num_filters,
+                                          kernel_size=kernel_size,
+                                          strides=1,
+                                          padding='valid',
+                                          dilation_rate=1,
+                                          activation=activation_fn)
+            conv_layer = batch_to_time(conv_layer, dilation, output_width)
+            TCN.set_conv_output_shape(conv_layer, padded_input_layer, num_filters, padding_steps)
+        else:
+            conv_layer = tf.layers.conv1d(inputs=padded_input_layer,
+                                          filters=num_filters,
+                                          kernel_size=kernel_size,
+                                          strides=1,
+                                          padding='valid',
+                                          dilation_rate=dilation,
+                                          activation=activation_fn)
         return conv_layer
 
+    @staticmethod
+    def set_conv_output_shape(conv_layer, padded_input_layer, num_filters, padding_steps):
+        """
+        Sets the static shape of a `valid` convolution output computed via `time_to_batch`.
+        """
+        output_shape = padded_input_layer.shape.as_list()
+        if output_shape[1] is not None:
+            output_shape[1] -= padding_steps
+        output_shape[2] = num_filters
+        conv_layer.set_shape(output_shape)
+
     @staticmethod
     def causal_gated_layer(input_layer, kernel_size, num_filters, dilation, zero_padding):
         with tf.name_scope('filter_conv'):
@@ -1243,14 +1565,52 @@ class TCN(BaseTemporalModel):
         return gated_dilation
 
     @staticmethod
-    def temporal_block(input_layer, num_filters, kernel_size, dilation, activation_fn, use_gate=True, use_residual=True, zero_padding=False):
+    def causal_gated_layer_fused(input_layer, kernel_size, num_filters, dilation, zero_padding):
+        """
+        Same as `causal_gated_layer`, but the input is padded once and a single convolution with 2*num_filters filters
+        computes the filter and gate pre-activations.
+
+        Variables are created with the same names and shapes as `causal_gated_layer` creates via `tf.layers.conv1d`
+        (i.e., `conv1d/kernel`, `conv1d/bias` for the filter and `conv1d_1/kernel`, `conv1d_1/bias` for the gate) and
+        concatenated in the graph. Hence, checkpoints of both implementations are interchangeable.
+        """
+        padded_input_layer = input_layer
+        padding_steps = (kernel_size - 1)*dilation
+        if zero_padding and padding_steps > 0:
+            padded_input_layer = tf.pad(input_layer, [(0, 0,), (padding_steps, 0), (0, 0)], mode='CONSTANT')
+
+        num_input_filters = input_layer.shape.as_list()[-1]
+        kernels, biases = [], []
+        for _ in range(2):  # Filter and gate variables, in this order.
+            with tf.variable_scope(None, default_name='conv1d'):
+                kernels.append(tf.get_variable('kernel', [kernel_size, num_input_filters, num_filters], dtype=tf.float32))
+                biases.append(tf.get_variable('bias', [num_filters], dtype=tf.float32, initializer=tf.zeros_initializer()))
+
+        with tf.name_scope('fused_conv'):
+            if TCN.space_to_batch and dilation > 1 and kernel_size > 1:
+                output_width = tf.shape(padded_input_layer)[1] - padding_steps
+                conv_layer = tf.nn.convolution(time_to_batch(padded_input_layer, dilation), tf.concat(kernels, axis=-1), padding='VALID')
+                conv_layer = batch_to_time(conv_layer, dilation, output_width)
+                TCN.set_conv_output_shape(conv_layer, padded_input_layer, 2*num_filters, padding_steps)
+            else:
+                conv_layer = tf.nn.convolution(padded_input_layer, tf.concat(kernels, axis=-1), padding='VALID', dilation_rate=[dilation])
+            conv_layer = tf.nn.bias_add(conv_layer, tf.concat(biases, axis=-1))
+        with tf.name_scope('gating'):
+            filter_op, gate_op = tf.split(conv_layer, 2, axis=-1)
+            gated_dilation = tf.nn.sigmoid(gate_op)*tf.nn.tanh(filter_op)
+
+        return gated_dilation
+
+    @staticmethod
+    def temporal_block(input_layer, num_filters, kernel_size, dilation, activation_fn, use_gate=True, use_residual=True, zero_padding=False, fused_gate=False):
         if use_gate:
             with tf.name_scope('gated_causal_layer'):
-                temp_out = TCN.causal_gated_layer(input_layer=input_layer,
-                                                  kernel_size=kernel_size,
-                                                  num_filters=num_filters,
-                                                  dilation=dilation,
-                                                  zero_padding=zero_padding)
+                gated_layer_fn = TCN.causal_gated_layer_fused if fused_gate else TCN.causal_gated_layer
+                temp_out = gated_layer_fn(input_layer=input_layer,
+                                          kernel_size=kernel_size,
+                                          num_filters=num_filters,
+                                          dilation=dilation,
+                                          zero_padding=zero_padding)
         else:
             with tf.name_scope('causal_layer'):
                 temp_out = TCN.causal_conv_layer(input_layer=input_layer,
@@ -1319,7 +1679,9 @@ class TCN(BaseTemporalModel):
                                                   zero_padding=self.zero_padding,
                                                   activation_fn=None)
         # Stack causal convolutional layers.
-        out_layers, skip_layers = self.build_temporal_block(current_layer, self.cnn_layer_config['num_layers'], self.reuse, self.cnn_layer_config['filter_size'])
+        output_idx = [-1] if self.use_skip else self.tcn_output_layer_idx
+        skip_idx = None if self.use_skip else []
+        out_layers, skip_layers = self.build_temporal_block(current_layer, self.cnn_layer_config['num_layers'], self.reuse, self.cnn_layer_config['filter_size'], output_idx=output_idx, skip_idx=skip_idx)
 
         if self.use_skip:
             # Sum skip connections from the outputs of each layer.
@@ -1346,25 +1708,71 @@ class TCN(BaseTemporalModel):
                                                            seed=self.config.seed,
                                                            training=self.is_training)
 
-    def build_temporal_block(self, input_layer, num_layers, reuse, kernel_size=2):
+    def build_temporal_block(self, input_layer, num_layers, reuse, kernel_size=2, output_idx=None, skip_idx=None):
         """
         Stacks a number of causal convolutional layers.
-        """
+
+        If `recompute_segment_size` (k) is set in `cnn_layer` config, every k consecutive blocks of the training graph
+        form a segment whose activations are recomputed during the backward pass instead of being stored. Only the
+        output of the last block in a segment and the outputs requested by `output_idx` and `skip_idx` are kept in
+        memory. The remaining entries of the returned lists are None.
+
+        Args:
+            input_layer: input tensor.
+            num_layers (int): number of temporal blocks.
+            reuse (bool): whether to reuse variables.
+            kernel_size (int): filter width.
+            output_idx (list): indices of the blocks whose outputs are used later. If None, all are kept.
+            skip_idx (list): indices of the blocks whose outputs without residual connection are used later. If None,
+                all are kept.
+
+        Returns:
+            (list, list): outputs of temporal blocks with and without residual connections.
+        """
+        def build_blocks(block_input, block_indices):
+            block_outputs = []
+            for idx in block_indices:
+                with tf.variable_scope('temporal_block_' + str(idx + 1), reuse=reuse):
+                    temp_block, temp_wo_res = TCN.temporal_block(input_layer=block_input,
+                                                                 num_filters=self.cnn_layer_config['num_filters'],
+                                                                 kernel_size=kernel_size,
+                                                                 dilation=self.cnn_layer_config['dilation_size'][idx],
+                                                                 activation_fn=self.activation_fn, use_gate=self.use_gate,
+                                                                 use_residual=self.use_residual,
+                                                                 zero_padding=self.zero_padding,
+                                                                 fused_gate=self.fused_gate)
+                block_outputs.append((temp_block, temp_wo_res))
+                block_input = temp_block
+            return block_outputs
+
+        segment_size = self.cnn_layer_config.get('recompute_segment_size', 0)
+        if segment_size < 1 or not self.is_training:
+            block_outputs = build_blocks(input_layer, range(num_layers))
+            return [block[0] for block in block_outputs], [block[1] for block in block_outputs]
+
+        output_idx = list(range(num_layers)) if output_idx is None else [idx % num_layers for idx in output_idx]
+        skip_idx = list(range(num_layers)) if skip_idx is None else [idx % num_layers for idx in skip_idx]
+        temporal_blocks = [None]*num_layers
+        temporal_blocks_no_res = [None]*num_layers
         current_layer = input_layer
-        temporal_blocks = []
-        temporal_blocks_no_res = []
-        for idx in range(num_layers):
-            with tf.variable_scope('temporal_block_' + str(idx + 1), reuse=reuse):
-                temp_block, temp_wo_res = TCN.temporal_block(input_layer=current_layer,
-                                                             num_filters=self.cnn_layer_config['num_filters'],
-                                                             kernel_size=kernel_size,
-                                                             dilation=self.cnn_layer_config['dilation_size'][idx],
-                                                             activation_fn=self.activation_fn, use_gate=self.use_gate,
-                                                             use_residual=self.use_residual,
-                                                             zero_padding=self.zero_padding)
-                temporal_blocks_no_res.append(temp_wo_res)
-                temporal_blocks.append(temp_block)
-                current_layer = temp_block
+        for segment_start in range(0, num_layers, segment_size):
+            segment = list(range(segment_start, min(segment_start + segment_size, num_layers)))
+            kept_outputs = [idx for idx in segment if idx in output_idx or idx == segment[-1]]
+            kept_skips = [idx for idx in segment if idx in skip_idx]
+
+            def segment_fn(segment_input, segment=segment, kept_outputs=kept_outputs, kept_skips=kept_skips):
+                # Functions with custom gradients only support resource variables. Otherwise the segment variables
+                # don't get gradients.
+                with tf.variable_scope(tf.get_variable_scope(), use_resource=True, auxiliary_name_scope=False):
+                    segment_outputs = dict(zip(segment, build_blocks(segment_input, segment)))
+                return tuple([segment_outputs[idx][0] for idx in kept_outputs] + [segment_outputs[idx][1] for idx in kept_skips])
+
+            segment_outputs = tf.contrib.layers.recompute_grad(segment_fn)(current_layer)
+            for idx, output in zip(kept_outputs, segment_outputs[:len(kept_outputs)]):
+                temporal_blocks[idx] = output
+            for idx, output in zip(kept_skips, segment_outputs[len(kept_outputs):]):
+                temporal_blocks_no_res[idx] = output
+            current_layer = temporal_blocks[segment[-1]]
 
         return temporal_blocks, temporal_blocks_no_res
 
@@ -1452,6 +1860,15 @@ class TCN(BaseTemporalModel):
 
         return model_outputs
 
+    def streaming_context_size(self):
+        # Initial causal convolution layer and the temporal blocks.
+        return (self.cnn_layer_config['filter_size'] - 1)*(sum(self.cnn_layer_config['dilation_size']) + 1)
+
+    def evaluate_streaming(self, input_sequence, target_sequence, seq_len, chunk_size):
+        if self.zero_padding is False:
+            assert chunk_size >= self.receptive_field_width, "Chunk size should be at least " + str(self.receptive_field_width) + " steps."
+        return super(TCN, self).evaluate_streaming(input_sequence, target_sequence, seq_len, chunk_size)
+
     def sample(self, **kwargs):
         """
         Sampling function.
@@ -1515,7 +1932,8 @@ class StochasticTCN(TCN):
 
         # Add latent layer related fields.
         self.latent_layer_config = self.config.get("latent_layer")
-        self.latent_layer = LatentLayer.get(self.latent_layer_config["type"], self.latent_layer_config, mode, reuse, global_step=self.global_step)
+        self.latent_layer = LatentLayer.get(self.latent_layer_config["type"], self.latent_layer_config, mode, reuse,
+                                            global_step=self.global_step, importance_weighted=self.importance_samples_per_pass > 0)
 
         # List of temporal convolution layers that are used in encoder.
         self.encoder_blocks = []
@@ -1540,13 +1958,22 @@ class StochasticTCN(TCN):
             with tf.variable_scope('input_dropout', reuse=self.reuse):
                 self.inputs_hidden = tf.layers.dropout(shifted_inputs, rate=self.input_layer_config.get("dropout_rate"), seed=self.config.seed, training=self.is_training)
 
+        # Encoder outputs used by the latent and decoder layers. Only relevant if activations are recomputed.
+        encoder_output_idx = None
+        if self.latent_layer_config["type"] == C.LATENT_LADDER_GAUSSIAN:
+            vertical_dilation = self.latent_layer_config.get('vertical_dilation', 1)
+            encoder_output_idx = [0, -1] + list(range(vertical_dilation - 1, self.num_encoder_blocks, vertical_dilation))
+        encoder_skip_idx = None if self.decoder_use_enc_skip else []
+        if self.config.get('tensorboard_verbose', 0) > 1:
+            encoder_output_idx = None
+
         with tf.variable_scope("encoder", reuse=self.reuse):
-            self.encoder_blocks, self.encoder_blocks_no_res = self.build_temporal_block(self.inputs_hidden, self.num_encoder_blocks, self.reuse, self.cnn_layer_config['filter_size'])
+            self.encoder_blocks, self.encoder_blocks_no_res = self.build_temporal_block(self.inputs_hidden, self.num_encoder_blocks, self.reuse, self.cnn_layer_config['filter_size'], output_idx=encoder_output_idx, skip_idx=encoder_skip_idx)
 
         with tf.variable_scope("latent", reuse=self.reuse):
-            p_input = [enc_layer[:, 0:-1] for enc_layer in self.encoder_blocks]
+            p_input = [enc_layer[:, 0:-1] if enc_layer is not None else None for enc_layer in self.encoder_blocks]
             if self.latent_layer_config.get('dynamic_prior', False):
-                q_input = [enc_layer[:, 1:] for enc_layer in self.encoder_blocks]
+                q_input = [enc_layer[:, 1:] if enc_layer is not None else None for enc_layer in self.encoder_blocks]
             else:
                 q_input = p_input
             latent_sample = self.latent_layer.build_latent_layer(q_input=q_input,
@@ -1570,10 +1997,13 @@ class StochasticTCN(TCN):
             with tf.variable_scope("decoder", reuse=self.reuse):
                 decoder_input_layer = tf.concat(decoder_inputs, axis=-1)
                 decoder_filter_size = self.cnn_layer_config.get("decoder_filter_size", self.cnn_layer_config['filter_size'])
+                decoder_output_idx = None if self.config.get('tensorboard_verbose', 0) > 1 else [-1]
                 self.decoder_blocks, self.decoder_blocks_no_res = self.build_temporal_block(decoder_input_layer,
                                                                                             self.num_decoder_blocks,
                                                                                             self.reuse,
-                                                                                            kernel_size=decoder_filter_size)
+                                                                                            kernel_size=decoder_filter_size,
+                                                                                            output_idx=decoder_output_idx,
+                                                                                            skip_idx=[])
                 self.temporal_block_outputs = self.decoder_blocks[-1]
         else:
             self.temporal_block_outputs = tf.concat(decoder_inputs, axis=-1)
@@ -1581,25 +2011,6 @@ class StochasticTCN(TCN):
         self.output_width = tf.shape(latent_sample)[1]
         self.build_output_layer()
 
-    def build_temporal_block(self, input_layer, num_layers, reuse, kernel_size=2):
-        current_layer = input_layer
-        temporal_blocks = []
-        temporal_blocks_no_res = []
-        for idx in range(num_layers):
-            with tf.variable_scope('temporal_block_' + str(idx + 1), reuse=reuse):
-                temp_block, temp_wo_res = TCN.temporal_block(input_layer=current_layer,
-                                                             num_filters=self.cnn_layer_config['num_filters'],
-                                                             kernel_size=kernel_size,
-                                                             dilation=self.cnn_layer_config['dilation_size'][idx],
-                                                             activation_fn=self.activation_fn, use_gate=self.use_gate,
-                                                             use_residual=self.use_residual,
-                                                             zero_padding=self.zero_padding)
-                temporal_blocks_no_res.append(temp_wo_res)
-                temporal_blocks.append(temp_block)
-                current_layer = temp_block
-
-        return temporal_blocks, temporal_blocks_no_res
-
     def build_output_layer(self):
         """
         Builds layers to make predictions.
@@ -1626,7 +2037,8 @@ class StochasticTCN(TCN):
                                                               kernel_size=kernel_size, dilation=1,
                                                               activation_fn=self.activation_fn,
                                                               use_gate=self.use_gate,
-                                                              use_residual=self.use_residual, zero_padding=True)
+                                                              use_residual=self.use_residual, zero_padding=True,
+                                                              fused_gate=self.fused_gate)
             for idx in range(len(self.output_layer_config['out_keys'])):
                 key = self.output_layer_config['out_keys'][idx]
                 with tf.variable_scope('out_' + key, reuse=self.reuse):
@@ -1660,10 +2072,13 @@ class StochasticTCN(TCN):
 
         # Get latent layer loss terms, apply mask and reduce function, and insert into our loss container.
         if self.is_eval:
-            self.latent_layer.build_loss(self.seq_loss_mask, self.reduce_loss_fn, self.ops_loss, reward=self.likelihood, eval_dict=self.ops_for_eval_mode)
+            self.latent_layer.build_loss(self.seq_loss_mask, self.reduce_loss_fn, self.ops_loss, reward=self.likelihood, eval_dict=self.ops_for_eval_mode, step_loss_dict=self.ops_loss_per_step)
             self.ops_evaluation["eval_dict"] = self.ops_for_eval_mode
         else:
-            self.latent_layer.build_loss(self.seq_loss_mask, self.reduce_loss_fn, self.ops_loss, reward=self.likelihood)
+            self.latent_layer.build_loss(self.seq_loss_mask, self.reduce_loss_fn, self.ops_loss, reward=self.likelihood, step_loss_dict=self.ops_loss_per_step)
+
+        if self.importance_samples_per_pass > 0:
+            self.build_log_importance_weights(self.latent_layer.build_log_importance_ratio(self.seq_loss_mask))
 
     def build_summary_plots(self):
         super(StochasticTCN, self).build_summary_plots()
@@ -1678,6 +2093,30 @@ class StochasticTCN(TCN):
                 plot_key = "decoder_block_" + str(idx + 1)
                 tf.summary.histogram(plot_key, decoder_block, collections=[self.mode + '_summary_plot', self.mode + '_temporal_block_activations'])
 
+    def streaming_context_size(self):
+        """
+        Sum of the receptive fields of the encoder (+1 due to the shifted prior inputs), latent, decoder and output
+        layers.
+        """
+        dilation_size = self.cnn_layer_config['dilation_size']
+        context_size = (self.cnn_layer_config['filter_size'] - 1)*sum(dilation_size[:self.num_encoder_blocks]) + 1
+
+        if self.latent_layer_config.get('layer_structure', None) == C.LAYER_TCN:
+            # Every p and q network of the hierarchy depends on the preceding latent sample.
+            latent_width = (self.latent_layer_config.get('kernel_size', 1) - 1)*self.latent_layer_config.get('dilation', 1)
+            num_latent_blocks = self.latent_layer_config.get('num_hidden_layers', 0) + 1
+            num_latent_layers = max(1, self.num_encoder_blocks//self.latent_layer_config.get('vertical_dilation', 1))
+            context_size += 2*num_latent_layers*num_latent_blocks*latent_width
+
+        if self.num_decoder_blocks > 0:
+            decoder_filter_size = self.cnn_layer_config.get("decoder_filter_size", self.cnn_layer_config['filter_size'])
+            context_size += (decoder_filter_size - 1)*sum(dilation_size[:self.num_decoder_blocks])
+
+        if (self.output_layer_config.get('type', None) or C.LAYER_TCN) == C.LAYER_TCN:
+            kernel_size = self.cnn_layer_config['filter_size'] if self.output_layer_config.get('filter_size', 0) < 1 else self.output_layer_config.get('filter_size', 0)
+            context_size += (kernel_size - 1)*self.output_layer_config.get('num_layers', 1)
+        return context_size
+
     def sample_function(self, model_input, sample_length):
         """
         Update: From now on we assume that the causal relationship between the inputs and targets are handled by dataset.
@@ -1757,7 +2196,10 @@ class BaseRNN(BaseTemporalModel):
         """
         Builds a Tensorflow RNN cell object by using the given configuration `self.cell_config`.
         """
-        self.cell = get_rnn_cell(scope='rnn_cell', reuse=self.reuse, **self.cell_config)
+        if self.cell_config['cell_type'] == C.FUSED_LSTM:
+            self.cell = FusedRNNLayer(is_training=self.is_training, **self.cell_config)
+        else:
+            self.cell = get_rnn_cell(scope='rnn_cell', reuse=self.reuse, **self.cell_config)
         self.initial_states = self.cell.zero_state(batch_size=self.batch_size, dtype=tf.float32)
 
     def build_input_layer(self):
@@ -1787,13 +2229,19 @@ class BaseRNN(BaseTemporalModel):
         Builds RNN layer by using dynamic_rnn wrapper of Tensorflow.
         """
         with tf.variable_scope("rnn_layer", reuse=self.reuse):
-            self.rnn_outputs, self.rnn_output_state = tf.nn.dynamic_rnn(self.cell,
-                                                                        self.inputs_hidden,
-                                                                        sequence_length=self.pl_seq_length,
-                                                                        initial_state=self.initial_states,
-                                                                        dtype=tf.float32)
+            if isinstance(self.cell, FusedRNNLayer):
+                self.rnn_outputs, self.rnn_output_state = self.cell(self.inputs_hidden,
+                                                                    sequence_length=self.pl_seq_length,
+                                                                    initial_state=self.initial_states)
+            else:
+                self.rnn_outputs, self.rnn_output_state = tf.nn.dynamic_rnn(self.cell,
+                                                                            self.inputs_hidden,
+                                                                            sequence_length=self.pl_seq_length,
+                                                                            initial_state=self.initial_states,
+                                                                            dtype=tf.float32)
             self.output_layer_inputs = self.rnn_outputs
             self.ops_evaluation['state'] = self.rnn_output_state
+            self.streaming_state_ops = (self.initial_states, self.rnn_output_state)
 
     def build_output_layer(self):
         """
@@ -1958,9 +2406,23 @@ class VRNN(BaseRNN):
         assert isinstance(self.cell, VRNNCell), "Cell object must be an instance of VRNNCell for VRNN model."
         self.initial_states = self.cell.zero_state(batch_size=self.batch_size, dtype=tf.float32)
 
+    def build_input_layer(self):
+        """
+        Applies the state independent phi(x) layer of the cell on all time-steps at once if the cell supports it. The
+        layer is created in the cell's variable scope so that the parameters are the same as when it is applied in the
+        recurrence.
+        """
+        super(VRNN, self).build_input_layer()
+
+        if self.cell.precompute_input_layer:
+            x = tf.split(self.inputs_hidden, self.input_dims, axis=2)[0]
+            with tf.variable_scope('rnn_layer/rnn/' + type(self.cell).__name__, reuse=self.reuse):
+                flat_phi_x = self.cell.phi(self.flat_tensor(x), scope='phi_x_input')
+            self.inputs_hidden = self.temporal_tensor(flat_phi_x)
+
     def build_output_layer(self):
         # These are the predefined vrnn cell outputs.
-        vrnn_model_out_keys = [C.Q_MU, C.Q_SIGMA, C.P_MU, C.P_SIGMA]
+        vrnn_model_out_keys = [C.Q_MU, C.Q_SIGMA, C.P_MU, C.P_SIGMA, C.Z_LATENT]
         vrnn_model_out_keys.extend(self.output_layer_config['out_keys'])
 
         # Assign model outputs.
@@ -1999,11 +2461,18 @@ class VRNN(BaseRNN):
         if loss_key not in self.ops_loss:
             with tf.name_scope('kld_loss'):
                 # KL-Divergence.
-                self.ops_loss['loss_kld'] = self.kld_weight*self.reduce_loss_fn(
-                    self.seq_loss_mask*tf_loss.kld_normal_isotropic(self.ops_model_output[C.Q_MU],
-                                                                    self.ops_model_output[C.Q_SIGMA],
-                                                                    self.ops_model_output[C.P_MU],
-                                                                    self.ops_model_output[C.P_SIGMA], reduce_sum=False))
+                seq_kld_loss = self.seq_loss_mask*tf_loss.kld_normal_isotropic(self.ops_model_output[C.Q_MU],
+                                                                               self.ops_model_output[C.Q_SIGMA],
+                                                                               self.ops_model_output[C.P_MU],
+                                                                               self.ops_model_output[C.P_SIGMA], reduce_sum=False)
+                self.ops_loss['loss_kld'] = self.kld_weight*self.reduce_loss_fn(seq_kld_loss)
+                self.ops_loss_per_step['loss_kld'] = self.kld_weight*tf.reduce_sum(seq_kld_loss, axis=2)
+
+        if self.importance_samples_per_pass > 0:
+            self.build_log_importance_weights(LatentLayer.log_density_ratio(self.ops_model_output[C.Z_LATENT],
+                                                                            (self.ops_model_output[C.Q_MU], self.ops_model_output[C.Q_SIGMA]),
+                                                                            (self.ops_model_output[C.P_MU], self.ops_model_output[C.P_SIGMA]),
+                                                                            self.seq_loss_mask))
 
     def build_summary_plots(self):
         """
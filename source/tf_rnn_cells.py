@@ -61,8 +61,8 @@ class VRNNCell(tf.contrib.rnn.RNNCell):
 
         self.output_config = config['output_layer']
 
-        self.output_size_ = [self.z_dim]*4
-        self.output_size_.extend(self.output_config['out_dims']) # q_mu, q_sigma, p_mu, p_sigma + model outputs
+        self.output_size_ = [self.z_dim]*5
+        self.output_size_.extend(self.output_config['out_dims']) # q_mu, q_sigma, p_mu, p_sigma, z + model outputs
 
         self.state_size_ = []
         # Optional. Linear layers will be used if not passed.
@@ -81,6 +81,11 @@ class VRNNCell(tf.contrib.rnn.RNNCell):
 
             self.state_size_.append(self.input_rnn_cell.state_size)
 
+        # phi(x) does not depend on the state. It is applied on the whole input sequence before the recurrence and
+        # the cell receives the projected inputs. In sampling mode the inputs are generated by the cell, input_rnn is
+        # recurrent and batch normalization statistics would be calculated over all steps instead.
+        self.precompute_input_layer = config.get('precompute_input_layer', True) and not (self.is_sampling or self.input_rnn or self.use_batch_norm)
+
         self.latent_rnn_config = config['latent_rnn']
         self.latent_rnn_cell_type = config['latent_rnn']['cell_type']
         self.latent_rnn_cell = get_rnn_cell(scope='latent_rnn', **config['latent_rnn'])
@@ -256,6 +261,10 @@ class VRNNCell(tf.contrib.rnn.RNNCell):
         Returns:
 
         """
+        if self.precompute_input_layer:
+            self.x = input_  # Already projected by phi(x).
+            return
+
         with tf.variable_scope("input"):
             input_components = tf.split(input_, self.input_dims, axis=1)
             self.x = input_components[0]
@@ -263,6 +272,8 @@ class VRNNCell(tf.contrib.rnn.RNNCell):
     def input_layer_hidden(self):
         if self.input_rnn is True:
             self.phi_x_input, self.input_rnn_state = self.input_rnn_cell(self.x, self.input_rnn_state, scope='phi_x_input')
+        elif self.precompute_input_layer:
+            self.phi_x_input = self.x
         else:
             self.phi_x_input = self.phi(self.x, scope='phi_x_input')
 
@@ -277,15 +288,15 @@ class VRNNCell(tf.contrib.rnn.RNNCell):
         else:
             self.q_mu, self.q_sigma = self.latent(input_latent_q, scope="latent_z_q")
 
-        q_z = self.reparametrization(self.q_mu, self.q_sigma, scope="z_q")
-        self.phi_z_q = self.phi(q_z, scope="phi_z", reuse=True)
+        self.z_q = self.reparametrization(self.q_mu, self.q_sigma, scope="z_q")
+        self.phi_z_q = self.phi(self.z_q, scope="phi_z", reuse=True)
 
     def latent_p_layer(self):
         input_latent_p = tf.concat((self.latent_h), axis=1)
         self.p_mu, self.p_sigma = self.latent(input_latent_p, scope="latent_z_p")
 
-        p_z = self.reparametrization(self.p_mu, self.p_sigma, scope="z_p")
-        self.phi_z_p = self.phi(p_z, scope="phi_z")
+        self.z_p = self.reparametrization(self.p_mu, self.p_sigma, scope="z_p")
+        self.phi_z_p = self.phi(self.z_p, scope="phi_z")
 
     def output_layer_hidden(self):
         if self.use_latent_h_in_outputs is True:
@@ -319,7 +330,9 @@ class VRNNCell(tf.contrib.rnn.RNNCell):
                 self.build_training_graph(input_, state)
 
             # Prepare cell output.
-            vrnn_cell_output = [self.q_mu, self.q_sigma, self.p_mu, self.p_sigma]
+            # The latent sample fed to the output and latent rnn layers.
+            z = self.z_p if self.is_sampling else self.z_q
+            vrnn_cell_output = [self.q_mu, self.q_sigma, self.p_mu, self.p_sigma, z]
             for key in self.output_config['out_keys']:
                 vrnn_cell_output.append(self.output_components[key])
 
@@ -2,9 +2,11 @@ import tensorflow as tf
 from tensorflow.python.ops import math_ops
 from tensorflow.python.framework import dtypes
 import os
+import time
 import numpy as np
-from tf_data_feeder import DataFeederTF, TFStagingArea
-from utils import get_model_dir_timestamp, create_tf_timeline, get_seq_len_histogram
+from constants import Constants as C
+from tf_data_feeder import DataFeederTF, EvaluationDataFeederTF, TFStagingArea
+from utils import get_model_dir_timestamp, create_tf_timeline, get_seq_len_histogram, get_session_config
 
 """
 A training script that can be used for basic tasks.
@@ -12,14 +14,28 @@ A training script that can be used for basic tasks.
 - Loads model and dataset classes given by config.
 - Creates dataset and data feeder objects for training.
 - Creates training model.
-- If validation data is provided, creates validation data & data feeder and validation model. Note that validation model
-uses a different computational graph but shares its weights with the training model.
+- If validation data is provided, creates validation data & evaluation data feeder and validation model. Note that
+validation model uses a different computational graph but shares its weights with the training model.
 - Standard tensorflow routines (i.e., session creation, gradient checks, optimization, summaries, etc.).
 - Main training loop:
     * Graph ops and summary ops to be evaluated are defined by the model class.
-    * Model is evaluated on the full validation data every time. Because of tensorflow input queues, we use an
-    unconventional routine. We need to iterate `num_validation_iterations` (# validation samples/batch size) times. Model
-    keeps track of losses and report via `get_validation_summary` method.
+    * Model is evaluated on the full validation data every time. The `EvaluationDataFeederTF` iterator is initialized
+    before every evaluation and yields every sample exactly once in a fixed order, including the smaller final batch.
+    Model keeps track of losses weighted by the batch sizes and report via `get_validation_summary` method.
+- Distributed training (between-graph replication): if `task_type` is set, the process joins a cluster as a parameter
+server ("ps") or as a worker. Variables are placed on the parameter servers while every worker builds its own copy of
+the graph and input pipeline. Worker 0 is the chief: it initializes/restores the variables, runs validation and writes
+checkpoints and summaries. Every worker feeds its own shard of the training data. The chief restores the checkpoint
+before initializing the remaining variables, so the other workers don't start with random weights. Validation, test and
+checkpoints are triggered when the global step passes a multiple of the interval, since asynchronous workers don't
+observe every step. The training ends when the global step reaches the number of updates of `num_epochs` epochs, i.e.,
+it doesn't depend on the number of steps a worker runs. The chief stops the other workers through a shared flag when it
+stops early. Updates are asynchronous by default and synchronous if `sync_replicas` is set. With synchronous updates,
+the chief pushes a token per worker before leaving, so that workers blocked in the optimizer can observe the end. An example for two workers and one parameter server
+on a single machine (one process per line):
+    python run_training.py <args> --task_type ps --task_index 0 --ps_hosts localhost:2222 --worker_hosts localhost:2223,localhost:2224
+    python run_training.py <args> --task_type worker --task_index 0 --ps_hosts localhost:2222 --worker_hosts localhost:2223,localhost:2224
+    python run_training.py <args> --task_type worker --task_index 1 --ps_hosts localhost:2222 --worker_hosts localhost:2223,localhost:2224
 """
 
 
@@ -30,23 +46,47 @@ class TrainingEngine():
         self.tensorboard_verbosity = config.get('tensorboard_verbose')  # Define detail level of tensorboard plots.
 
         # Training loop setup.
-        self.training_num_epochs = config.get('num_epochs') + 1
         self.training_evaluate_every_step = config.get('evaluate_every_step')
         self.training_create_timeline = config.get('create_timeline', False)
         self.early_stopping_save = early_stopping_tolerance > 0
         self.early_stopping_tolerance = early_stopping_tolerance
         self.training_checkpoint_every_step = config.get('checkpoint_every_step') if not self.early_stopping_save else self.training_evaluate_every_step
+        # Gradients of `grad_accumulation_steps` micro-batches are accumulated before a parameter update. The effective
+        # batch size is `batch_size*grad_accumulation_steps`.
+        self.grad_accumulation_steps = config.get('grad_accumulation_steps', 1)
 
         # Data preprocessing configuration.
         self.preprocessing_ops = config.get_preprocessing_ops()
 
+        # Distributed training setup.
+        self.task_type = config.get('task_type', None)
+        self.task_index = config.get('task_index', 0) or 0
+        self.sync_replicas = config.get('sync_replicas', False)
+        self.is_chief = True
+        self.num_workers = 1
+        self.server = None
+        self.device_setter = None  # Default device placement if not distributed.
+        self.worker_device = None
+        if self.task_type is not None:
+            self.create_cluster()
+            if self.task_type == C.TASK_PS:
+                # A parameter server only hosts variables. See `run`.
+                return
+
         # Create a session object and initialize parameters.
-        gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.95, allow_growth=True)
-        self.session = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options, allow_soft_placement=True))
+        if self.server is None:
+            self.session = tf.Session(config=get_session_config(config))
+        else:
+            # Workers communicate with the parameter servers only.
+            device_filters = ["/job:" + C.TASK_PS, "/job:{}/task:{}".format(C.TASK_WORKER, self.task_index)]
+            self.session = tf.Session(target=self.server.target, config=get_session_config(config, device_filters=device_filters))
         # Create step counter (used by optimization routine and schedulers.)
 
         # with tf.variable_scope("global_step"):
-        self.global_step = tf.Variable(1, trainable=False, name='global_step')
+        with tf.device(self.device_setter):
+            self.global_step = tf.Variable(1, trainable=False, name='global_step')
+            # Set by the chief when the training ends. It is not stored in checkpoints.
+            self.stop_training = tf.Variable(False, trainable=False, name='stop_training') if self.server is not None else None
 
         # TODO learning rate scheduling
         # TODO implement a scheduler
@@ -67,38 +107,74 @@ class TrainingEngine():
 
         # Training model
         self.training_dataset, self.num_training_iterations = self.load_dataset(config.get('training_data'))
+        # Every worker iterates over its own shard.
+        self.num_training_iterations = self.num_training_iterations//self.num_workers
         print("# training steps per epoch: " + str(self.num_training_iterations))
-
-        # Validation model
-        self.apply_validation = config.get('validate_model', False)
+        # The global step is incremented once per aggregated update with synchronous replicas and once per worker update
+        # otherwise.
+        self.num_updates_per_epoch = self.num_training_iterations//self.grad_accumulation_steps
+        if not self.sync_replicas:
+            self.num_updates_per_epoch *= self.num_workers
+        assert self.num_updates_per_epoch > 0, "Not enough training samples."
+        # The global step starts from 1.
+        self.max_global_step = 1 + config.get('num_epochs')*self.num_updates_per_epoch
+        if self.grad_accumulation_steps > 1:
+            print("# updates per epoch: {} (effective batch size {})".format(self.num_training_iterations//self.grad_accumulation_steps,
+                                                                           config.get('batch_size')*self.grad_accumulation_steps))
+
+        # Validation model. Only the chief evaluates the model in distributed training.
+        self.apply_validation = config.get('validate_model', False) and self.is_chief
         if self.apply_validation:
-            self.validation_dataset, self.num_validation_iterations = self.load_dataset(config.get('validation_data'))
-            assert not (self.num_validation_iterations == 0), "Not enough validation samples."
-            print("# validation steps per epoch: " + str(self.num_validation_iterations))
+            self.validation_dataset, _ = self.load_dataset(config.get('validation_data'))
+            assert self.validation_dataset.num_samples > 0, "Not enough validation samples."
 
         # Test model
-        self.apply_test = config.get('test_model', False)
+        self.apply_test = config.get('test_model', False) and self.is_chief
         if self.apply_test:
-            self.test_dataset, self.num_test_iterations = self.load_dataset(config.get('test_data'))
-            assert not (self.num_test_iterations == 0), "Not enough test samples."
-            print("# test steps per epoch: " + str(self.num_test_iterations))
+            self.test_dataset, _ = self.load_dataset(config.get('test_data'))
+            assert self.test_dataset.num_samples > 0, "Not enough test samples."
 
     def run(self):
-        # Models in different modes (training, validation, sampling, etc.)
-        self.create_models()
-        # Gradient clipping
-        self.gradient_check()
+        if self.task_type == C.TASK_PS:
+            print("Parameter server {} is running.".format(self.task_index))
+            self.server.join()
+            return
+
+        # Variables are placed on parameter servers in distributed training.
+        with tf.device(self.device_setter):
+            # Models in different modes (training, validation, sampling, etc.)
+            self.create_models()
+            # Gradient clipping
+            self.gradient_check()
         # Tensorflow routines
         self.call_tensorflow_routines()
         # Summary writer
         self.create_summaries()
         # Save configuration in pickle and json formats.
-        self.config.dump(self.config.get('model_dir'))
+        if self.is_chief:
+            self.config.dump(self.config.get('model_dir'))
         # Main training loop.
         self.train()
         # Close input queues and stop threads.
         self.finalize_training()
 
+    def create_cluster(self):
+        """
+        Creates the cluster specification and the server of this task. Cluster members are given by comma separated
+        `ps_hosts` and `worker_hosts` lists (i.e., "host:port,host:port").
+        """
+        ps_hosts = self.config.get('ps_hosts').split(",")
+        worker_hosts = self.config.get('worker_hosts').split(",")
+        if self.task_type not in [C.TASK_PS, C.TASK_WORKER]:
+            raise Exception("Invalid task type: " + str(self.task_type))
+
+        self.num_workers = len(worker_hosts)
+        self.is_chief = self.task_type == C.TASK_WORKER and self.task_index == 0
+        cluster = tf.train.ClusterSpec({C.TASK_PS: ps_hosts, C.TASK_WORKER: worker_hosts})
+        self.server = tf.train.Server(cluster, job_name=self.task_type, task_index=self.task_index)
+        self.worker_device = "/job:{}/task:{}".format(C.TASK_WORKER, self.task_index)
+        self.device_setter = tf.train.replica_device_setter(worker_device=self.worker_device, cluster=cluster)
+
     def load_dataset(self, path):
         dataset = self.Dataset_cls(path, preprocessing_ops=self.preprocessing_ops)
         num_data_iterations = int(dataset.num_samples/self.config.get('batch_size'))
@@ -106,20 +182,21 @@ class TrainingEngine():
 
     def create_model_graph(self, dataset, mode, reuse):
         # Create a tensorflow sub-graph that loads batches of samples.
-        # (1) Create input pipeline
+        # (1) Create input pipeline. Validation and test models iterate over the full dataset once per evaluation.
         if mode == "training":
-            shuffle = True
             num_epochs = self.config.get('num_epochs')+2  # To fill queues.
+            data_feeder = DataFeederTF(dataset, num_epochs, self.config.get('batch_size'), queue_capacity=1024, shuffle=True,
+                                       shard_index=self.task_index if self.server is not None else 0, num_shards=self.num_workers)
+            data_placeholders = data_feeder.batch_queue(dynamic_pad=dataset.is_dynamic,
+                                                        queue_capacity=512,
+                                                        queue_threads=self.config.get('feeder_threads', 4))
         else:
-            shuffle = False
-            num_epochs = self.config.get('num_epochs')*(self.num_training_iterations/self.training_evaluate_every_step)+2
-
-        data_feeder = DataFeederTF(dataset, num_epochs, self.config.get('batch_size'), queue_capacity=1024, shuffle=shuffle)
-        data_placeholders = data_feeder.batch_queue(dynamic_pad=dataset.is_dynamic,
-                                                    queue_capacity=512,
-                                                    queue_threads=4)
-        # (2) Create staging area for faster data transfer to GPU memory.
-        if self.config.get('use_staging_area', False):
+            data_feeder = EvaluationDataFeederTF(dataset, self.config.get('batch_size'), num_readers=self.config.get('feeder_threads', 4))
+            data_placeholders = data_feeder.batch
+
+        # (2) Create staging area for faster data transfer to GPU memory. Preloading would consume batches of the
+        # following evaluation. Hence, it is used in training only.
+        if self.config.get('use_staging_area', False) and mode == "training":
             staging_area = TFStagingArea(data_placeholders, device_name="/gpu:0")
             data_placeholders = staging_area.tensors
         else:
@@ -142,6 +219,11 @@ class TrainingEngine():
     def create_models(self):
         self.training_model, self.training_data_feeder, self.training_staging_area = self.create_model_graph(dataset=self.training_dataset, mode='training', reuse=False)
 
+        if self.config.get('report_peak_memory', False):
+            # Peak memory of the device allocator, i.e., to compare settings such as `recompute_segment_size`. The CPU
+            # allocator doesn't collect statistics, so the peak resident set size of the process is reported as well.
+            self.training_model.register_run_ops('peak_memory', tf.contrib.memory_stats.MaxBytesInUse())
+
         # Preparing lists of objects to initialize/run later.
         self.data_feeders = [self.training_data_feeder]
         self.staging_areas = []
@@ -150,18 +232,10 @@ class TrainingEngine():
             self.training_model.register_run_ops('staging_area', self.training_staging_area.preload_op)
 
         if self.apply_validation:
-            self.validation_model, self.validation_data_feeder, self.validation_staging_area = self.create_model_graph(dataset=self.validation_dataset, mode='validation', reuse=True)
-            self.data_feeders.append(self.validation_data_feeder)
-            if self.validation_staging_area:
-                self.staging_areas.append(self.validation_staging_area)
-                self.validation_model.register_run_ops('staging_area', self.validation_staging_area.preload_op)
+            self.validation_model, self.validation_data_feeder, _ = self.create_model_graph(dataset=self.validation_dataset, mode='validation', reuse=True)
 
         if self.apply_test:
-            self.test_model, self.test_data_feeder, self.test_staging_area = self.create_model_graph(dataset=self.test_dataset, mode='test', reuse=True)
-            self.data_feeders.append(self.test_data_feeder)
-            if self.test_staging_area:
-                self.staging_areas.append(self.test_staging_area)
-                self.test_model.register_run_ops('staging_area', self.test_staging_area.preload_op)
+            self.test_model, self.test_data_feeder, _ = self.create_model_graph(dataset=self.test_dataset, mode='test', reuse=True)
 
     def create_summaries(self):
         """
@@ -189,8 +263,16 @@ class TrainingEngine():
         update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
         with tf.control_dependencies(update_ops):
             optimizer = tf.train.AdamOptimizer(self.learning_rate)
+            if self.server is not None and self.sync_replicas:
+                # Gradients of all workers are aggregated before a single update.
+                optimizer = tf.train.SyncReplicasOptimizer(optimizer,
+                                                           replicas_to_aggregate=self.num_workers,
+                                                           total_num_replicas=self.num_workers)
+            self.optimizer = optimizer
             # Gradient clipping.
             grads = tf.gradients(self.training_model.loss, tf.trainable_variables())
+            if self.grad_accumulation_steps > 1:
+                grads = self.accumulate_gradients(grads)
             if self.config.get('grad_clip_by_norm') > 0:
                 grads, global_norm = tf.clip_by_global_norm(grads, self.config.get('grad_clip_by_norm'))
                 tf.summary.scalar('training/gradient_norm', global_norm, collections=["training_status"])
@@ -204,49 +286,93 @@ class TrainingEngine():
                 self.grads_and_vars = grads_and_vars_clipped
 
             self.train_op = optimizer.apply_gradients(grads_and_vars=self.grads_and_vars, global_step=self.global_step)
+            if self.grad_accumulation_steps > 1:
+                # Clear the accumulators for the next update.
+                with tf.control_dependencies([self.train_op]):
+                    self.train_op = tf.group(*[accumulator.assign(tf.zeros_like(accumulator)) for accumulator in self.grad_accumulators])
             self.training_model.register_run_ops('train_op', self.train_op)
 
-    def call_tensorflow_routines(self):
+    def accumulate_gradients(self, grads):
         """
-        Creates and runs basic tensorflow routines such as initialization, saver, coordinator, etc.
+        Creates non-trainable accumulator variables and `accumulate_op` adding gradients of a micro-batch. Running
+        `accumulate_op` for the first (K-1) micro-batches and then `train_op` for the K-th one updates parameters with the
+        average gradient of K micro-batches. Accumulators are local variables, i.e., not shared between workers and not
+        stored in checkpoints.
 
+        Args:
+            grads (list): gradients of the micro-batch loss w.r.t. trainable variables.
+
+        Returns:
+            (list): averaged gradients after the current micro-batch is accumulated.
         """
-        init_op = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
-        self.session.run(init_op)
+        self.grad_accumulators = []
+        accumulate_ops = []
+        with tf.device(self.worker_device), tf.name_scope("gradient_accumulation"):
+            for grad, var in zip(grads, tf.trainable_variables()):
+                if grad is None:
+                    continue
+                accumulator = tf.Variable(tf.zeros(var.shape, dtype=var.dtype.base_dtype), trainable=False,
+                                          collections=[tf.GraphKeys.LOCAL_VARIABLES], name=var.op.name.replace("/", "_"))
+                self.grad_accumulators.append(accumulator)
+                accumulate_ops.append(accumulator.assign_add(tf.convert_to_tensor(grad)))
+            self.accumulate_op = tf.group(*accumulate_ops)
+
+            averaged_grads = []
+            with tf.control_dependencies([self.accumulate_op]):
+                accumulators = iter(self.grad_accumulators)
+                for grad in grads:
+                    averaged_grads.append(None if grad is None else next(accumulators).read_value()/self.grad_accumulation_steps)
+        return averaged_grads
 
-        self.run_opts = None
-        self.run_metadata = None
-        if self.config.get('create_timeline', False):
-            self.run_opts = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE, timeout_in_ms=100000)
-            self.run_metadata = tf.RunMetadata()
+    def call_tensorflow_routines(self):
+        """
+        Creates and runs basic tensorflow routines such as initialization, saver, coordinator, etc.
 
+        """
         # Create a saver for writing training checkpoints.
-        self.saver = tf.train.Saver(max_to_keep=2, save_relative_paths=True)
+        saved_variables = [var for var in tf.global_variables() if self.stop_training is None or var is not self.stop_training]
+        self.saver = tf.train.Saver(var_list=saved_variables, max_to_keep=2, save_relative_paths=True)
+        checkpoint_path = None
         if self.model_dir:
             # If model directory already exists, continue training by restoring computation graph.
-            # Restore variables.
             if self.config.get('checkpoint_id'):
                 checkpoint_path = os.path.join(self.model_dir, self.config.get('checkpoint_id'))
             else:
                 checkpoint_path = tf.train.latest_checkpoint(self.model_dir)
 
-            print("Continue training with model " + checkpoint_path)
-            self.saver.restore(self.session, checkpoint_path)
+        if self.is_chief:
+            if checkpoint_path is not None:
+                # Restore first. Otherwise the other workers could start training with the initial values.
+                print("Continue training with model " + checkpoint_path)
+                self.saver.restore(self.session, checkpoint_path)
+                uninitialized_names = set(name.decode() for name in self.session.run(tf.report_uninitialized_variables(tf.global_variables())))
+                self.session.run(tf.variables_initializer([var for var in tf.global_variables() if var.op.name in uninitialized_names]))
+            else:
+                self.session.run(tf.global_variables_initializer())
+        else:
+            # Wait until the chief initializes or restores the shared variables.
+            uninitialized_variables = tf.report_uninitialized_variables(tf.global_variables())
+            while len(self.session.run(uninitialized_variables)) > 0:
+                print("Waiting for the chief to initialize variables.")
+                time.sleep(1)
+        self.session.run(tf.local_variables_initializer())
 
-            # Estimate training epoch.
-            step = tf.train.global_step(self.session, self.global_step)
-            self.start_epoch = round(step/(self.training_dataset.num_samples/self.config.get('batch_size')))
+        self.run_opts = None
+        self.run_metadata = None
+        if self.config.get('create_timeline', False):
+            self.run_opts = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE, timeout_in_ms=100000)
+            self.run_metadata = tf.RunMetadata()
 
-        else:
+        if not self.model_dir:
             # Fresh start
-            # Create a unique output directory for this experiment.
-            model_timestamp = get_model_dir_timestamp(prefix="tf", suffix=self.config.get('experiment_name'), connector="-")
+            # Create a unique output directory for this experiment. Non-chief workers only write summaries.
+            suffix = self.config.get('experiment_name') if self.is_chief else "{}-worker{}".format(self.config.get('experiment_name'), self.task_index)
+            model_timestamp = get_model_dir_timestamp(prefix="tf", suffix=suffix, connector="-")
             self.model_id = model_timestamp
             self.config.set('model_id', model_timestamp, override=True)
             self.model_dir = os.path.abspath(os.path.join(self.config.get('save_dir'), model_timestamp))
             print("Saving to {}\n".format(self.model_dir))
             self.config.set('model_dir', self.model_dir, override=True)
-            self.start_epoch = 1
 
         # Initialize data loader threads.
         # TODO (BUG): Enqueue threads must be initialized after definition of train_op.
@@ -255,6 +381,16 @@ class TrainingEngine():
             data_feeder.init(self.session, self.coordinator)
 
         self.queue_threads = tf.train.start_queue_runners(sess=self.session, coord=self.coordinator)
+        self.release_tokens_op = None
+        if isinstance(self.optimizer, tf.train.SyncReplicasOptimizer):
+            # Local step of each worker must be set after the global step is initialized or restored.
+            self.session.run(self.optimizer.local_step_init_op)
+            if self.is_chief:
+                self.session.run(self.optimizer.get_init_tokens_op())
+                # Pushed when the chief leaves. Workers waiting for a token after their last step can then exit.
+                self.release_tokens_op = self.optimizer.get_init_tokens_op(self.num_workers)
+                chief_queue_runner = self.optimizer.get_chief_queue_runner()
+                self.queue_threads.extend(chief_queue_runner.create_threads(self.session, coord=self.coordinator, start=True))
         for data_feeder in self.data_feeders:
             self.queue_threads.append(data_feeder.enqueue_threads)
 
@@ -271,44 +407,81 @@ class TrainingEngine():
         validation_loss = np.inf
         num_steps_wo_improvement = 0
         stop_signal = False
-        for epoch in range(self.start_epoch, self.training_num_epochs):
-            if stop_signal:
-                break
-            for epoch_step in range(self.num_training_iterations):
+        # Steps passing these thresholds trigger evaluation and checkpointing. Asynchronous workers update the global
+        # step concurrently, i.e., the chief may not observe the multiples of the intervals.
+        next_evaluation_step = None
+        next_checkpoint_step = None
+        # The training ends when the global step reaches `max_global_step`. Workers observe the same global step, i.e.,
+        # they stop together regardless of the number of local steps.
+        while True:
+            if self.stop_training is not None and not self.is_chief:
+                step, stopped_by_chief = self.session.run([self.global_step, self.stop_training])
+                if stopped_by_chief:
+                    print("The chief stopped the training.")
+                    break
+            else:
                 step = tf.train.global_step(self.session, self.global_step)
-
+            if step >= self.max_global_step:
+                break
+            epoch = (step - 1)//self.num_updates_per_epoch + 1
+            if next_evaluation_step is None:
+                # The first multiple of the interval that is not smaller than the current step.
+                next_evaluation_step = -(-step//self.training_evaluate_every_step)*self.training_evaluate_every_step
+                next_checkpoint_step = -(-step//self.training_checkpoint_every_step)*self.training_checkpoint_every_step
+            evaluate_now = step >= next_evaluation_step
+            if evaluate_now:
+                next_evaluation_step = (step//self.training_evaluate_every_step + 1)*self.training_evaluate_every_step
+            checkpoint_now = step >= next_checkpoint_step
+            if checkpoint_now:
+                next_checkpoint_step = (step//self.training_checkpoint_every_step + 1)*self.training_checkpoint_every_step
+
+            try:
+                # Gradients of the last micro-batch are accumulated by the train_op before the update. Note that the
+                # reported training loss is calculated on the last micro-batch only.
+                # Every micro-batch consumes a staged batch, i.e., the staging area is refilled along with it.
+                for _ in range(self.grad_accumulation_steps - 1):
+                    self.session.run([self.accumulate_op] + [staging_area.preload_op for staging_area in self.staging_areas])
                 run_training_output = self.training_model.training_step(step, epoch, feed_dict={})
-                for summary_entry in run_training_output['summary']:
-                    self.summary_writer.add_summary(summary_entry, step)
+            except tf.errors.OutOfRangeError:
+                # A worker whose updates are dropped as stale runs more steps than the others.
+                print("Training data is exhausted.")
+                break
+            for summary_entry in run_training_output['summary']:
+                self.summary_writer.add_summary(summary_entry, step)
 
-                if self.apply_validation and step%self.training_evaluate_every_step == 0:
-                    validation_summary, validation_loss_all = self.validation_model.evaluation_step(step, epoch, self.num_validation_iterations)
-                    validation_loss = validation_loss_all['total_loss']
-                    self.summary_writer.add_summary(validation_summary, step)
+            if self.apply_validation and evaluate_now:
+                validation_summary, validation_loss_all = self.validation_model.evaluation_step(step, epoch, iterator_initializer=self.validation_data_feeder.initializer)
+                validation_loss = validation_loss_all['total_loss']
+                self.summary_writer.add_summary(validation_summary, step)
 
-                    if (best_validation_loss-validation_loss) > np.abs(best_validation_loss*improvement_ratio):
-                        num_steps_wo_improvement = 0
-                    else:
-                        num_steps_wo_improvement += 1
+                if (best_validation_loss-validation_loss) > np.abs(best_validation_loss*improvement_ratio):
+                    num_steps_wo_improvement = 0
+                else:
+                    num_steps_wo_improvement += 1
 
-                    if num_steps_wo_improvement == self.early_stopping_tolerance:
-                        stop_signal = True
-                        break
+                if num_steps_wo_improvement == self.early_stopping_tolerance:
+                    stop_signal = True
+                    break
 
-                if self.apply_test and step%self.training_evaluate_every_step == 0:
-                    test_summary, test_loss = self.test_model.evaluation_step(step, epoch, self.num_test_iterations)
-                    self.summary_writer.add_summary(test_summary, step)
+            if self.apply_test and evaluate_now:
+                test_summary, test_loss = self.test_model.evaluation_step(step, epoch, iterator_initializer=self.test_data_feeder.initializer)
+                self.summary_writer.add_summary(test_summary, step)
 
-                if self.training_create_timeline:
-                    create_tf_timeline(self.model_dir, self.run_metadata)
+            if self.training_create_timeline:
+                create_tf_timeline(self.model_dir, self.run_metadata)
 
-                if (step%self.training_checkpoint_every_step) == 0 and validation_loss <= best_validation_loss:
-                    ckpt_save_path = self.saver.save(self.session, os.path.join(self.model_dir, 'model'), self.global_step-1)
-                    print("Model save: %s"%ckpt_save_path)
-                    best_validation_loss = min(best_validation_loss, validation_loss)
+            if self.is_chief and checkpoint_now and validation_loss <= best_validation_loss:
+                ckpt_save_path = self.saver.save(self.session, os.path.join(self.model_dir, 'model'), self.global_step-1)
+                print("Model save: %s"%ckpt_save_path)
+                best_validation_loss = min(best_validation_loss, validation_loss)
 
         print("End-of-Training.")
-        if stop_signal is False and validation_loss < best_validation_loss:
+        if self.is_chief and self.stop_training is not None:
+            # The flag is set before the tokens are pushed. Otherwise a released worker could start another step.
+            self.session.run(self.stop_training.assign(True))
+            if self.release_tokens_op is not None:
+                self.session.run(self.release_tokens_op)
+        if self.is_chief and stop_signal is False and validation_loss < best_validation_loss:
             ckpt_save_path = self.saver.save(self.session, os.path.join(self.model_dir, 'model'), self.global_step)
             print("Model save: %s"%ckpt_save_path)
             print('Model is trained for %d epochs, %d steps.'%(self.config.get('num_epochs'), step))
@@ -1,5 +1,7 @@
 import time
 import os
+import sys
+import tensorflow as tf
 from tensorflow.python.client import timeline
 import numpy as np
 
@@ -95,3 +97,57 @@ def get_seq_len_histogram(sequence_length_array, num_bins=10, collapse_first_and
     else:
         return [int(b) for b in bins]
 
+
+
+def get_session_config(config, **kwargs):
+    """
+    Creates a session configuration with the CPU threading settings of the experiment configuration. Thread pool sizes
+    are set by `intra_op_parallelism_threads` and `inter_op_parallelism_threads`. If they are not set (or 0),
+    tensorflow picks them. If `cpu_cores` is given, the process is pinned to these cores. If `use_xla` is set, XLA JIT
+    compilation is enabled for the whole graph, fusing chains of small ops (i.e., convolution, gating, add and slice).
+    `global_jit_level` only clusters GPU ops. Clustering of CPU ops is enabled by the `--tf_xla_cpu_global_jit` flag in
+    `TF_XLA_FLAGS`, which tensorflow reads once per process. Hence, the configuration must be created before the first
+    session of the process.
+
+    Args:
+        config (Configuration): experiment configuration.
+        **kwargs: other tf.ConfigProto arguments.
+
+    Returns:
+        (tf.ConfigProto)
+    """
+    pin_cpu_cores(config.get('cpu_cores', None))
+    gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.95, allow_growth=True)
+    session_config = tf.ConfigProto(gpu_options=gpu_options,
+                                    allow_soft_placement=True,
+                                    intra_op_parallelism_threads=config.get('intra_op_parallelism_threads', 0) or 0,
+                                    inter_op_parallelism_threads=config.get('inter_op_parallelism_threads', 0) or 0,
+                                    **kwargs)
+    if config.get('use_xla', False):
+        session_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+        xla_flags = os.environ.get('TF_XLA_FLAGS', '')
+        if '--tf_xla_cpu_global_jit' not in xla_flags:
+            os.environ['TF_XLA_FLAGS'] = (xla_flags + ' --tf_xla_cpu_global_jit').strip()
+    return session_config
+
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of the current process in bytes. Unlike the allocator statistics of tensorflow,
+    it is also valid on CPU. Only supported on Unix.
+    """
+    import resource
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak_rss if sys.platform == 'darwin' else peak_rss*1024
+
+
+def pin_cpu_cores(cpu_cores):
+    """
+    Restricts the current process (and threads created afterwards) to the given CPU cores. Only supported on Linux.
+
+    Args:
+        cpu_cores (list): core ids. If None or empty, the affinity is not changed.
+    """
+    if cpu_cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpu_cores)